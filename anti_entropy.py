@@ -0,0 +1,200 @@
+import os
+import heapq
+import bisect
+import hashlib
+import logging
+import threading
+from sqlalchemy import func
+from app import db
+from models import Truth, TruthChange
+from change_log import OP_DELETE, latest_change_id, compacted_through, get_changes_since
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of consecutive truth IDs covered by one Merkle leaf
+MERKLE_LEAF_SIZE = int(os.environ.get('MERKLE_LEAF_SIZE', '1024'))
+
+# Leaf hashes are cached per process and refreshed from the change log
+_leaf_hashes = {}  # leaf index -> hex digest, non-empty leaves only
+_sorted_leaves = []
+_leaf_cursor = None
+_leaf_lock = threading.Lock()
+
+EMPTY_HASH = hashlib.sha256(b'').hexdigest()
+# Stands in for the content hash of a deleted truth, so deletes are compared too
+TOMBSTONE = "deleted"
+# Deepest tree level a peer may ask for: truth IDs are 64-bit
+MERKLE_MAX_LEVEL = 64
+
+def _hash_leaf_rows(rows):
+    """Hash the (id, content_hash) pairs of one leaf, ordered by id"""
+    digest = hashlib.sha256()
+    for truth_id, content_hash in rows:
+        digest.update(f"{truth_id}:{content_hash};".encode('utf-8'))
+    return digest.hexdigest()
+
+def _tombstones(low=None, high=None):
+    """Query the IDs in [low, high) that have a delete in the change log and no live row"""
+    live = db.session.query(Truth.id).filter(Truth.id == TruthChange.truth_id)
+    query = db.session.query(TruthChange.truth_id).filter(TruthChange.op == OP_DELETE, ~live.exists())
+    if low is not None:
+        query = query.filter(TruthChange.truth_id >= low, TruthChange.truth_id < high)
+    return query.distinct().order_by(TruthChange.truth_id)
+
+def _leaf_rows(leaf):
+    """Load the (id, content_hash) pairs of one leaf from the database, tombstones included"""
+    low = leaf * MERKLE_LEAF_SIZE
+    rows = (db.session.query(Truth.id, Truth.content_hash, Truth.content)
+            .filter(Truth.id >= low, Truth.id < low + MERKLE_LEAF_SIZE)
+            .order_by(Truth.id)
+            .all())
+    live = [(truth_id, content_hash or Truth.hash_content(content))
+            for truth_id, content_hash, content in rows]
+    deleted = [(truth_id, TOMBSTONE) for truth_id, in _tombstones(low, low + MERKLE_LEAF_SIZE)]
+    return list(heapq.merge(live, deleted))
+
+def _rebuild_leaf_hashes():
+    """Hash every leaf with a single pass over the truth table and the logged deletes"""
+    global _leaf_hashes
+
+    leaves = {}
+    query = (db.session.query(Truth.id, Truth.content_hash)
+             .order_by(Truth.id)
+             .execution_options(yield_per=5000))
+    live = ((truth_id, content_hash) for truth_id, content_hash in query)
+    deleted = ((truth_id, TOMBSTONE) for truth_id, in _tombstones().execution_options(yield_per=5000))
+    current_leaf = None
+    current_rows = []
+    for truth_id, content_hash in heapq.merge(live, deleted):
+        if content_hash is None:
+            # Rows written before content hashes existed; skip one deleted since the scan began
+            truth = db.session.get(Truth, truth_id)
+            if truth is None:
+                continue
+            content_hash = Truth.hash_content(truth.content)
+        leaf = truth_id // MERKLE_LEAF_SIZE
+        if leaf != current_leaf and current_rows:
+            leaves[current_leaf] = _hash_leaf_rows(current_rows)
+            current_rows = []
+        current_leaf = leaf
+        current_rows.append((truth_id, content_hash))
+    if current_rows:
+        leaves[current_leaf] = _hash_leaf_rows(current_rows)
+
+    _leaf_hashes = leaves
+    logger.info(f"Rebuilt Merkle leaf hashes: {len(leaves)} non-empty leaves")
+
+def _rehash_leaf(leaf):
+    """Recompute one leaf after its truths changed"""
+    rows = _leaf_rows(leaf)
+    if rows:
+        _leaf_hashes[leaf] = _hash_leaf_rows(rows)
+    else:
+        _leaf_hashes.pop(leaf, None)
+
+def refresh_leaf_hashes():
+    """Bring the cached leaf hashes up to date with the change log"""
+    global _leaf_cursor, _sorted_leaves
+
+    with _leaf_lock:
+        head = latest_change_id()
+        if _leaf_cursor is None or _leaf_cursor < compacted_through() or _leaf_cursor > head:
+            _rebuild_leaf_hashes()
+        elif head > _leaf_cursor:
+            # Only the leaves touched since the last refresh are rehashed
+            dirty = set()
+            cursor = _leaf_cursor
+            while cursor < head:
+                changes = get_changes_since(cursor, 5000)
+                if not changes:
+                    break
+                dirty.update(change.truth_id // MERKLE_LEAF_SIZE for change in changes)
+                cursor = changes[-1].id
+            for leaf in dirty:
+                _rehash_leaf(leaf)
+        else:
+            return
+        _leaf_cursor = head
+        _sorted_leaves = sorted(_leaf_hashes)
+
+def local_leaf_count():
+    """Return the number of leaves (a power of two) needed to cover local IDs"""
+    if not _sorted_leaves:
+        return 1
+    count = 1
+    while count <= _sorted_leaves[-1]:
+        count *= 2
+    return count
+
+def _subtree_is_empty(level, index):
+    """Check whether no local leaf falls under the given tree node"""
+    low = index << level
+    high = (index + 1) << level
+    position = bisect.bisect_left(_sorted_leaves, low)
+    return position >= len(_sorted_leaves) or _sorted_leaves[position] >= high
+
+def _node_hash(level, index, empty_hashes, memo):
+    """Hash of the tree node covering leaves [index << level, (index + 1) << level)"""
+    key = (level, index)
+    if key in memo:
+        return memo[key]
+    if _subtree_is_empty(level, index):
+        value = empty_hashes[level]
+    elif level == 0:
+        value = _leaf_hashes[index]
+    else:
+        left = _node_hash(level - 1, index * 2, empty_hashes, memo)
+        right = _node_hash(level - 1, index * 2 + 1, empty_hashes, memo)
+        value = hashlib.sha256((left + right).encode('utf-8')).hexdigest()
+    memo[key] = value
+    return value
+
+def get_node_hashes(nodes):
+    """Return hashes for a list of (level, index) tree nodes
+
+    Raises ValueError for a node outside the tree of 64-bit IDs.
+    """
+    for level, index in nodes:
+        if not 0 <= level <= MERKLE_MAX_LEVEL or not 0 <= index < 2 ** (MERKLE_MAX_LEVEL - level):
+            raise ValueError(f"No Merkle tree node at level {level}, index {index}")
+    refresh_leaf_hashes()
+
+    max_level = max([level for level, _ in nodes], default=0)
+    empty_hashes = [EMPTY_HASH]
+    for _ in range(max_level):
+        previous = empty_hashes[-1]
+        empty_hashes.append(hashlib.sha256((previous + previous).encode('utf-8')).hexdigest())
+
+    memo = {}
+    return [_node_hash(level, index, empty_hashes, memo) for level, index in nodes]
+
+def tree_height(leaf_count):
+    """Return the root level of a tree with the given number of leaves"""
+    return max(leaf_count - 1, 0).bit_length()
+
+def truths_in_leaves(leaves):
+    """Return all truths whose IDs fall in the given leaves"""
+    truths = []
+    for leaf in sorted(set(leaves)):
+        low = leaf * MERKLE_LEAF_SIZE
+        truths.extend(Truth.query
+                      .filter(Truth.id >= low, Truth.id < low + MERKLE_LEAF_SIZE)
+                      .order_by(Truth.id)
+                      .all())
+    return truths
+
+def tombstones_in_leaves(leaves):
+    """Return the deleted truths whose IDs fall in the given leaves, with when they were deleted"""
+    tombstones = []
+    for leaf in sorted(set(leaves)):
+        low = leaf * MERKLE_LEAF_SIZE
+        ids = _tombstones(low, low + MERKLE_LEAF_SIZE).subquery()
+        latest = (db.session.query(func.max(TruthChange.id))
+                  .filter(TruthChange.op == OP_DELETE, TruthChange.truth_id.in_(db.select(ids.c.truth_id)))
+                  .group_by(TruthChange.truth_id))
+        tombstones.extend(TruthChange.query
+                          .filter(TruthChange.id.in_(latest))
+                          .order_by(TruthChange.truth_id)
+                          .all())
+    return tombstones
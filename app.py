@@ -2,8 +2,10 @@ import os
 import logging
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate, upgrade, stamp
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from db_profile import normalize_database_url, engine_options
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -21,16 +23,45 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev_key_for_testing")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///zion_steward.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+# Postgres gets a per-worker pool and statement timeouts (see db_profile)
+database_url = normalize_database_url(os.environ.get("DATABASE_URL", "sqlite:///zion_steward.db"))
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize database
 db.init_app(app)
 
+# Schema changes are applied with Alembic migrations (flask db upgrade)
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+migrate = Migrate(app, db, directory=MIGRATIONS_DIR)
+# Set to false when migrations are run as a separate deploy step
+DB_AUTO_MIGRATE = os.environ.get("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+def upgrade_database():
+    """Apply pending migrations, stamping databases created by db.create_all() at the baseline first"""
+    import fcntl
+    from sqlalchemy import inspect
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'migrate.lock'), 'w') as lock_file:
+        # Workers start together; only one of them migrates at a time
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        tables = inspect(db.engine).get_table_names()
+        if 'truth' in tables and 'alembic_version' not in tables:
+            logger.info("Stamping existing database at the baseline migration")
+            stamp(directory=MIGRATIONS_DIR, revision='0001_baseline')
+        upgrade(directory=MIGRATIONS_DIR)
+
+def schema_is_current():
+    """Whether the database has every migration applied"""
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    with db.engine.connect() as connection:
+        applied = set(MigrationContext.configure(connection).get_current_heads())
+    return applied == set(ScriptDirectory(MIGRATIONS_DIR).get_heads())
+
 # Import components after app creation to avoid circular imports
 from twilio_integration import twilio_bp
 from llm_handler import llm_bp
@@ -45,11 +76,12 @@ app.register_blueprint(truth_bp)
 app.register_blueprint(upgrader_bp)
 app.register_blueprint(replication_bp)
 
-# Create database tables
+# Bring the database schema up to date
 with app.app_context():
     import models
-    db.create_all()
-    logger.info("Database tables created")
+    if DB_AUTO_MIGRATE:
+        upgrade_database()
+        logger.info("Database schema is up to date")
 
 # Routes
 @app.route('/')
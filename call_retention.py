@@ -0,0 +1,335 @@
+import os
+import json
+import gzip
+import time
+import fcntl
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import app, db, schema_is_current
+from models import CallLog, CallDailyRollup, CallTurn
+from db_writer import run_write
+from db_profile import stream_query
+from voice_pipeline import classify_intent, search_terms_for
+from voice_analytics import prune_voice_turns
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Call logs older than this are moved out of the hot table into archive segments
+CALL_LOG_RETENTION_DAYS = int(os.environ.get('CALL_LOG_RETENTION_DAYS', '30'))
+# Archive segments older than this are deleted; 0 keeps them forever
+CALL_ARCHIVE_RETENTION_DAYS = int(os.environ.get('CALL_ARCHIVE_RETENTION_DAYS', '0'))
+CALL_ARCHIVE_DIR = os.environ.get('CALL_ARCHIVE_DIR', os.path.join(app.instance_path, 'call_archive'))
+# Rows per archive segment
+CALL_ARCHIVE_BATCH_ROWS = int(os.environ.get('CALL_ARCHIVE_BATCH_ROWS', '5000'))
+# A day is rolled up once it has been over this long, so late transcripts count
+CALL_ROLLUP_GRACE_MINUTES = int(os.environ.get('CALL_ROLLUP_GRACE_MINUTES', '60'))
+# Search terms kept per daily rollup
+CALL_ROLLUP_TOP_QUERIES = int(os.environ.get('CALL_ROLLUP_TOP_QUERIES', '20'))
+# How often each worker's retention thread runs a pass; 0 only runs on request
+CALL_RETENTION_INTERVAL_SECONDS = float(os.environ.get('CALL_RETENTION_INTERVAL_SECONDS', '3600'))
+# How often a scheduler started before the migrations ran checks for them
+CALL_RETENTION_SCHEMA_WAIT_SECONDS = float(os.environ.get('CALL_RETENTION_SCHEMA_WAIT_SECONDS', '60'))
+
+SEGMENT_PREFIX = "call-log-"
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+# State of the retention thread in this worker
+_retention_thread = None
+_retention_lock = threading.Lock()
+_wake = threading.Event()
+_last_run = {"state": "idle"}
+
+def _day_bounds(day):
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def compute_rollup(day):
+    """Aggregate the hot table's calls for one UTC day into rollup values"""
+    start, end = _day_bounds(day)
+    query = (db.session.query(CallLog.call_duration, CallLog.transcript)
+             .filter(CallLog.created_at >= start, CallLog.created_at < end))
+    calls = transcribed = duration_total = duration_calls = 0
+    intents, queries = Counter(), Counter()
+    for duration, transcript in stream_query(query):
+        calls += 1
+        if duration is not None:
+            duration_total += duration
+            duration_calls += 1
+        intent = classify_intent(transcript)
+        intents[intent] += 1
+        if intent != "none":
+            transcribed += 1
+        if intent == "question":
+            terms = search_terms_for(transcript)
+            if terms:
+                queries[terms] += 1
+    return {
+        "day": day,
+        "calls": calls,
+        "transcribed": transcribed,
+        "duration_total": duration_total,
+        "duration_calls": duration_calls,
+        "intents": dict(intents),
+        "top_queries": [list(item) for item in queries.most_common(CALL_ROLLUP_TOP_QUERIES)],
+    }
+
+def _store_rollup(values):
+    """Stage the rollup row for a day, replacing any earlier one"""
+    rollup = CallDailyRollup.query.filter_by(day=values["day"]).first()
+    if not rollup:
+        rollup = CallDailyRollup(day=values["day"])
+        db.session.add(rollup)
+    rollup.calls = values["calls"]
+    rollup.transcribed = values["transcribed"]
+    rollup.duration_total = values["duration_total"]
+    rollup.duration_calls = values["duration_calls"]
+    rollup.intents = json.dumps(values["intents"])
+    rollup.top_queries = json.dumps(values["top_queries"])
+
+def _first_unrolled_day():
+    """The day after the last rollup, or the oldest call's day when there are none"""
+    last_day = db.session.query(func.max(CallDailyRollup.day)).scalar()
+    if last_day:
+        return last_day + timedelta(days=1)
+    oldest = db.session.query(func.min(CallLog.created_at)).scalar()
+    return oldest.date() if oldest else None
+
+def roll_up_finished_days(now=None):
+    """Roll up every day that ended more than the grace period ago; returns days rolled up"""
+    now = now or datetime.utcnow()
+    day = _first_unrolled_day()
+    rolled = 0
+    while day and _day_bounds(day)[1] + timedelta(minutes=CALL_ROLLUP_GRACE_MINUTES) <= now:
+        run_write(_store_rollup, compute_rollup(day))
+        rolled += 1
+        day += timedelta(days=1)
+    return rolled
+
+def _delete_call_logs(log_ids, call_sids):
+    CallTurn.query.filter(CallTurn.call_sid.in_(call_sids)).delete(synchronize_session=False)
+    CallLog.query.filter(CallLog.id.in_(log_ids)).delete(synchronize_session=False)
+
+def _archive_records(logs):
+    """Call log rows with their conversation turns attached"""
+    turns = {}
+    call_sids = [log.twilio_sid for log in logs if log.twilio_sid]
+    for turn in CallTurn.query.filter(CallTurn.call_sid.in_(call_sids)).order_by(CallTurn.turn_index):
+        turns.setdefault(turn.call_sid, []).append(turn.to_dict())
+    return [{**log.to_dict(), "turns": turns.get(log.twilio_sid, [])} for log in logs]
+
+def _write_segment(logs):
+    """Write call logs and their turns to a gzipped NDJSON segment; returns its path
+
+    The name comes from the first row, so a pass retried after a crash
+    rewrites the same segment instead of archiving rows twice.
+    """
+    os.makedirs(CALL_ARCHIVE_DIR, exist_ok=True)
+    first = logs[0]
+    path = os.path.join(CALL_ARCHIVE_DIR,
+                        f"{SEGMENT_PREFIX}{first.created_at:%Y%m%d}-{first.id}{SEGMENT_SUFFIX}")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as segment:
+            for record in _archive_records(logs):
+                segment.write((json.dumps(record) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+def archive_old_call_logs(now=None):
+    """Move call logs past the retention age into archive segments; returns rows archived"""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=max(CALL_LOG_RETENTION_DAYS, 1))
+    # Never archive a day before it has been rolled up
+    first_unrolled = _first_unrolled_day()
+    if first_unrolled:
+        cutoff = min(cutoff, _day_bounds(first_unrolled)[0])
+
+    archived = 0
+    while True:
+        logs = (CallLog.query.filter(CallLog.created_at < cutoff)
+                .order_by(CallLog.created_at, CallLog.id).limit(CALL_ARCHIVE_BATCH_ROWS).all())
+        if not logs:
+            break
+        path = _write_segment(logs)
+        run_write(_delete_call_logs, [log.id for log in logs], [log.twilio_sid for log in logs if log.twilio_sid])
+        archived += len(logs)
+        logger.info(f"Archived {len(logs)} call logs to {os.path.basename(path)}")
+        # Start the next batch from a fresh transaction
+        db.session.remove()
+    return archived
+
+def _segment_day(filename):
+    return datetime.strptime(filename[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 8], '%Y%m%d').date()
+
+def archive_segments():
+    """Return the archive segment file names, oldest first"""
+    if not os.path.isdir(CALL_ARCHIVE_DIR):
+        return []
+    return sorted(name for name in os.listdir(CALL_ARCHIVE_DIR)
+                  if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+def prune_archive(now=None):
+    """Delete archive segments past CALL_ARCHIVE_RETENTION_DAYS; returns segments deleted"""
+    if CALL_ARCHIVE_RETENTION_DAYS <= 0:
+        return 0
+    oldest_kept = (now or datetime.utcnow()).date() - timedelta(days=CALL_ARCHIVE_RETENTION_DAYS)
+    pruned = 0
+    for name in archive_segments():
+        if _segment_day(name) < oldest_kept:
+            os.remove(os.path.join(CALL_ARCHIVE_DIR, name))
+            pruned += 1
+    return pruned
+
+def run_retention(now=None):
+    """One retention pass: roll up finished days, archive old rows, prune old segments and voice turns
+
+    Only one process runs a pass at a time; others skip it.
+    """
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'call_retention.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        started = time.time()
+        result = {
+            "rolled_up_days": roll_up_finished_days(now),
+            "archived": archive_old_call_logs(now),
+            "segments_pruned": prune_archive(now),
+            "voice_turns_pruned": prune_voice_turns(now),
+        }
+        result["seconds"] = round(time.time() - started, 2)
+        logger.info(f"Call retention pass: {result}")
+        return result
+
+def _retention_loop():
+    with app.app_context():
+        while True:
+            try:
+                ready = schema_is_current()
+            except Exception as e:
+                logger.error(f"Could not check the database schema: {e}")
+                ready = False
+            if not ready:
+                # Deploys that migrate as a separate step may start serving first
+                _last_run.update({"state": "waiting for migrations"})
+                _wake.wait(CALL_RETENTION_SCHEMA_WAIT_SECONDS)
+                _wake.clear()
+                continue
+            _last_run.update({"state": "running", "started_at": datetime.utcnow().isoformat()})
+            try:
+                result = run_retention()
+                _last_run.clear()
+                _last_run.update({"state": "skipped"} if result is None else {"state": "finished", **result})
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Call retention pass failed: {e}")
+                _last_run.update({"state": "failed", "error": str(e)})
+            finally:
+                db.session.remove()
+            _last_run["finished_at"] = datetime.utcnow().isoformat()
+            _wake.wait(CALL_RETENTION_INTERVAL_SECONDS if CALL_RETENTION_INTERVAL_SECONDS > 0 else None)
+            _wake.clear()
+
+def _ensure_retention_thread():
+    """Start the retention thread in this process if it is not running; returns True if started"""
+    global _retention_thread
+    with _retention_lock:
+        if _retention_thread is not None and _retention_thread.is_alive():
+            return False
+        _retention_thread = threading.Thread(target=_retention_loop, name="call-retention", daemon=True)
+        _retention_thread.start()
+        return True
+
+def start_retention_scheduler():
+    """Run retention passes in the background every CALL_RETENTION_INTERVAL_SECONDS"""
+    if CALL_RETENTION_INTERVAL_SECONDS > 0:
+        _ensure_retention_thread()
+
+def request_retention_run():
+    """Run a retention pass now in the background; returns False if one is already running"""
+    if _last_run.get("state") == "running":
+        return False
+    if not _ensure_retention_thread():
+        _wake.set()
+    return True
+
+def retention_status():
+    """Return the retention thresholds, the archive's size and this worker's last pass"""
+    segments = archive_segments()
+    return {
+        "retention_days": CALL_LOG_RETENTION_DAYS,
+        "archive_retention_days": CALL_ARCHIVE_RETENTION_DAYS,
+        "interval_seconds": CALL_RETENTION_INTERVAL_SECONDS,
+        "hot_rows": db.session.query(func.count(CallLog.id)).scalar(),
+        "rolled_up_days": db.session.query(func.count(CallDailyRollup.id)).scalar(),
+        "archive": {
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(os.path.join(CALL_ARCHIVE_DIR, name)) for name in segments),
+            "oldest": segments[0] if segments else None,
+        },
+        "last_run": dict(_last_run),
+    }
+
+def _rollup_dict(values):
+    duration_calls = values["duration_calls"]
+    return {
+        "day": values["day"].isoformat(),
+        "calls": values["calls"],
+        "transcribed": values["transcribed"],
+        "average_duration": round(values["duration_total"] / duration_calls, 1) if duration_calls else None,
+        "intents": values["intents"],
+        "top_queries": values["top_queries"],
+    }
+
+def call_stats(days=7):
+    """Dashboard call statistics from the daily rollups
+
+    Totals sum the rollup table; days in the window not rolled up yet (today,
+    usually) are aggregated live from their own range of the hot table.
+    """
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+    rollups = {r.day: {
+        "day": r.day, "calls": r.calls, "transcribed": r.transcribed,
+        "duration_total": r.duration_total, "duration_calls": r.duration_calls,
+        "intents": r.get_intents(), "top_queries": r.get_top_queries(),
+    } for r in CallDailyRollup.query.filter(CallDailyRollup.day >= since).all()}
+
+    totals = db.session.query(
+        func.coalesce(func.sum(CallDailyRollup.calls), 0),
+        func.coalesce(func.sum(CallDailyRollup.transcribed), 0),
+        func.coalesce(func.sum(CallDailyRollup.duration_total), 0),
+        func.coalesce(func.sum(CallDailyRollup.duration_calls), 0),
+    ).one()
+    calls, transcribed, duration_total, duration_calls = (int(v) for v in totals)
+
+    first_unrolled = _first_unrolled_day() or today
+    for offset in range((today - max(first_unrolled, since)).days + 1):
+        day = max(first_unrolled, since) + timedelta(days=offset)
+        values = rollups[day] = compute_rollup(day)
+        calls += values["calls"]
+        transcribed += values["transcribed"]
+        duration_total += values["duration_total"]
+        duration_calls += values["duration_calls"]
+
+    intents, queries = Counter(), Counter()
+    for values in rollups.values():
+        intents.update(values["intents"])
+        queries.update({terms: count for terms, count in values["top_queries"]})
+    return {
+        "totals": {
+            "calls": calls,
+            "transcribed": transcribed,
+            "average_duration": round(duration_total / duration_calls, 1) if duration_calls else None,
+        },
+        "days": [_rollup_dict(rollups[day]) for day in sorted(rollups)],
+        "intents": dict(intents),
+        "top_queries": [list(item) for item in queries.most_common(CALL_ROLLUP_TOP_QUERIES)],
+    }
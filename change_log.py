@@ -0,0 +1,132 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from models import TruthChange, ReplicationNode, Setting
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Operation names stored in the change log
+OP_INSERT = "insert"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+# Only the truth's topics changed, e.g. a clustering job moved it to another cluster
+OP_RETAG = "retag"
+
+COMPACTED_THROUGH_KEY = "change_log_compacted_through"
+
+# Days a delete stays in the log after every node consumed it. Anti-entropy
+# compares these tombstones, so a peer out of contact for longer than this may
+# bring back a truth that was deleted here.
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+
+def record_truth_change(truth, op):
+    """Append a change entry for a truth mutation to the current session
+
+    The entry is committed together with the mutation itself, so the log never
+    drifts from the truth table.
+    """
+    if truth.id is None:
+        # Inserts need their primary key before they can be logged
+        db.session.flush()
+
+    payload = None
+    if op == OP_DELETE:
+        # Keep enough of the row to let replicas match it after it is gone
+        payload = json.dumps({"content": truth.content, "source": truth.source, "uid": truth.uid})
+
+    change = TruthChange(truth_id=truth.id, op=op, payload=payload)
+    db.session.add(change)
+    return change
+
+def record_delete(truth_id, content=None, source=None, uid=None):
+    """Log the delete of a truth this node does not hold, keeping its tombstone"""
+    change = TruthChange(truth_id=truth_id, op=OP_DELETE,
+                         payload=json.dumps({"content": content, "source": source, "uid": uid}))
+    db.session.add(change)
+    return change
+
+def latest_change_id():
+    """Return the newest sequence number in the change log (0 if empty)"""
+    return db.session.query(func.max(TruthChange.id)).scalar() or 0
+
+def compacted_through():
+    """Return the sequence up to which the log has been compacted
+
+    Readers whose own cursor is below this value may have missed deletes and
+    must rebuild from the truth table instead of tailing the log.
+    """
+    setting = Setting.query.filter_by(key=COMPACTED_THROUGH_KEY).first()
+    return int(setting.value) if setting else 0
+
+def mark_compacted_through(sequence):
+    """Stage a raise of the compacted-through sequence; it never moves back"""
+    setting = Setting.query.filter_by(key=COMPACTED_THROUGH_KEY).first()
+    if setting:
+        setting.value = str(max(int(setting.value), sequence))
+    else:
+        db.session.add(Setting(
+            key=COMPACTED_THROUGH_KEY,
+            value=str(sequence),
+            description="Change log sequence up to which entries have been compacted"
+        ))
+
+def get_changes_since(cursor, limit=1000):
+    """Return up to `limit` change entries after `cursor`, oldest first"""
+    return (TruthChange.query
+            .filter(TruthChange.id > cursor)
+            .order_by(TruthChange.id)
+            .limit(limit)
+            .all())
+
+def collapse_changes(changes):
+    """Reduce a run of change entries to the latest entry per truth"""
+    latest = {}
+    for change in changes:
+        latest[change.truth_id] = change
+    return latest
+
+def compact_change_log():
+    """Stage a compaction of the change log; run it with run_write
+
+    Entries every node has already consumed are collapsed to the latest entry
+    per truth, and delete entries below every node's cursor are dropped once
+    they are older than TOMBSTONE_RETENTION_DAYS. Nodes that are still behind,
+    including nodes that have not pulled at all, keep receiving a complete
+    picture of each truth.
+    """
+    min_cursor = db.session.query(func.min(func.coalesce(ReplicationNode.last_change_id, 0))).scalar() or 0
+    if min_cursor <= 0:
+        logger.info("No change log entries consumed by every node yet; nothing to compact")
+        return 0
+
+    # Latest entry per truth within the consumed range
+    latest_per_truth = (db.session.query(func.max(TruthChange.id))
+                        .filter(TruthChange.id <= min_cursor)
+                        .group_by(TruthChange.truth_id))
+
+    superseded = (TruthChange.query
+                  .filter(TruthChange.id <= min_cursor)
+                  .filter(TruthChange.id.notin_(latest_per_truth))
+                  .delete(synchronize_session=False))
+
+    # Consumed deletes are kept as tombstones for anti-entropy until they
+    # expire. The newest entry is kept so the sequence never restarts below a
+    # node cursor.
+    newest_id = latest_change_id()
+    expired_before = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    consumed_deletes = (TruthChange.query
+                        .filter(TruthChange.id <= min_cursor)
+                        .filter(TruthChange.id < newest_id)
+                        .filter(TruthChange.op == OP_DELETE)
+                        .filter(TruthChange.created_at < expired_before)
+                        .delete(synchronize_session=False))
+
+    mark_compacted_through(min_cursor)
+
+    removed = superseded + consumed_deletes
+    logger.info(f"Compacted change log up to sequence {min_cursor}: removed {removed} entries")
+    return removed
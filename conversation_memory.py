@@ -0,0 +1,239 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import CallTurn
+from db_writer import run_write
+from config import MODEL_MAX_LENGTH
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Recent turns kept word for word per call; older ones are folded into a summary
+CALL_MEMORY_TURNS = int(os.environ.get('CALL_MEMORY_TURNS', '6'))
+# Older turns remembered as one short summary line each
+CALL_MEMORY_SUMMARY_TURNS = int(os.environ.get('CALL_MEMORY_SUMMARY_TURNS', '12'))
+# Calls held in memory at once, and how long an idle call stays there
+CALL_MEMORY_MAX_CALLS = int(os.environ.get('CALL_MEMORY_MAX_CALLS', '1000'))
+CALL_MEMORY_IDLE_SECONDS = float(os.environ.get('CALL_MEMORY_IDLE_SECONDS', '1800'))
+# Longest transcript or reply kept in memory per turn
+CALL_MEMORY_TURN_CHARS = int(os.environ.get('CALL_MEMORY_TURN_CHARS', '600'))
+# Tokens of MODEL_MAX_LENGTH left free for the generated reply
+CALL_MEMORY_RESPONSE_TOKENS = int(os.environ.get('CALL_MEMORY_RESPONSE_TOKENS', '128'))
+
+SUMMARY_WORDS = 12
+# Attempts at storing a turn when another worker took the same turn index
+STORE_TURN_ATTEMPTS = 3
+
+# Sessions by call SID, least recently used first
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def count_tokens(text):
+    """Tokens in text: the loaded model's tokenizer if any, else about four characters per token"""
+    from llm_handler import tokenizer
+    if not text:
+        return 0
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return math.ceil(len(text) / 4)
+
+def _clip(text, limit=CALL_MEMORY_TURN_CHARS):
+    if text and len(text) > limit:
+        return text[:limit].rsplit(' ', 1)[0] + '...'
+    return text
+
+def _summary_line(turn):
+    """One short line standing in for a turn that has left the recent window"""
+    if turn["intent"] == "question" and turn["search_terms"]:
+        return f"Caller asked about {turn['search_terms']}."
+    transcript = turn["transcript"] or ''
+    if turn["intent"] == "store":
+        # Drop the "store this truth:" command before the truth itself
+        transcript = transcript.split(':', 1)[-1]
+    words = transcript.split()
+    text = ' '.join(words[:SUMMARY_WORDS]) + ('...' if len(words) > SUMMARY_WORDS else '')
+    if turn["intent"] == "store":
+        return f"Caller stored a truth: {text}"
+    return f"Caller said: {text}"
+
+class CallSession:
+    """Bounded conversation memory for one call
+
+    The last CALL_MEMORY_TURNS turns are kept whole; each older turn is
+    reduced to a summary line, and only the newest CALL_MEMORY_SUMMARY_TURNS
+    lines are kept, so memory stays the same however long the call runs.
+    """
+
+    def __init__(self, call_sid):
+        self.call_sid = call_sid
+        self.turns = deque()
+        self.summary = deque(maxlen=CALL_MEMORY_SUMMARY_TURNS)
+        self.turn_count = 0
+        self.last_search_terms = None
+        self.last_used = time.monotonic()
+
+    def add(self, turn):
+        self.turns.append(turn)
+        self.turn_count = max(self.turn_count, turn["turn_index"])
+        if turn["intent"] == "question" and turn["search_terms"]:
+            self.last_search_terms = turn["search_terms"]
+        while len(self.turns) > CALL_MEMORY_TURNS:
+            self.summary.append(_summary_line(self.turns.popleft()))
+
+    def has_said(self, reply):
+        """Whether the reply was given in one of the recent turns"""
+        reply = _clip(reply)
+        return any(turn["response"] == reply for turn in self.turns)
+
+    def context(self, budget_tokens):
+        """Summary and recent turns as prompt lines, newest kept first, within budget_tokens"""
+        lines = []
+        for turn in reversed(self.turns):
+            exchange = [f"Caller: {turn['transcript']}"]
+            if turn["response"]:
+                exchange.append(f"Steward: {turn['response']}")
+            cost = sum(count_tokens(line) + 1 for line in exchange)
+            if cost > budget_tokens:
+                break
+            lines = exchange + lines
+            budget_tokens -= cost
+        else:
+            # Every recent turn fitted; add as much of the summary as still fits
+            summary = []
+            for line in reversed(self.summary):
+                cost = count_tokens(line) + 1
+                if cost > budget_tokens:
+                    break
+                summary.insert(0, line)
+                budget_tokens -= cost
+            if summary:
+                lines = ["Earlier in this call: " + ' '.join(summary)] + lines
+        return lines
+
+    def to_dict(self):
+        return {
+            "call_sid": self.call_sid,
+            "turn_count": self.turn_count,
+            "summary": list(self.summary),
+            "recent_turns": list(self.turns),
+        }
+
+def _load_session(call_sid):
+    """Rebuild a call's session from its newest stored turns, e.g. after another worker took the earlier ones"""
+    session = CallSession(call_sid)
+    rows = (CallTurn.query.filter_by(call_sid=call_sid)
+            .order_by(CallTurn.turn_index.desc())
+            .limit(CALL_MEMORY_TURNS + CALL_MEMORY_SUMMARY_TURNS).all())
+    for row in reversed(rows):
+        session.add({
+            "turn_index": row.turn_index,
+            "transcript": _clip(row.transcript),
+            "response": _clip(row.response),
+            "intent": row.intent,
+            "search_terms": row.search_terms,
+        })
+    return session
+
+def get_session(call_sid):
+    """Return the call's session, loading it from the database when this worker has not seen the call"""
+    with _sessions_lock:
+        session = _sessions.get(call_sid)
+        if session:
+            _sessions.move_to_end(call_sid)
+            session.last_used = time.monotonic()
+            return session
+    session = _load_session(call_sid)
+    with _sessions_lock:
+        session = _sessions.setdefault(call_sid, session)
+        _evict()
+    return session
+
+def _evict():
+    """Drop idle sessions and, past CALL_MEMORY_MAX_CALLS, the least recently used"""
+    now = time.monotonic()
+    while _sessions:
+        call_sid, oldest = next(iter(_sessions.items()))
+        if len(_sessions) <= CALL_MEMORY_MAX_CALLS and now - oldest.last_used < CALL_MEMORY_IDLE_SECONDS:
+            break
+        del _sessions[call_sid]
+
+def end_session(call_sid):
+    """Forget a finished call in this worker; its turns stay in the database"""
+    with _sessions_lock:
+        _sessions.pop(call_sid, None)
+
+def _store_turn(call_sid, transcript, response, intent, search_terms):
+    """Stage a turn after the newest one stored for the call; returns its turn index"""
+    turn_index = (db.session.query(func.max(CallTurn.turn_index))
+                  .filter(CallTurn.call_sid == call_sid).scalar() or 0) + 1
+    db.session.add(CallTurn(call_sid=call_sid, turn_index=turn_index, transcript=transcript,
+                            response=response, intent=intent, search_terms=search_terms))
+    return turn_index
+
+def remember_turn(call_sid, transcript, response, intent, search_terms=None):
+    """Store an answered turn and add it to the call's session
+
+    The turn index comes from the database, since earlier turns of the call
+    may have been answered by another worker; a session that missed them
+    is reloaded.
+    """
+    if not call_sid:
+        return
+    session = get_session(call_sid)
+    turn_index = None
+    for attempt in range(STORE_TURN_ATTEMPTS):
+        try:
+            turn_index = run_write(_store_turn, call_sid, transcript, response, intent, search_terms)
+            break
+        except IntegrityError:
+            # Another worker stored a turn of this call at the same moment
+            continue
+        except Exception as e:
+            logger.error(f"Error storing a turn of call {call_sid}: {e}")
+            break
+    else:
+        logger.error(f"Could not store a turn of call {call_sid} after {STORE_TURN_ATTEMPTS} attempts")
+
+    with _sessions_lock:
+        stale = turn_index is not None and turn_index > session.turn_count + 1
+        if not stale:
+            session.add({
+                "turn_index": turn_index or session.turn_count + 1,
+                "transcript": _clip(transcript),
+                "response": _clip(response),
+                "intent": intent,
+                "search_terms": search_terms,
+            })
+    if stale:
+        # Turns answered elsewhere are missing here; take them all from the database
+        session = _load_session(call_sid)
+        with _sessions_lock:
+            _sessions[call_sid] = session
+            _sessions.move_to_end(call_sid)
+
+def build_prompt(call_sid, prompt, system_prompt=None):
+    """Prompt for generation with as much of the call's conversation as fits MODEL_MAX_LENGTH
+
+    Room is kept for the system prompt, the new prompt and
+    CALL_MEMORY_RESPONSE_TOKENS of reply; the conversation fills the rest.
+    """
+    head = [system_prompt.strip()] if system_prompt else []
+    tail = [f"Caller: {prompt}", "Steward:"]
+    budget = MODEL_MAX_LENGTH - CALL_MEMORY_RESPONSE_TOKENS - sum(count_tokens(line) + 1 for line in head + tail)
+    context = get_session(call_sid).context(budget) if call_sid and budget > 0 else []
+    return '\n'.join(head + context + tail)
+
+def memory_stats():
+    with _sessions_lock:
+        return {
+            "sessions": len(_sessions),
+            "max_sessions": CALL_MEMORY_MAX_CALLS,
+            "turns_per_session": CALL_MEMORY_TURNS,
+            "summary_lines_per_session": CALL_MEMORY_SUMMARY_TURNS,
+        }
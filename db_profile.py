@@ -0,0 +1,146 @@
+import io
+import os
+import json
+import logging
+import sqlite3
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Postgres connection budget shared by every gunicorn worker on this node
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', '40'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+# Per-worker pool; defaults split the budget evenly, two thirds kept open
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '0'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '-1'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+# Server-side limits so one slow query cannot hold a connection indefinitely
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '15000'))
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.environ.get('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', '60000'))
+# SQLite profile for embedded nodes: WAL lets readers run alongside the writer
+SQLITE_WAL = os.environ.get('SQLITE_WAL', 'true').lower() == 'true'
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '65536'))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# Rows fetched per round trip when streaming large reads
+DB_STREAM_BATCH_ROWS = int(os.environ.get('DB_STREAM_BATCH_ROWS', '1000'))
+
+def normalize_database_url(url):
+    """Accept the postgres:// scheme some hosts hand out, and use psycopg2 for Postgres
+
+    bulk_insert relies on psycopg2's COPY support, and newer SQLAlchemy
+    releases default postgresql:// to a different driver.
+    """
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            return 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+def is_postgres_url(url):
+    return url.startswith('postgresql')
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLite profile to every new SQLite connection"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs at checkpoints and stays crash-safe
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def engine_options(url):
+    """Return SQLAlchemy engine options for the configured database"""
+    options = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    if not is_postgres_url(url):
+        return options
+
+    per_worker = max(DB_MAX_CONNECTIONS // max(WEB_CONCURRENCY, 1), 2)
+    pool_size = DB_POOL_SIZE or max(per_worker * 2 // 3, 1)
+    max_overflow = DB_MAX_OVERFLOW if DB_MAX_OVERFLOW >= 0 else max(per_worker - pool_size, 0)
+    options.update({
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "connect_args": {
+            "application_name": "zion-steward",
+            "options": (f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS} "
+                        f"-c idle_in_transaction_session_timeout={DB_IDLE_IN_TRANSACTION_TIMEOUT_MS}"),
+        },
+    })
+    logger.info(f"Postgres pool per worker: {pool_size} + {max_overflow} overflow "
+                f"({WEB_CONCURRENCY} workers, budget {DB_MAX_CONNECTIONS})")
+    return options
+
+def stream_query(query, batch_rows=DB_STREAM_BATCH_ROWS):
+    """Iterate over an ORM query in batches instead of loading every row
+
+    On Postgres yield_per runs the query on a server-side cursor, so memory
+    stays flat however large the table is.
+    """
+    return query.yield_per(batch_rows)
+
+def _copy_field(value):
+    """Format one value for COPY CSV: NULL unquoted, anything else quoted so text such as \\N stays text"""
+    if value is None:
+        return '\\N'
+    return '"' + str(value).replace('"', '""') + '"'
+
+def bulk_insert(session, model, rows, columns):
+    """Insert many rows of plain values into a model's table
+
+    Postgres loads them with COPY; other databases use one executemany.
+    Mapper validators and defaults do not run, so rows must be complete.
+    """
+    if not rows:
+        return 0
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(_copy_field(row.get(c)) for c in columns) + '\n')
+        buffer.seek(0)
+        table = model.__table__.name
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY "{table}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')',
+                buffer
+            )
+    else:
+        session.execute(insert(model), [{c: row.get(c) for c in columns} for row in rows])
+    return len(rows)
+
+def upsert_insert(session, model):
+    """An INSERT on the session's database that supports on_conflict_do_update()
+
+    Postgres and SQLite both have ON CONFLICT; use it for counters that
+    several workers may create at once instead of checking for the row first.
+    """
+    dialect = postgresql if session.connection().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+def stream_json_object(fields, streamed):
+    """Yield a JSON object in chunks: `fields` are dumped whole, `streamed` maps names to iterables of items"""
+    first = True
+    yield '{'
+    for name, value in fields.items():
+        yield ('' if first else ', ') + f'{json.dumps(name)}: {json.dumps(value)}'
+        first = False
+    for name, items in streamed.items():
+        yield ('' if first else ', ') + f'{json.dumps(name)}: ['
+        first = False
+        for position, item in enumerate(items):
+            yield (', ' if position else '') + json.dumps(item)
+        yield ']'
+    yield '}'
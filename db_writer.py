@@ -0,0 +1,102 @@
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+from app import app, db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# On SQLite every write goes through one thread, so webhook requests never
+# fight over the database lock and concurrent writes share a commit
+SQLITE_SINGLE_WRITER = os.environ.get('SQLITE_SINGLE_WRITER', 'true').lower() == 'true'
+# Most writes committed together
+DB_WRITE_BATCH = int(os.environ.get('DB_WRITE_BATCH', '64'))
+# How long a request waits for its write to start before giving up; a write
+# already running is always waited for, since it may still commit
+DB_WRITE_TIMEOUT_SECONDS = float(os.environ.get('DB_WRITE_TIMEOUT_SECONDS', '30'))
+
+_write_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+def _use_writer_thread():
+    if not SQLITE_SINGLE_WRITER or threading.current_thread() is _writer_thread:
+        return False
+    return db.engine.dialect.name == 'sqlite'
+
+def run_write(fn, *args, **kwargs):
+    """Run a write function and commit it; returns the function's result
+
+    fn stages its changes on db.session without committing. On SQLite it runs
+    on the writer thread with its own session, so it must load the rows it
+    changes by ID rather than receive objects from the caller's session.
+    Raises TimeoutError only if the write was withdrawn before it ran.
+    """
+    if not _use_writer_thread():
+        try:
+            result = fn(*args, **kwargs)
+            db.session.commit()
+            return result
+        except Exception:
+            db.session.rollback()
+            raise
+
+    _ensure_writer_thread()
+    future = Future()
+    _write_queue.put((fn, args, kwargs, future))
+    try:
+        return future.result(timeout=DB_WRITE_TIMEOUT_SECONDS)
+    except TimeoutError:
+        if future.cancel():
+            raise
+    logger.warning(f"Write {getattr(fn, '__name__', fn)} still running after {DB_WRITE_TIMEOUT_SECONDS}s; waiting for it")
+    return future.result()
+
+def _ensure_writer_thread():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+            _writer_thread.start()
+
+def _writer_loop():
+    """Apply queued writes in batches, one commit per batch"""
+    with app.app_context():
+        while True:
+            batch = [_write_queue.get()]
+            while len(batch) < DB_WRITE_BATCH:
+                try:
+                    batch.append(_write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                _commit_batch(batch)
+            finally:
+                db.session.remove()
+
+def _commit_batch(batch):
+    """Commit a batch together; if any write fails, retry them one by one"""
+    # Writes their callers gave up on are dropped; the rest can no longer be withdrawn
+    batch = [write for write in batch if write[3].set_running_or_notify_cancel()]
+    if not batch:
+        return
+    try:
+        results = [fn(*args, **kwargs) for fn, args, kwargs, _ in batch]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if len(batch) > 1:
+            logger.warning(f"Batched write failed ({e}); retrying {len(batch)} writes individually")
+        for fn, args, kwargs, future in batch:
+            try:
+                result = fn(*args, **kwargs)
+                db.session.commit()
+                future.set_result(result)
+            except Exception as write_error:
+                db.session.rollback()
+                future.set_exception(write_error)
+        return
+    for (_, _, _, future), result in zip(batch, results):
+        future.set_result(result)
@@ -5,6 +5,8 @@ import json
 from flask import Blueprint, request, jsonify
 from app import db
 from models import ModelState, Setting
+from db_writer import run_write
+from settings_cache import get_setting, bump_settings_version, invalidate_settings, VERSION_KEY as SETTINGS_VERSION_KEY
 # Temporarily disable huggingface imports
 # import huggingface_hub
 # from huggingface_hub import snapshot_download, HfApi, login
@@ -75,9 +77,9 @@ def self_upgrade():
     
     # Check if we have the right permissions to upgrade (still maintain security)
     upgrade_key = request.json.get('upgrade_key')
-    system_upgrade_key = Setting.query.filter_by(key="upgrade_key").first()
+    system_upgrade_key = get_setting("upgrade_key")
     
-    if not system_upgrade_key or system_upgrade_key.value != upgrade_key:
+    if not system_upgrade_key or system_upgrade_key != upgrade_key:
         logger.warning("Unauthorized self-upgrade attempt")
         return jsonify({"error": "Unauthorized"}), 403
     
@@ -87,6 +89,20 @@ def self_upgrade():
         "message": "Self-upgrade functionality is temporarily disabled"
     })
 
+def _save_settings(values):
+    """Stage new values for settings by key"""
+    for key, value in values.items():
+        if key == SETTINGS_VERSION_KEY:
+            continue
+        setting = Setting.query.filter_by(key=key).first()
+        if setting:
+            setting.value = value
+        else:
+            db.session.add(Setting(key=key, value=value))
+    
+    # Other workers reload their settings cache when they see the new version
+    bump_settings_version()
+
 @upgrader_bp.route('/settings', methods=['GET', 'POST'])
 def manage_settings():
     """Get or update upgrader settings"""
@@ -94,14 +110,12 @@ def manage_settings():
         # Get current settings
         try:
             # Include Twilio settings along with other settings
-            settings = {
-                s.key: s.value for s in Setting.query.filter(
-                    Setting.key.in_([
-                        'preferred_model', 'upgrade_key', 'auto_upgrade', 'system_prompt',
-                        'twilio_phone_number', 'twilio_account_sid', 'twilio_auth_token'
-                    ])
-                ).all()
-            }
+            settings = {}
+            for key in ['preferred_model', 'upgrade_key', 'auto_upgrade', 'system_prompt',
+                        'twilio_phone_number', 'twilio_account_sid', 'twilio_auth_token']:
+                value = get_setting(key)
+                if value is not None:
+                    settings[key] = value
             
             # Add Twilio phone number from environment if not in database
             if 'twilio_phone_number' not in settings:
@@ -123,21 +137,14 @@ def manage_settings():
         # Update settings
         data = request.json
         try:
-            for key, value in data.items():
+            for key in data:
                 # For Twilio settings, also update environment variables
                 if key in ['twilio_phone_number', 'twilio_account_sid', 'twilio_auth_token']:
-                    env_key = key.upper()
                     # We don't modify environment variables at runtime, but we store values in the database
                     logger.info(f"Twilio setting {key} updated in database")
-                
-                setting = Setting.query.filter_by(key=key).first()
-                if setting:
-                    setting.value = value
-                else:
-                    new_setting = Setting(key=key, value=value)
-                    db.session.add(new_setting)
             
-            db.session.commit()
+            run_write(_save_settings, data)
+            invalidate_settings()
             return jsonify({"message": "Settings updated successfully"})
         except Exception as e:
             db.session.rollback()
@@ -3,7 +3,10 @@ import logging
 import threading
 from flask import Blueprint, jsonify, request
 from app import db
-from models import ModelState, Setting
+from models import ModelState
+from db_writer import run_write
+from settings_cache import get_setting
+from conversation_memory import build_prompt, count_tokens
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -119,67 +122,72 @@ def initialize_model():
         return False
     """
 
+def _generate(model_input, search_results, max_length=512):
+    """Run the model on the full input; search_results are the truths retrieved for the prompt"""
+    if search_results:
+        model_input = f"Relevant truth: {search_results[0].content}\n{model_input}"
+    
+    if generation_pipeline is not None:
+        with model_lock:
+            output = generation_pipeline(model_input, max_new_tokens=max_length, return_full_text=False)
+        return output[0]["generated_text"].strip()
+    
+    # In development mode, return a placeholder that demonstrates
+    # what the actual model would do once deployed to VPS
+    template_responses = [
+        "I've consulted the knowledge base and found relevant information on this topic.",
+        "Based on the truths stored in Zion's knowledge, I can provide guidance.",
+        "The scriptures and recorded truths offer insight on this matter.",
+        "According to the wisdom preserved in our truth repository..."
+    ]
+    
+    import random
+    response_prefix = random.choice(template_responses)
+    
+    # If we found relevant truths, include them in the response
+    if search_results:
+        return f"{response_prefix} {search_results[0].content}"
+    return f"{response_prefix} When deployed on your 16GB VPS, Mistral-7B will generate a complete response based on your prompt and any relevant truths in the knowledge base."
+
+def generate_response(prompt, call_sid=None, max_length=512):
+    """Generate a reply to prompt; with a call_sid the model also sees that call's conversation"""
+    logger.info(f"Received prompt: {prompt[:50]}...")
+    
+    # Get system prompt from settings
+    system_prompt = get_setting("system_prompt")
+    if system_prompt:
+        logger.info(f"Using system prompt: {system_prompt[:50]}...")
+    
+    # The full model input: system prompt, as much of the call as fits
+    # MODEL_MAX_LENGTH, then the new prompt
+    model_input = build_prompt(call_sid, prompt, system_prompt)
+    logger.info(f"Model input is {count_tokens(model_input)} tokens")
+    
+    # Try to find relevant truths that might relate to the prompt. The
+    # reranker picks the single best passage, so only one goes into the prompt.
+    from truth_store import retrieve_truths
+    search_results = []
+    try:
+        search_results = retrieve_truths(prompt, 1, search_type="text", use_reranker=True)
+    except Exception as search_error:
+        logger.warning(f"Error searching truths: {search_error}")
+    
+    return {"response": _generate(model_input, search_results, max_length)}
+
 @llm_bp.route('/generate', methods=['POST'])
 def generate_text():
     """Generate text from the language model"""
     data = request.json
     prompt = data.get('prompt', '')
     max_length = data.get('max_length', 512)
+    # Voice turns pass their call SID so the model sees the call's conversation
+    call_sid = data.get('call_sid')
     
     if not prompt:
         return jsonify({"error": "Prompt is required"}), 400
     
-    # In Replit development environment, return a placeholder response
-    # Once deployed to VPS with ML libraries, this will use the actual model
-    logger.info(f"Received prompt: {prompt[:50]}...")
-    
     try:
-        # Get system prompt from settings
-        system_prompt = Setting.query.filter_by(key="system_prompt").first()
-        if system_prompt:
-            system_context = system_prompt.value
-            logger.info(f"Using system prompt: {system_context[:50]}...")
-        
-        # Try to find relevant truths that might relate to the prompt
-        from flask import request as flask_request
-        from truth_store import search_truths
-        search_results = []
-        try:
-            # Create a mock request for the search_truths function
-            class MockRequest:
-                args = {"query": prompt, "type": "text", "limit": "3"}
-            
-            # Call the search function
-            original_request = flask_request
-            flask_request = MockRequest()
-            search_response = search_truths()
-            flask_request = original_request
-            
-            if search_response and isinstance(search_response, dict):
-                search_results = search_response.get("results", [])
-        except Exception as search_error:
-            logger.warning(f"Error searching truths: {search_error}")
-        
-        # In development mode, return a placeholder that demonstrates
-        # what the actual model would do once deployed to VPS
-        template_responses = [
-            "I've consulted the knowledge base and found relevant information on this topic.",
-            "Based on the truths stored in Zion's knowledge, I can provide guidance.",
-            "The scriptures and recorded truths offer insight on this matter.",
-            "According to the wisdom preserved in our truth repository..."
-        ]
-        
-        import random
-        response_prefix = random.choice(template_responses)
-        
-        # If we found relevant truths, include them in the response
-        if search_results:
-            truth_content = search_results[0].get("content", "")
-            response = f"{response_prefix} {truth_content}"
-        else:
-            response = f"{response_prefix} When deployed on your 16GB VPS, Mistral-7B will generate a complete response based on your prompt and any relevant truths in the knowledge base."
-        
-        return jsonify({"response": response})
+        return jsonify(generate_response(prompt, call_sid, max_length))
     except Exception as e:
         logger.error(f"Error generating text: {e}")
         return jsonify({"error": str(e)}), 500
@@ -211,6 +219,28 @@ def model_info():
         "last_used": model_state.last_used.isoformat() if model_state.last_used else None
     })
 
+def _register_model(model_path, quantization):
+    """Stage a model as the loaded one"""
+    # Set all models to not loaded
+    ModelState.query.update({ModelState.loaded: False})
+    
+    # Check if model already exists
+    existing_model = ModelState.query.filter_by(model_path=model_path).first()
+    if existing_model:
+        existing_model.loaded = True
+        existing_model.quantization = quantization
+    else:
+        # Extract model name from path
+        model_name = model_path.split('/')[-1]
+        new_model = ModelState(
+            model_name=model_name,
+            model_version="1.0",  # Default version
+            model_path=model_path,
+            quantization=quantization,
+            loaded=True
+        )
+        db.session.add(new_model)
+
 @llm_bp.route('/load-model', methods=['POST'])
 def load_model():
     """Load a specific model"""
@@ -223,28 +253,7 @@ def load_model():
     
     try:
         # Update database
-        with db.session() as session:
-            # Set all models to not loaded
-            ModelState.query.update({ModelState.loaded: False})
-            
-            # Check if model already exists
-            existing_model = ModelState.query.filter_by(model_path=model_path).first()
-            if existing_model:
-                existing_model.loaded = True
-                existing_model.quantization = quantization
-            else:
-                # Extract model name from path
-                model_name = model_path.split('/')[-1]
-                new_model = ModelState(
-                    model_name=model_name,
-                    model_version="1.0",  # Default version
-                    model_path=model_path,
-                    quantization=quantization,
-                    loaded=True
-                )
-                session.add(new_model)
-            
-            session.commit()
+        run_write(_register_model, model_path, quantization)
         
         # In development mode, we don't actually load the model,
         # but we record the change in the database
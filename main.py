@@ -1,5 +1,12 @@
 from app import app  # noqa: F401
+from call_retention import start_retention_scheduler
+from outbound_calls import resume_queued_calls
+
+# Roll up and archive old call logs in the background. Only the serving
+# processes run it; flask db upgrade and scripts import app without it
+start_retention_scheduler()
+# Place the outbound calls that workers which have since exited left queued
+resume_queued_calls()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
-
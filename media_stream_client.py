@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import wave
+import base64
+import asyncio
+import argparse
+import numpy as np
+from websockets.asyncio.client import connect
+from twilio.request_validator import RequestValidator
+from media_streams import SAMPLE_RATE, FRAME_MS, ulaw_encode, resample
+
+# Stand-in for Twilio's side of a media stream, for testing the server
+# offline: plays WAV files into a stream the way Twilio would, with 20 ms
+# mu-law frames in real time, acknowledges marks once the reply audio before
+# them would have finished playing, and reports how long each reply took to
+# start. A clear from the server drops the queued reply, as on a real call.
+
+def load_wav(path):
+    """Read a mono or stereo 16-bit WAV as 8 kHz int16 samples"""
+    with wave.open(path, 'rb') as wav:
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        if wav.getnchannels() > 1:
+            samples = samples.reshape(-1, wav.getnchannels()).mean(axis=1)
+        return resample(samples.astype(np.float32), wav.getframerate(), SAMPLE_RATE).astype(np.int16)
+
+def silence(ms):
+    return np.zeros(SAMPLE_RATE * ms // 1000, dtype=np.int16)
+
+class FakeTwilioCall:
+    """One simulated call against a media stream server"""
+
+    def __init__(self, url, call_sid="CAFAKE0000", caller="+15550000000", speed=1.0, signed_url=None):
+        self.url = url
+        # The public stream URL the server checks the signature against
+        self.signed_url = signed_url or url
+        self.call_sid = call_sid
+        self.caller = caller
+        self.speed = speed
+        self.stream_sid = f"MZ{call_sid[2:]}"
+        self.events = []
+        self.reply_bytes = 0
+        self.clears = 0
+        self.speech_ended_at = None
+        self.reply_latencies = []
+        self.playback_ends_at = 0.0
+        self.pending_marks = []
+
+    async def _receive(self, websocket):
+        async for raw in websocket:
+            message = json.loads(raw)
+            event = message.get("event")
+            self.events.append(event)
+            if event == "media":
+                if self.speech_ended_at is not None:
+                    self.reply_latencies.append(time.perf_counter() - self.speech_ended_at)
+                    self.speech_ended_at = None
+                audio_bytes = len(base64.b64decode(message["media"]["payload"]))
+                self.reply_bytes += audio_bytes
+                # Queue the audio for playback at real-time speed
+                now = time.perf_counter()
+                self.playback_ends_at = max(self.playback_ends_at, now) + audio_bytes / SAMPLE_RATE / self.speed
+            elif event == "clear":
+                self.clears += 1
+                self.playback_ends_at = 0.0
+                for task in self.pending_marks:
+                    task.cancel()
+                self.pending_marks = []
+            elif event == "mark":
+                self.pending_marks.append(asyncio.create_task(self._echo_mark(websocket, message["mark"])))
+
+    async def _echo_mark(self, websocket, mark):
+        """Send a mark back once the audio queued before it has played, like Twilio does"""
+        await asyncio.sleep(max(self.playback_ends_at - time.perf_counter(), 0))
+        await websocket.send(json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": mark}))
+
+    async def _send_audio(self, websocket, samples, chunk):
+        frame = SAMPLE_RATE * FRAME_MS // 1000
+        for start in range(0, len(samples), frame):
+            payload = base64.b64encode(ulaw_encode(samples[start:start + frame])).decode('ascii')
+            await websocket.send(json.dumps({
+                "event": "media", "streamSid": self.stream_sid,
+                "media": {"track": "inbound", "chunk": str(chunk), "payload": payload}
+            }))
+            chunk += 1
+            await asyncio.sleep(FRAME_MS / 1000 / self.speed)
+        return chunk
+
+    async def run(self, utterances, gap_ms=2000):
+        """Play each utterance followed by gap_ms of silence, then hang up"""
+        headers = {}
+        auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
+        if auth_token:
+            # Sign the upgrade as Twilio does, so servers that check signatures accept it
+            headers['X-Twilio-Signature'] = RequestValidator(auth_token).compute_signature(self.signed_url, {})
+        async with connect(self.url, additional_headers=headers) as websocket:
+            receiver = asyncio.create_task(self._receive(websocket))
+            await websocket.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+            await websocket.send(json.dumps({
+                "event": "start", "streamSid": self.stream_sid,
+                "start": {"streamSid": self.stream_sid, "callSid": self.call_sid,
+                          "customParameters": {"caller": self.caller},
+                          "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": SAMPLE_RATE, "channels": 1}}
+            }))
+            chunk = 1
+            for samples in utterances:
+                chunk = await self._send_audio(websocket, samples, chunk)
+                self.speech_ended_at = time.perf_counter()
+                chunk = await self._send_audio(websocket, silence(gap_ms), chunk)
+            await websocket.send(json.dumps({"event": "stop", "streamSid": self.stream_sid}))
+            await asyncio.sleep(0.1)
+            receiver.cancel()
+        return {
+            "reply_bytes": self.reply_bytes,
+            "clears": self.clears,
+            "reply_latencies": [round(latency, 3) for latency in self.reply_latencies],
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Play WAV files into a media stream server like Twilio would")
+    parser.add_argument("wav", nargs="+", help="one WAV file per caller utterance")
+    parser.add_argument("--url", default="ws://127.0.0.1:5001/media-stream")
+    parser.add_argument("--gap-ms", type=int, default=2000, help="silence after each utterance")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed relative to real time")
+    args = parser.parse_args()
+
+    call = FakeTwilioCall(args.url, speed=args.speed, signed_url=os.environ.get('MEDIA_STREAM_URL'))
+    result = asyncio.run(call.run([load_wav(path) for path in args.wav], gap_ms=args.gap_ms))
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import logging
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+from app import app, db
+from models import CallLog
+from db_writer import run_write
+from speech_to_text import transcribe, is_available as stt_available
+from text_to_speech import resample, synthesize as synthesize_speech, is_available as tts_available
+from voice_pipeline import answer_turn, prefetch_answer
+from twilio_integration import MEDIA_STREAM_URL
+from twilio_security import TWILIO_VALIDATE_SIGNATURES, signature_valid
+from voice_prompts import PROMPTS, recorded_prompt
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MEDIA_STREAM_HOST = os.environ.get('MEDIA_STREAM_HOST', '0.0.0.0')
+MEDIA_STREAM_PORT = int(os.environ.get('MEDIA_STREAM_PORT', '5001'))
+# Threads shared by every call for transcription and retrieval
+MEDIA_STREAM_WORKERS = int(os.environ.get('MEDIA_STREAM_WORKERS', '4'))
+# VAD: how far speech energy must rise above the noise floor, and how long
+# speech or silence must last to start or end an utterance
+VAD_RATIO = float(os.environ.get('VAD_RATIO', '3.0'))
+VAD_MIN_RMS = float(os.environ.get('VAD_MIN_RMS', '0.01'))
+VAD_START_MS = int(os.environ.get('VAD_START_MS', '60'))
+VAD_END_MS = int(os.environ.get('VAD_END_MS', '300'))
+VAD_MAX_UTTERANCE_MS = int(os.environ.get('VAD_MAX_UTTERANCE_MS', '15000'))
+# Audio kept from before speech started, so the first syllable is not cut
+VAD_PREROLL_MS = int(os.environ.get('VAD_PREROLL_MS', '200'))
+# While the caller talks, the utterance so far is transcribed this often so the
+# answer can be started early; 0 disables partial transcription
+MEDIA_STREAM_PARTIAL_MS = int(os.environ.get('MEDIA_STREAM_PARTIAL_MS', '1000'))
+# Spoken when a turn cannot be answered, as the recording webhook does; a fixed
+# prompt, so its rendered recording plays even without a voice
+REPLY_ERROR_TEXT = PROMPTS["turn_error"]
+
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+
+_sentence_pattern = re.compile(r'(?<=[.!?;:])\s+')
+
+_executor = ThreadPoolExecutor(max_workers=MEDIA_STREAM_WORKERS, thread_name_prefix="media-stream")
+
+def _build_ulaw_table():
+    codes = ~np.arange(256) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+_ULAW_TABLE = _build_ulaw_table()
+
+def ulaw_decode(data):
+    """G.711 mu-law bytes to int16 samples"""
+    return _ULAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+def ulaw_encode(samples):
+    """int16 samples to G.711 mu-law bytes"""
+    # Work on 14-bit magnitudes, as the G.711 reference encoder does
+    samples = np.asarray(samples, dtype=np.int32) >> 2
+    sign = (samples < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(samples), 8159) + 0x21
+    exponent = np.maximum(np.floor(np.log2(magnitude)).astype(np.int32) - 5, 0)
+    # Magnitudes past the top segment saturate to its largest code
+    mantissa = np.where(exponent > 7, 0x0F, (magnitude >> (exponent + 1)) & 0x0F)
+    exponent = np.minimum(exponent, 7)
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+class EnergyVad:
+    """Incremental voice activity detector over 20 ms frames
+
+    A frame is speech when its RMS is VAD_RATIO times the adaptive noise
+    floor. process() returns "start" when speech has lasted VAD_START_MS,
+    "end" after VAD_END_MS of silence (or at VAD_MAX_UTTERANCE_MS), else None.
+    """
+
+    def __init__(self):
+        self.noise_floor = VAD_MIN_RMS / VAD_RATIO
+        self.in_speech = False
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self.utterance_ms = 0
+
+    def process(self, frame):
+        rms = float(np.sqrt(np.mean(np.square(frame)))) if len(frame) else 0.0
+        is_speech = rms >= max(self.noise_floor * VAD_RATIO, VAD_MIN_RMS)
+        if not is_speech:
+            # Follow the background level only while nobody is talking
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+
+        frame_ms = len(frame) * 1000 // SAMPLE_RATE
+        if not self.in_speech:
+            self.speech_ms = self.speech_ms + frame_ms if is_speech else 0
+            if self.speech_ms >= VAD_START_MS:
+                self.in_speech = True
+                self.silence_ms = 0
+                self.utterance_ms = self.speech_ms
+                return "start"
+            return None
+
+        self.utterance_ms += frame_ms
+        self.silence_ms = 0 if is_speech else self.silence_ms + frame_ms
+        if self.silence_ms >= VAD_END_MS or self.utterance_ms >= VAD_MAX_UTTERANCE_MS:
+            self.in_speech = False
+            self.speech_ms = 0
+            return "end"
+        return None
+
+def synthesize(text):
+    """Synthesize one sentence to 8 kHz int16 samples; None without a voice"""
+    return synthesize_speech(text, SAMPLE_RATE)
+
+def _speech_audio(text):
+    """8 kHz int16 samples for text: a fixed prompt's recording if rendered, else synthesized"""
+    samples = recorded_prompt(text, SAMPLE_RATE)
+    if samples is None:
+        samples = synthesize(text)
+    return samples
+
+def _speech_parts(text):
+    """Split text into the units spoken one at a time
+
+    Fixed prompts stay whole so their recordings can be played; anything else
+    is spoken sentence by sentence so playback starts early.
+    """
+    if text.strip() in PROMPTS.values():
+        return [text.strip()]
+    return [sentence for sentence in _sentence_pattern.split(text) if sentence.strip()]
+
+def _transcribe_utterance(samples):
+    """Transcribe 8 kHz float samples (-1..1) with the shared Whisper model"""
+    text, _ = transcribe(resample(samples, SAMPLE_RATE, 16000))
+    return text
+
+def _log_turn(call_sid, caller, transcript, response):
+    """Stage the latest turn on the call's log row, creating it on the first turn"""
+    call_log = CallLog.query.filter_by(twilio_sid=call_sid).first()
+    if not call_log:
+        call_log = CallLog(twilio_sid=call_sid, caller_number=caller)
+        db.session.add(call_log)
+    call_log.transcript = transcript
+    call_log.response = response
+
+def _answer_turn(call_sid, caller, transcript):
+    with app.app_context():
+        response = answer_turn(call_sid, transcript, caller, "stream", prefetch_wait=1.0)
+        try:
+            run_write(_log_turn, call_sid, caller, transcript, response)
+        except Exception as e:
+            logger.error(f"Error logging turn for {call_sid}: {e}")
+        return response
+
+class MediaStreamSession:
+    """One Twilio media stream: caller audio in, spoken answers out
+
+    An energy VAD cuts the caller's 8 kHz mu-law audio into utterances, which
+    are transcribed, answered by the voice pipeline and spoken back. Speech
+    from the caller while a reply is playing clears it (barge-in).
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.stream_sid = None
+        self.call_sid = None
+        self.caller = None
+        self.vad = EnergyVad()
+        self.preroll = []
+        self.utterance = []
+        self.partial_task = None
+        self.partials = 0
+        self.reply_task = None
+        self.speaking = False
+        self.marks_sent = 0
+        self.turns = 0
+
+    async def send(self, message):
+        await self.websocket.send(json.dumps(message))
+
+    async def run(self):
+        try:
+            async for raw in self.websocket:
+                message = json.loads(raw)
+                event = message.get("event")
+                if event == "start":
+                    self.on_start(message["start"])
+                    self.stream_sid = message.get("streamSid") or message["start"].get("streamSid")
+                elif event == "media":
+                    await self.on_media(base64.b64decode(message["media"]["payload"]))
+                elif event == "mark":
+                    if message["mark"]["name"] == f"reply-{self.marks_sent}":
+                        # Twilio has played everything sent before the mark
+                        self.speaking = False
+                elif event == "stop":
+                    break
+        except ConnectionClosed:
+            pass
+        finally:
+            for task in (self.reply_task, self.partial_task):
+                if task:
+                    task.cancel()
+            logger.info(f"Media stream for {self.call_sid} closed after {self.turns} turns")
+
+    def on_start(self, start):
+        self.call_sid = start.get("callSid")
+        self.caller = start.get("customParameters", {}).get("caller", "unknown")
+        logger.info(f"Media stream started for call {self.call_sid}")
+
+    async def on_media(self, payload):
+        frame = ulaw_decode(payload).astype(np.float32) / 32768.0
+        event = self.vad.process(frame)
+
+        if self.vad.in_speech or event == "end":
+            if event == "start":
+                self.utterance = self.preroll + [frame]
+                await self.barge_in()
+            else:
+                self.utterance.append(frame)
+            if self.vad.in_speech:
+                self.maybe_transcribe_partial()
+        else:
+            self.preroll.append(frame)
+            del self.preroll[:-max(VAD_PREROLL_MS // FRAME_MS, 1)]
+
+        if event == "end":
+            audio = np.concatenate(self.utterance)
+            self.utterance = []
+            self.partials = 0
+            self.reply_task = asyncio.create_task(self.reply(audio))
+
+    async def barge_in(self):
+        """The caller started talking: stop any reply in progress"""
+        if self.reply_task and not self.reply_task.done():
+            self.reply_task.cancel()
+        if self.speaking:
+            await self.send({"event": "clear", "streamSid": self.stream_sid})
+            self.speaking = False
+            logger.info(f"Barge-in on call {self.call_sid}")
+
+    def maybe_transcribe_partial(self):
+        """Transcribe the utterance so far and start answering it speculatively"""
+        if MEDIA_STREAM_PARTIAL_MS <= 0 or (self.partial_task and not self.partial_task.done()):
+            return
+        if self.vad.utterance_ms < MEDIA_STREAM_PARTIAL_MS * (self.partials + 1):
+            return
+        self.partials += 1
+        audio = np.concatenate(self.utterance)
+        self.partial_task = asyncio.create_task(self.transcribe_partial(audio))
+
+    async def transcribe_partial(self, audio):
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(_executor, _transcribe_utterance, audio)
+        if text:
+            prefetch_answer(self.call_sid, text)
+
+    async def reply(self, audio):
+        loop = asyncio.get_running_loop()
+        heard_at = time.perf_counter()
+        try:
+            transcript = await loop.run_in_executor(_executor, _transcribe_utterance, audio)
+            if not transcript:
+                return
+            response = await loop.run_in_executor(_executor, _answer_turn, self.call_sid, self.caller, transcript)
+            self.turns += 1
+            await self.speak(response, heard_at)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.error(f"Error answering turn on call {self.call_sid}: {e}")
+            try:
+                await self.speak(REPLY_ERROR_TEXT, heard_at)
+            except Exception as speak_error:
+                logger.error(f"Error speaking the fallback on call {self.call_sid}: {speak_error}")
+
+    async def speak(self, text, heard_at):
+        """Send text as audio part by part so playback starts early; nothing without a voice"""
+        loop = asyncio.get_running_loop()
+        first = True
+        for part in _speech_parts(text):
+            samples = await loop.run_in_executor(_executor, _speech_audio, part)
+            if samples is None:
+                continue
+            self.speaking = True
+            await self.send({
+                "event": "media",
+                "streamSid": self.stream_sid,
+                "media": {"payload": base64.b64encode(ulaw_encode(samples)).decode('ascii')}
+            })
+            if first:
+                logger.info(f"Call {self.call_sid}: first reply audio {time.perf_counter() - heard_at:.2f}s "
+                            f"after end of speech")
+                first = False
+        if first:
+            logger.warning(f"Call {self.call_sid}: no voice to speak the reply with; "
+                           f"set TTS_PIPER_MODEL or render the prompts")
+            return
+        self.marks_sent += 1
+        await self.send({"event": "mark", "streamSid": self.stream_sid,
+                         "mark": {"name": f"reply-{self.marks_sent}"}})
+
+def stream_url(path, host):
+    """The URL Twilio signed when it opened the stream at path"""
+    if MEDIA_STREAM_URL:
+        return urljoin(MEDIA_STREAM_URL, path)
+    return f"wss://{host}{path}"
+
+def authorize_stream(connection, request):
+    """Refuse websocket upgrades that were not signed by Twilio
+
+    Twilio signs the upgrade request like a webhook: the stream URL with no
+    parameters, in X-Twilio-Signature.
+    """
+    if not TWILIO_VALIDATE_SIGNATURES:
+        return None
+    url = stream_url(request.path, request.headers.get('Host', ''))
+    if signature_valid(url, {}, request.headers.get('X-Twilio-Signature')):
+        return None
+    logger.warning(f"Refused unsigned media stream from {connection.remote_address}")
+    return connection.respond(403, "Invalid Twilio signature\n")
+
+async def handle_media_stream(websocket):
+    await MediaStreamSession(websocket).run()
+
+async def serve_media_streams(host=MEDIA_STREAM_HOST, port=MEDIA_STREAM_PORT):
+    if not stt_available():
+        logger.warning("Local speech-to-text is unavailable; media streams will not understand callers")
+    if not tts_available():
+        logger.warning("No speech synthesis voice configured; media streams can only play rendered prompts")
+    async with serve(handle_media_stream, host, port, process_request=authorize_stream) as server:
+        logger.info(f"Media stream server listening on {host}:{port}")
+        await server.serve_forever()
+
+# Runs as its own process next to the Flask app; calls are connected to it
+# with <Connect><Stream> when TWILIO_VOICE_MODE=stream
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve_media_streams())
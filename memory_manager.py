@@ -1,21 +1,51 @@
 import os
+import time
+import fcntl
+import queue
+import bisect
+import shutil
+import threading
 import numpy as np
 import logging
 # import faiss  # Commented out until we can install faiss
 import json
+from datetime import timezone
 from flask import Blueprint, jsonify, request
-from app import db
+from app import app, db
 from models import Truth
+from change_log import OP_DELETE, OP_RETAG, latest_change_id, compacted_through, get_changes_since, collapse_changes
+from db_writer import run_write
+from search_cache import cached_embedding
+from topic_clusters import probe_labels
 # from llm_handler import initialize_model, model, tokenizer  # Commented out until we can install torch/transformers
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Global variables
-index = None
-truth_ids = []
 dimension = 768  # Default dimension for embeddings
 
+# Shared index configuration. Snapshots live on disk so every worker can map
+# the same pages; the change log sequence acts as the index generation.
+INDEX_DIR = os.environ.get('INDEX_DIR', os.path.join(app.instance_path, 'index'))
+INDEX_REFRESH_SECONDS = float(os.environ.get('INDEX_REFRESH_SECONDS', '2'))
+INDEX_SNAPSHOT_EVERY = int(os.environ.get('INDEX_SNAPSHOT_EVERY', '1000'))
+# Fraction of dead row slots that triggers compaction of the vector matrix
+INDEX_COMPACT_RATIO = float(os.environ.get('INDEX_COMPACT_RATIO', '0.25'))
+# Delta segment size that triggers a merge into the main segment
+INDEX_DELTA_MAX_ROWS = int(os.environ.get('INDEX_DELTA_MAX_ROWS', '10000'))
+# Main segment encoding: 'int8' keeps per-dimension scalar codes in memory, 'none' scans float32
+INDEX_QUANTIZATION = os.environ.get('INDEX_QUANTIZATION', 'int8').lower()
+# Candidates per requested result re-ranked with the exact vectors (0 disables re-ranking)
+INDEX_RERANK_FACTOR = int(os.environ.get('INDEX_RERANK_FACTOR', '4'))
+# Rows decoded per block while scanning codes, bounding temporary float memory
+INDEX_SCAN_CHUNK_ROWS = 8192
+# Most queries and results per query a recall estimate may ask for
+INDEX_RECALL_MAX_SAMPLE = 1000
+INDEX_RECALL_MAX_K = 100
+# Written into each snapshot; snapshots of any other format are rebuilt
+# (2: adds created.npy and postings.json for filtered search)
+INDEX_SNAPSHOT_FORMAT = 2
+
 def get_embedding(text):
     """Get embedding vector for text using the loaded model"""
     try:
@@ -27,78 +57,808 @@ def get_embedding(text):
         logger.error(f"Error generating embedding: {e}")
         return None
 
+def _normalize(vector):
+    """Return a unit-length float32 copy of a vector"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def quantize_int8(vectors):
+    """Scalar-quantize vectors per dimension; returns (codes, offset, scale)
+
+    A vector is reconstructed as offset + scale * codes.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) == 0:
+        return np.zeros((0, dimension), dtype=np.uint8), np.zeros(dimension, np.float32), np.ones(dimension, np.float32)
+    offset = vectors.min(axis=0)
+    scale = (vectors.max(axis=0) - offset) / 255.0
+    scale[scale == 0] = 1.0
+    codes = np.empty(vectors.shape, dtype=np.uint8)
+    for start in range(0, len(vectors), INDEX_SCAN_CHUNK_ROWS):
+        block = vectors[start:start + INDEX_SCAN_CHUNK_ROWS]
+        codes[start:start + INDEX_SCAN_CHUNK_ROWS] = np.clip(np.rint((block - offset) / scale), 0, 255)
+    return codes, offset.astype(np.float32), scale.astype(np.float32)
+
+def metadata_keys(topics, source):
+    """Return the posting keys a truth is listed under for filtered search"""
+    keys = [f"topic:{topic.lower()}" for topic in (topics or [])]
+    if source:
+        keys.append(f"source:{source}")
+    return keys
+
+def _epoch(moment):
+    """Convert a datetime to epoch seconds, treating naive values as UTC like the models do"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def _store_vectors(vectors):
+    """Stage embeddings, by truth ID, for truths stored without one"""
+    for truth_id, vector in vectors.items():
+        truth = db.session.get(Truth, truth_id)
+        if truth is not None:
+            truth.set_vector(vector)
+
+def _row_metadata(topics, source, created_at):
+    """Return (created epoch seconds, posting keys) for a truth row; topics is the stored JSON"""
+    created = _epoch(created_at) if created_at else 0.0
+    return created, metadata_keys(json.loads(topics) if topics else [], source)
+
+class IndexSegment:
+    """A block of index rows: truth IDs, unit vectors and a live mask per row slot
+
+    Each segment also keeps filter metadata: a creation timestamp per slot and
+    posting lists of slots per topic and per source, turned into bitmaps over
+    the slots when a filtered query needs them.
+    """
+
+    def __init__(self, ids, vectors, codes=None, quant_offset=None, quant_scale=None,
+                 created=None, postings=None, mutable=False):
+        self.ids = ids  # Row slot -> truth ID, -1 for tombstones
+        self.vectors = vectors  # Row slot -> unit vector
+        self.live = np.ones(len(ids), dtype=bool)
+        self.size = len(ids)  # Slots in use, live or tombstoned
+        self.tombstones = 0
+        # Optional int8 codes; when present, only these are scanned and
+        # the float vectors are read back just for re-ranking
+        self.codes = codes
+        self.quant_offset = quant_offset
+        self.quant_scale = quant_scale
+        # Row slot -> creation time (epoch seconds)
+        self.created = created if created is not None else np.zeros(len(ids), dtype=np.float64)
+        self.postings = postings if postings is not None else {}  # Metadata key -> row slots
+        # Bitmaps of immutable segments are built once and reused across queries
+        self.mutable = mutable
+        self._bitmaps = {}
+        self._source_keys = None
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.int64), np.zeros((0, dimension), dtype=np.float32), mutable=True)
+
+    def append(self, truth_id, vector, created=0.0, keys=()):
+        """Append a row in constant amortized time; returns its slot"""
+        if self.size == len(self.ids):
+            self._grow()
+        slot = self.size
+        self.ids[slot] = truth_id
+        self.vectors[slot] = vector
+        self.live[slot] = True
+        self.created[slot] = created
+        for key in keys:
+            self.postings.setdefault(key, []).append(slot)
+        self.size += 1
+        return slot
+
+    def _grow(self):
+        """Double the slot capacity"""
+        capacity = max(2 * len(self.ids), 64)
+        ids = np.full(capacity, -1, dtype=np.int64)
+        vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        live = np.zeros(capacity, dtype=bool)
+        created = np.zeros(capacity, dtype=np.float64)
+        ids[:self.size] = self.ids[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        live[:self.size] = self.live[:self.size]
+        created[:self.size] = self.created[:self.size]
+        self.ids, self.vectors, self.live, self.created = ids, vectors, live, created
+
+    def replace_topics(self, topic_keys):
+        """Move rows to new topic posting lists in one pass; topic_keys maps slot -> topic keys"""
+        moved = np.fromiter(topic_keys, dtype=np.int64, count=len(topic_keys))
+        for key in [key for key in self.postings if key.startswith("topic:")]:
+            slots = self.postings[key]
+            if self.mutable:
+                kept = [slot for slot in slots if slot not in topic_keys]
+            else:
+                kept = slots[~np.isin(slots, moved)]
+            if len(kept) != len(slots):
+                self.postings[key] = kept
+        added = {}
+        for slot, keys in topic_keys.items():
+            for key in keys:
+                added.setdefault(key, []).append(slot)
+        for key, slots in added.items():
+            if self.mutable:
+                self.postings.setdefault(key, []).extend(slots)
+            else:
+                existing = self.postings.get(key, np.zeros(0, dtype=np.int32))
+                self.postings[key] = np.union1d(existing, slots).astype(np.int32)
+        self._bitmaps.clear()
+
+    def frozen(self, filters=None):
+        """A view of the rows in use now whose live mask is narrowed to those passing filters
+
+        Rows below size are never rewritten in place, so the view shares the
+        arrays and can be scanned outside the index lock while writes go on.
+        """
+        view = IndexSegment(self.ids, self.vectors, codes=self.codes, quant_offset=self.quant_offset,
+                            quant_scale=self.quant_scale, created=self.created)
+        view.live = self.allowed_mask(filters)
+        view.size = self.size
+        view.tombstones = self.size - int(view.live.sum())
+        return view
+
+    def tombstone(self, slot):
+        """Mark a row dead; the live mask is private, so mapped rows stay untouched"""
+        self.live[slot] = False
+        self.tombstones += 1
+
+    def live_slots(self):
+        """Return the slots of the live rows"""
+        return np.flatnonzero(self.live[:self.size])
+
+    def bitmap(self, key):
+        """Return a boolean mask over the slots listed under a metadata key"""
+        if not self.mutable and key in self._bitmaps:
+            return self._bitmaps[key]
+        mask = np.zeros(self.size, dtype=bool)
+        slots = self.postings.get(key)
+        if slots is not None and len(slots):
+            mask[np.asarray(slots)] = True
+        if not self.mutable:
+            self._bitmaps[key] = mask
+        return mask
+
+    def _source_prefix_bitmap(self, prefix):
+        """OR together the bitmaps of every source starting with prefix"""
+        cache_key = f"source-prefix:{prefix}"
+        if not self.mutable and cache_key in self._bitmaps:
+            return self._bitmaps[cache_key]
+        if self._source_keys is None or self.mutable:
+            self._source_keys = sorted(key for key in self.postings if key.startswith("source:"))
+        start = bisect.bisect_left(self._source_keys, f"source:{prefix}")
+        mask = np.zeros(self.size, dtype=bool)
+        for key in self._source_keys[start:]:
+            if not key.startswith(f"source:{prefix}"):
+                break
+            mask |= self.bitmap(key)
+        if not self.mutable:
+            self._bitmaps[cache_key] = mask
+        return mask
+
+    def allowed_mask(self, filters=None):
+        """Return the mask of live rows that pass the filters"""
+        mask = self.live[:self.size].copy()
+        if not filters:
+            return mask
+        if filters.get('topics'):
+            topic_mask = np.zeros(self.size, dtype=bool)
+            for topic in filters['topics']:
+                topic_mask |= self.bitmap(f"topic:{topic.lower()}")
+            mask &= topic_mask
+        if filters.get('clusters'):
+            # Coarse quantizer: only rows in the probed clusters are scanned
+            cluster_mask = np.zeros(self.size, dtype=bool)
+            for label in filters['clusters']:
+                cluster_mask |= self.bitmap(f"topic:{label}")
+            mask &= cluster_mask
+        if filters.get('source_prefix'):
+            mask &= self._source_prefix_bitmap(filters['source_prefix'])
+        if filters.get('created_after') is not None:
+            mask &= self.created[:self.size] >= filters['created_after']
+        if filters.get('created_before') is not None:
+            mask &= self.created[:self.size] < filters['created_before']
+        return mask
+
+    def top_k(self, query_vector, k, rerank_factor=None, filters=None):
+        """Return (scores, ids) of the best k live rows passing the filters"""
+        return self.top_k_batch(query_vector[np.newaxis, :], k, rerank_factor, filters)[0]
+
+    def top_k_batch(self, query_vectors, k, rerank_factor=None, filters=None):
+        """Return [(scores, ids)] of the best k rows for each query row
+
+        Each block of rows is scored against every query with one matrix
+        product, keeping a running top list per query, so temporary memory is
+        bounded by the block size rather than the segment size.
+        """
+        n_queries = len(query_vectors)
+        allowed = self.allowed_mask(filters)
+        allowed_count = int(allowed.sum())
+        if allowed_count == 0:
+            return [(np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))] * n_queries
+        k = min(k, allowed_count)
+
+        quantized = self.codes is not None
+        if rerank_factor is None:
+            rerank_factor = INDEX_RERANK_FACTOR
+        n_candidates = min(allowed_count, k * max(rerank_factor, 1)) if quantized else k
+
+        if quantized:
+            # Asymmetric distance: float queries against int8 codes, decoded block by block
+            weights = (query_vectors * self.quant_scale).T
+            base = query_vectors @ self.quant_offset
+        best_scores = np.zeros((n_queries, 0), dtype=np.float32)
+        best_slots = np.zeros((n_queries, 0), dtype=np.int64)
+        for start in range(0, self.size, INDEX_SCAN_CHUNK_ROWS):
+            end = min(start + INDEX_SCAN_CHUNK_ROWS, self.size)
+            if quantized:
+                block = self.codes[start:end].astype(np.float32) @ weights + base
+            else:
+                block = np.asarray(self.vectors[start:end]) @ query_vectors.T
+            block[~allowed[start:end]] = -np.inf
+
+            scores = np.concatenate([best_scores, block.T], axis=1)
+            slots = np.concatenate([best_slots, np.broadcast_to(np.arange(start, end), (n_queries, end - start))], axis=1)
+            if scores.shape[1] > n_candidates:
+                keep = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                slots = np.take_along_axis(slots, keep, axis=1)
+            best_scores, best_slots = scores, slots
+
+        if quantized and rerank_factor > 0:
+            # Exact scores for the union of candidates with one more matrix product;
+            # sorted slots keep mapped reads sequential
+            union = np.unique(best_slots)
+            exact = np.asarray(self.vectors[union]) @ query_vectors.T
+            best_scores = exact[np.searchsorted(union, best_slots), np.arange(n_queries)[:, np.newaxis]]
+
+        results = []
+        for scores, slots in zip(best_scores, best_slots):
+            best = np.argpartition(-scores, k - 1)[:k]
+            results.append((scores[best], self.ids[slots[best]]))
+        return results
+
+    def memory_bytes(self):
+        """Bytes of the arrays scanned on every query (the float vectors are only touched when re-ranking)"""
+        scanned = self.codes if self.codes is not None else self.vectors
+        return int(scanned[:self.size].nbytes + self.ids[:self.size].nbytes + self.live[:self.size].nbytes)
+
+class TruthIndex:
+    """Per-worker view of the shared truth vector index
+
+    Workers start from the newest on-disk snapshot (memory-mapped, so its pages
+    are shared between workers) and tail the change log to pick up writes made
+    by any other worker within INDEX_REFRESH_SECONDS.
+
+    The snapshot is the immutable main segment. Writes go to a small delta
+    segment searched alongside it, deletes and replaced rows become tombstones,
+    and compact() merges both segments once thresholds are crossed.
+    """
+
+    def __init__(self):
+        self._install(IndexSegment.empty())
+        self.generation = None  # Change log sequence reflected by the index
+        self.changes_since_snapshot = 0
+        self.last_checked = 0.0
+        # Change log entries this worker already applied from its own writes;
+        # tailing the log skips them instead of replacing the row a second time
+        self.applied_changes = set()
+        self.lock = threading.RLock()
+
+    def _install(self, main):
+        """Install a main segment and an empty delta segment"""
+        self.main = main
+        self.delta = IndexSegment.empty()
+        # Truth ID -> (segment, row slot)
+        self.slots = {int(main.ids[slot]): (main, slot) for slot in main.live_slots()}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def refresh(self, force=False):
+        """Catch up with writes from other workers, at most once per refresh interval"""
+        now = time.monotonic()
+        if not force and self.generation is not None and now - self.last_checked < INDEX_REFRESH_SECONDS:
+            return
+
+        with self.lock:
+            self.last_checked = now
+            head = latest_change_id()
+            if self.generation is None or self.generation < compacted_through() or self.generation > head:
+                # Compacted entries may hide deletes, and a log behind the index
+                # was reset under it, so start over from a snapshot
+                self.load(head)
+
+            while self.generation < head:
+                changes = get_changes_since(self.generation, 5000)
+                if not changes:
+                    break
+                self.apply_changes(changes)
+                self.generation = changes[-1].id
+                self.changes_since_snapshot += len(changes)
+            self.applied_changes = {c for c in self.applied_changes if c > self.generation}
+
+            if self.changes_since_snapshot >= INDEX_SNAPSHOT_EVERY:
+                self.save_snapshot()
+
+    def load(self, head=None):
+        """Load the newest usable snapshot, or build the index from the database"""
+        head = latest_change_id() if head is None else head
+        snapshot = self._current_snapshot()
+        if snapshot and compacted_through() <= snapshot[0] <= head:
+            generation, path = snapshot
+        else:
+            self.build_from_database()
+            generation, path = self.generation, self.save_snapshot()
+        self._install_snapshot(path)
+        self.generation = generation
+        self.changes_since_snapshot = 0
+        # The snapshot may predate this worker's own writes; tail them from the log
+        self.applied_changes = set()
+        logger.info(f"Loaded index snapshot at generation {generation} with {len(self)} truths")
+
+    def _install_snapshot(self, path):
+        """Map a snapshot directory in as the main segment"""
+        quantization = {}
+        codes_path = os.path.join(path, 'codes.npy')
+        if INDEX_QUANTIZATION == 'int8' and os.path.exists(codes_path):
+            quantization = {
+                "codes": np.load(codes_path, mmap_mode='r'),
+                "quant_offset": np.load(os.path.join(path, 'quant_offset.npy')),
+                "quant_scale": np.load(os.path.join(path, 'quant_scale.npy')),
+            }
+        with open(os.path.join(path, 'postings.json')) as postings_file:
+            postings = {key: np.array(slots, dtype=np.int32)
+                        for key, slots in json.load(postings_file).items()}
+        main = IndexSegment(np.load(os.path.join(path, 'ids.npy'), mmap_mode='r'),
+                            np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'),
+                            created=np.load(os.path.join(path, 'created.npy')),
+                            postings=postings,
+                            **quantization)
+        with self.lock:
+            self._install(main)
+
+    def build_from_database(self):
+        """Rebuild the index from the embeddings stored on each truth"""
+        generation = latest_change_id()
+        segment = IndexSegment.empty()
+        missing = []
+        query = (db.session.query(Truth.id, Truth.vector_embedding, Truth.topics, Truth.source, Truth.created_at)
+                 .order_by(Truth.id)
+                 .execution_options(yield_per=5000))
+        for truth_id, vector_embedding, topics, source, created_at in query:
+            if not vector_embedding:
+                missing.append(truth_id)
+                continue
+            vector = json.loads(vector_embedding)
+            if len(vector) != dimension:
+                logger.warning(f"Skipping truth ID {truth_id}: embedding has {len(vector)} dimensions")
+                continue
+            segment.append(truth_id, _normalize(vector), *_row_metadata(topics, source, created_at))
+
+        # Persist embeddings for legacy rows so every worker indexes the same vectors
+        computed = {}
+        for truth_id in missing:
+            truth = Truth.query.get(truth_id)
+            if truth is None:
+                continue
+            vector = get_embedding(truth.content)
+            if vector is not None:
+                computed[truth_id] = vector.tolist()
+                segment.append(truth_id, _normalize(vector),
+                               *_row_metadata(truth.topics, truth.source, truth.created_at))
+        if computed:
+            run_write(_store_vectors, computed)
+
+        with self.lock:
+            self._install(segment)
+        self.generation = generation
+        self.changes_since_snapshot = 0
+        logger.info(f"Built index from database with {len(self)} truths at generation {generation}")
+
+    def save_snapshot(self):
+        """Write the index to disk, point CURRENT at it atomically and return its path"""
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        # Unique per writer, so a snapshot is never overwritten while mapped
+        name = f"gen-{self.generation}-{os.getpid()}-{int(time.time() * 1000)}"
+        path = os.path.join(INDEX_DIR, name)
+        tmp_path = f"{path}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        with open(os.path.join(tmp_path, 'FORMAT'), 'w') as format_file:
+            format_file.write(str(INDEX_SNAPSHOT_FORMAT))
+
+        # Snapshots only hold live rows, so loading them yields a compact index
+        with self.lock:
+            ids, vectors, created, postings = self._merged_rows()
+        np.save(os.path.join(tmp_path, 'ids.npy'), ids)
+        np.save(os.path.join(tmp_path, 'vectors.npy'), vectors)
+        np.save(os.path.join(tmp_path, 'created.npy'), created)
+        with open(os.path.join(tmp_path, 'postings.json'), 'w') as postings_file:
+            json.dump({key: slots.tolist() for key, slots in postings.items()}, postings_file)
+        if INDEX_QUANTIZATION == 'int8':
+            codes, quant_offset, quant_scale = quantize_int8(vectors)
+            np.save(os.path.join(tmp_path, 'codes.npy'), codes)
+            np.save(os.path.join(tmp_path, 'quant_offset.npy'), quant_offset)
+            np.save(os.path.join(tmp_path, 'quant_scale.npy'), quant_scale)
+        os.rename(tmp_path, path)
+
+        with open(os.path.join(INDEX_DIR, 'CURRENT.lock'), 'w') as lock_file:
+            # Workers publish one at a time, and never over a newer snapshot
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            current = self._current_snapshot()
+            if current is None or current[0] <= self.generation:
+                pointer_tmp = os.path.join(INDEX_DIR, f"CURRENT.tmp-{os.getpid()}")
+                with open(pointer_tmp, 'w') as pointer:
+                    pointer.write(name)
+                os.replace(pointer_tmp, os.path.join(INDEX_DIR, 'CURRENT'))
+                published = name
+            else:
+                published = os.path.basename(current[1])
+                logger.info(f"Kept newer index snapshot {published} published by another worker")
+            self._remove_old_snapshots(keep={name, published})
+        self.changes_since_snapshot = 0
+        logger.info(f"Saved index snapshot {name}")
+        return path
+
+    def _current_snapshot(self):
+        """Return (generation, path) of the published snapshot, if any in the current format"""
+        try:
+            with open(os.path.join(INDEX_DIR, 'CURRENT')) as pointer:
+                name = pointer.read().strip()
+            with open(os.path.join(INDEX_DIR, name, 'FORMAT')) as format_file:
+                snapshot_format = format_file.read().strip()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if snapshot_format != str(INDEX_SNAPSHOT_FORMAT):
+            logger.info(f"Ignoring index snapshot {name} in format {snapshot_format}")
+            return None
+        return int(name.split('-')[1]), os.path.join(INDEX_DIR, name)
+
+    def _remove_old_snapshots(self, keep):
+        """Delete superseded snapshots; workers still mapping them keep their pages"""
+        cutoff = time.time() - 60  # Leave other workers' fresh snapshots alone
+        for name in os.listdir(INDEX_DIR):
+            path = os.path.join(INDEX_DIR, name)
+            if name.startswith('gen-') and name not in keep and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def apply_changes(self, changes):
+        """Apply a batch of change log entries to the index
+
+        Truths only retagged since the last batch keep their rows and move
+        between topic posting lists; any other change rewrites the row.
+        """
+        latest = {truth_id: change for truth_id, change in collapse_changes(changes).items()
+                  if change.id not in self.applied_changes}
+        rewritten = {change.truth_id for change in changes if change.op != OP_RETAG}
+        with self.lock:
+            retag_ids = [truth_id for truth_id, change in latest.items()
+                         if change.op == OP_RETAG and truth_id not in rewritten and truth_id in self.slots]
+        if retag_ids:
+            self.retag({truth_id: metadata_keys(json.loads(topics) if topics else [], None)
+                        for truth_id, topics in db.session.query(Truth.id, Truth.topics)
+                        .filter(Truth.id.in_(retag_ids))})
+            for truth_id in retag_ids:
+                del latest[truth_id]
+        upsert_ids = [truth_id for truth_id, change in latest.items() if change.op != OP_DELETE]
+        rows = {}
+        if upsert_ids:
+            rows = {row[0]: row[1:] for row in
+                    db.session.query(Truth.id, Truth.vector_embedding, Truth.topics, Truth.source, Truth.created_at)
+                    .filter(Truth.id.in_(upsert_ids))
+                    .all()}
+        for truth_id, change in latest.items():
+            row = rows.get(truth_id)
+            if change.op == OP_DELETE or not row or not row[0]:
+                self.delete(truth_id)
+            else:
+                vector_embedding, topics, source, created_at = row
+                self.upsert(truth_id, json.loads(vector_embedding),
+                            *_row_metadata(topics, source, created_at))
+
+    def upsert(self, truth_id, vector, created=0.0, keys=()):
+        """Insert or replace the vector and filter metadata for a truth in constant amortized time"""
+        vector = _normalize(vector)
+        if vector.shape != (dimension,):
+            logger.warning(f"Not indexing truth ID {truth_id}: embedding has shape {vector.shape}")
+            return
+        with self.lock:
+            location = self.slots.get(truth_id)
+            if location:
+                # Rows are never rewritten in place, so postings never go stale
+                location[0].tombstone(location[1])
+            self.slots[truth_id] = (self.delta, self.delta.append(truth_id, vector, created, keys))
+
+    def retag(self, topic_keys):
+        """Replace the topic posting keys of indexed truths, by ID, without rewriting their rows"""
+        with self.lock:
+            by_segment = {}
+            for truth_id, keys in topic_keys.items():
+                location = self.slots.get(truth_id)
+                if location:
+                    by_segment.setdefault(id(location[0]), (location[0], {}))[1][location[1]] = keys
+            for segment, slot_keys in by_segment.values():
+                segment.replace_topics(slot_keys)
+
+    def delete(self, truth_id):
+        """Tombstone a truth's row; returns whether it was present"""
+        with self.lock:
+            location = self.slots.pop(truth_id, None)
+            if location is None:
+                return False
+            location[0].tombstone(location[1])
+            return True
+
+    def needs_compaction(self):
+        """Check whether the delta segment or the tombstones crossed their thresholds"""
+        return (self.delta.size >= INDEX_DELTA_MAX_ROWS or
+                self.main.tombstones > INDEX_COMPACT_RATIO * max(self.main.size, 1) or
+                self.delta.tombstones > INDEX_COMPACT_RATIO * max(self.delta.size, 64))
+
+    def _merged_rows(self):
+        """Return (ids, vectors, created, postings) of all live rows across both segments"""
+        ids, vectors, created = [], [], []
+        postings = {}
+        offset = 0
+        for segment in (self.main, self.delta):
+            live_slots = segment.live_slots()
+            # Old slot -> slot in the merged rows, -1 for dropped tombstones
+            remap = np.full(segment.size, -1, dtype=np.int64)
+            remap[live_slots] = np.arange(len(live_slots)) + offset
+            ids.append(np.asarray(segment.ids[live_slots]))
+            vectors.append(np.asarray(segment.vectors[live_slots]))
+            created.append(np.asarray(segment.created[live_slots]))
+            for key, slots in segment.postings.items():
+                merged = remap[np.asarray(slots, dtype=np.int64)]
+                merged = merged[merged >= 0]
+                if len(merged):
+                    postings.setdefault(key, []).append(merged)
+            offset += len(live_slots)
+        postings = {key: np.concatenate(parts).astype(np.int32) for key, parts in postings.items()}
+        return np.concatenate(ids), np.vstack(vectors), np.concatenate(created), postings
+
+    def compact(self):
+        """Merge the delta segment into the main segment, dropping tombstones
+
+        Only the maintenance thread mutates the index, so the merged snapshot
+        is written without blocking readers and then mapped in atomically.
+        """
+        removed = self.main.tombstones + self.delta.tombstones
+        self._install_snapshot(self.save_snapshot())
+        logger.info(f"Compacted index: dropped {removed} tombstones, {len(self)} truths remain")
+
+    def search(self, query_vector, top_k, filters=None):
+        """Return the IDs of the top_k truths by cosine similarity across both segments
+
+        filters may restrict results to any of a list of topics, a source
+        prefix and a created_at range (epoch seconds); they are applied as
+        bitmaps inside the scan rather than by over-fetching.
+        """
+        return self.search_batch(np.asarray(query_vector)[np.newaxis, :], top_k, filters)[0]
+
+    def search_batch(self, query_vectors, top_k, filters=None):
+        """Return one ranked ID list per query row, scoring all queries together
+
+        Filters are resolved to masks under the index lock, where the cached
+        bitmaps live; the scans run on frozen views outside it.
+        """
+        query_vectors = np.vstack([_normalize(vector) for vector in query_vectors])
+        with self.lock:
+            if len(self) == 0:
+                return [[] for _ in query_vectors]
+            main, delta = self.main.frozen(filters), self.delta.frozen(filters)
+        main_results = main.top_k_batch(query_vectors, top_k)
+        delta_results = delta.top_k_batch(query_vectors, top_k)
+
+        ranked_ids = []
+        for (main_scores, main_ids), (delta_scores, delta_ids) in zip(main_results, delta_results):
+            scores = np.concatenate([main_scores, delta_scores])
+            ids = np.concatenate([main_ids, delta_ids])
+            ranked = np.argsort(-scores)[:top_k]
+            ranked_ids.append([int(ids[i]) for i in ranked])
+        return ranked_ids
+
+    def stats(self):
+        """Return size and memory figures for monitoring"""
+        with self.lock:
+            return {
+                "truths": len(self),
+                "generation": self.generation,
+                "quantization": "int8" if self.main.codes is not None else "none",
+                "rerank_factor": INDEX_RERANK_FACTOR,
+                "main_rows": self.main.size,
+                "main_tombstones": self.main.tombstones,
+                "delta_rows": self.delta.size,
+                "delta_tombstones": self.delta.tombstones,
+                "scanned_bytes": self.main.memory_bytes() + self.delta.memory_bytes(),
+                "float32_bytes": len(self) * dimension * 4
+            }
+
+    def estimate_recall(self, sample_size=100, top_k=10, rerank_factor=None):
+        """Measure recall@top_k of the quantized main segment against an exact scan
+
+        Queries are stored vectors with noise added, so they behave like
+        near-duplicates rather than exact matches. At most
+        INDEX_RECALL_MAX_SAMPLE queries are run, outside the index lock.
+        """
+        sample_size = max(1, min(sample_size, INDEX_RECALL_MAX_SAMPLE))
+        top_k = max(1, min(top_k, INDEX_RECALL_MAX_K))
+        with self.lock:
+            # The main segment's arrays are immutable; only its live mask changes
+            segment = self.main
+            if segment.codes is None or segment.size == segment.tombstones:
+                return 1.0
+            live = segment.live[:segment.size].copy()
+            size, tombstones = segment.size, segment.tombstones
+        quantized = IndexSegment(segment.ids, segment.vectors, codes=segment.codes,
+                                 quant_offset=segment.quant_offset, quant_scale=segment.quant_scale)
+        exact = IndexSegment(segment.ids, segment.vectors)
+        for view in (quantized, exact):
+            view.live, view.size, view.tombstones = live, size, tombstones
+
+        rng = np.random.default_rng(0)
+        live_slots = np.flatnonzero(live)
+        sample = rng.choice(live_slots, size=min(sample_size, len(live_slots)), replace=False)
+        queries = np.stack([_normalize(np.asarray(segment.vectors[slot]) + rng.normal(0, 0.05, dimension))
+                            for slot in sample])
+        hits = total = 0
+        # Queries are scanned in batches so the score blocks stay small
+        for start in range(0, len(queries), 100):
+            batch = queries[start:start + 100]
+            for (_, expected), (_, found) in zip(exact.top_k_batch(batch, top_k),
+                                                 quantized.top_k_batch(batch, top_k, rerank_factor)):
+                hits += len(set(expected.tolist()) & set(found.tolist()))
+                total += len(expected)
+        return hits / total if total else 1.0
+
+# Index state for this worker process
+truth_index = TruthIndex()
+
+# Index writes are applied by a per-process maintenance thread
+_index_queue = queue.Queue()
+_maintenance_thread = None
+_maintenance_lock = threading.Lock()
+
+def _ensure_maintenance_thread():
+    """Start the maintenance thread in this process if it is not running"""
+    global _maintenance_thread
+    with _maintenance_lock:
+        if _maintenance_thread is None or not _maintenance_thread.is_alive():
+            _maintenance_thread = threading.Thread(
+                target=_maintenance_loop, name="index-maintenance", daemon=True
+            )
+            _maintenance_thread.start()
+
+def _maintenance_loop():
+    """Apply queued index writes, tail the change log and compact segments"""
+    with app.app_context():
+        while True:
+            try:
+                operation = _index_queue.get(timeout=INDEX_REFRESH_SECONDS)
+            except queue.Empty:
+                operation = None
+            try:
+                if operation:
+                    _apply_index_operation(*operation)
+                truth_index.refresh()
+                if truth_index.needs_compaction():
+                    truth_index.compact()
+            except Exception as e:
+                logger.error(f"Error in index maintenance: {e}")
+            finally:
+                # Each pass starts a fresh transaction so other workers' writes are visible
+                db.session.remove()
+                if operation:
+                    _index_queue.task_done()
+
+def _apply_index_operation(op, truth_id, vector_embedding=None, topics=None, source=None, created_at=None,
+                           change_id=None):
+    """Apply one queued index write on the maintenance thread
+
+    change_id is the log entry of the write; once applied here it is skipped
+    when the log is tailed, and if the log got there first the write is skipped.
+    """
+    if change_id is not None and truth_index.generation is not None and change_id <= truth_index.generation:
+        return
+    if op == OP_DELETE:
+        if truth_index.delete(truth_id):
+            logger.info(f"Removed truth ID {truth_id} from index")
+        return
+
+    if vector_embedding:
+        vector = json.loads(vector_embedding)
+    else:
+        # Generate and store the embedding if the caller did not provide one
+        truth = Truth.query.get(truth_id)
+        if truth is None:
+            return
+        vector = get_embedding(truth.content)
+        if vector is None:
+            return
+        run_write(_store_vectors, {truth_id: vector.tolist()})
+    truth_index.upsert(truth_id, vector, *_row_metadata(topics, source, created_at))
+    if change_id is not None:
+        truth_index.applied_changes.add(change_id)
+    logger.info(f"Added truth ID {truth_id} to index")
+
+def wait_for_index_updates():
+    """Block until every queued index write has been applied"""
+    _ensure_maintenance_thread()
+    _index_queue.join()
+
 def initialize_index():
-    """Initialize or load the FAISS index for truth retrieval"""
-    global index, truth_ids, dimension
-    
+    """Initialize or load the shared index for truth retrieval"""
     try:
-        # Temporarily disabled FAISS integration
-        logger.info("FAISS integration is currently disabled")
-        
-        # Load all truths from database
-        truths = Truth.query.all()
-        if not truths:
-            logger.info("No truths found in database to index")
-            return
-        
-        # Just store truth IDs for now
-        truth_ids = [truth.id for truth in truths]
-        logger.info(f"Loaded {len(truth_ids)} truth IDs (no vector index)")
-        
+        truth_index.refresh(force=True)
+        _ensure_maintenance_thread()
+        logger.info(f"Index ready with {len(truth_index)} truths at generation {truth_index.generation}")
     except Exception as e:
         logger.error(f"Error initializing index: {e}")
 
-def search_similar_truths(query_text, top_k=5):
-    """Search for similar truths based on semantic similarity"""
-    global index, truth_ids
-    
-    if len(truth_ids) == 0:
+def search_similar_truths(query_text, top_k=5, topics=None, source_prefix=None,
+                          created_after=None, created_before=None):
+    """Search for similar truths based on semantic similarity
+
+    Optional filters restrict results to any of the given topics, to sources
+    starting with source_prefix, and to a created_at range (datetimes).
+    """
+    return search_similar_truths_batch([query_text], top_k, topics, source_prefix,
+                                       created_after, created_before)[0]
+
+def search_similar_truths_batch(query_texts, top_k=5, topics=None, source_prefix=None,
+                                created_after=None, created_before=None):
+    """Search for several queries at once; returns one truth list per query
+
+    All queries are scored in a single pass over the index and the matching
+    truths are loaded with a single database query.
+    """
+    if truth_index.generation is None:
         initialize_index()
-        if len(truth_ids) == 0:
-            logger.warning("No truths found in database")
-            return []
-    
-    # Since we don't have FAISS, return a random selection of truths instead
-    logger.warning("Using basic search without semantic capabilities")
-    
-    # Get a random selection of truth IDs
-    import random
-    selected_ids = random.sample(truth_ids, min(top_k, len(truth_ids)))
-    
-    # Retrieve truths from database
-    truths = Truth.query.filter(Truth.id.in_(selected_ids)).all()
-    
-    return truths
-
-def add_to_index(truth):
-    """Add a truth to the index (simplified version without FAISS)"""
-    global truth_ids
-    
-    if truth.id not in truth_ids:
-        # Generate a placeholder embedding
-        vector = get_embedding(truth.content)
-        
-        # Save embedding to database (will be useful when we enable FAISS)
-        if vector is not None:
-            truth.set_vector(vector.tolist())
-            db.session.commit()
-        
-        # Add to our simple index
-        truth_ids.append(truth.id)
-        logger.info(f"Added truth ID {truth.id} to simplified index")
-    
+    if len(truth_index) == 0:
+        logger.warning("No truths found in database")
+        return [[] for _ in query_texts]
+
+    # Queries without an embedding get no results but keep their position
+    embeddings = [cached_embedding(text, get_embedding) for text in query_texts]
+    embedded = [i for i, vector in enumerate(embeddings) if vector is not None]
+    ranked_ids = [[] for _ in query_texts]
+    if embedded:
+        filters = {
+            "topics": topics,
+            "source_prefix": source_prefix,
+            "created_after": _epoch(created_after) if created_after else None,
+            "created_before": _epoch(created_before) if created_before else None,
+        }
+        # With cluster probing on, queries that probe the same clusters share a scan
+        groups = {}
+        for i in embedded:
+            probes = probe_labels(_normalize(embeddings[i]))
+            groups.setdefault(tuple(probes) if probes else None, []).append(i)
+        for probes, members in groups.items():
+            group_filters = dict(filters, clusters=list(probes) if probes else None)
+            batch = truth_index.search_batch([embeddings[i] for i in members], top_k, group_filters)
+            for i, ids in zip(members, batch):
+                ranked_ids[i] = ids
+
+    # Retrieve truths from database, keeping the similarity order
+    all_ids = {truth_id for ids in ranked_ids for truth_id in ids}
+    truths = {t.id: t for t in Truth.query.filter(Truth.id.in_(all_ids)).all()} if all_ids else {}
+    return [[truths[truth_id] for truth_id in ids if truth_id in truths] for ids in ranked_ids]
+
+def add_to_index(truth, change_id=None):
+    """Queue a truth for indexing; returns without touching the index or the database
+
+    change_id is the change log entry of the write being indexed, so the
+    index does not apply it again when it tails the log.
+    """
+    _ensure_maintenance_thread()
+    _index_queue.put(("upsert", truth.id, truth.vector_embedding, truth.topics, truth.source, truth.created_at,
+                      change_id))
     return True
 
 def remove_from_index(truth_id):
-    """Remove a truth from the index"""
-    global truth_ids
-    
-    try:
-        if truth_id in truth_ids:
-            # Remove from ids list
-            truth_ids.remove(truth_id)
-            logger.info(f"Removed truth ID {truth_id} from simplified index")
-        else:
-            logger.warning(f"Truth ID {truth_id} not found in index")
-    except Exception as e:
-        logger.error(f"Error removing truth from index: {e}")
+    """Queue a truth for removal from the index"""
+    _ensure_maintenance_thread()
+    _index_queue.put((OP_DELETE, truth_id))
@@ -0,0 +1,91 @@
+"""Baseline schema, as created by db.create_all() before migrations existed
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_baseline'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=64), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('password_hash', sa.String(length=256), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('setting',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('key')
+    )
+    op.create_table('truth',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('source', sa.String(length=256), nullable=True),
+        sa.Column('vector_embedding', sa.Text(), nullable=True),
+        sa.Column('topics', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('model_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('model_name', sa.String(length=128), nullable=False),
+        sa.Column('model_version', sa.String(length=64), nullable=False),
+        sa.Column('model_path', sa.String(length=256), nullable=False),
+        sa.Column('quantization', sa.String(length=32), nullable=True),
+        sa.Column('loaded', sa.Boolean(), nullable=True),
+        sa.Column('last_used', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('call_log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('twilio_sid', sa.String(length=64), nullable=True),
+        sa.Column('call_duration', sa.Integer(), nullable=True),
+        sa.Column('caller_number', sa.String(length=32), nullable=True),
+        sa.Column('transcript', sa.Text(), nullable=True),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('twilio_sid')
+    )
+    op.create_table('replication_node',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('endpoint', sa.String(length=256), nullable=False),
+        sa.Column('api_key', sa.String(length=256), nullable=True),
+        sa.Column('status', sa.String(length=32), nullable=True),
+        sa.Column('last_sync', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('replication_node')
+    op.drop_table('call_log')
+    op.drop_table('model_state')
+    op.drop_table('truth')
+    op.drop_table('setting')
+    op.drop_table('user')
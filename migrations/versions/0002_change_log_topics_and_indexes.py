@@ -0,0 +1,96 @@
+"""Change log, topic tables, new columns and indexes for hot query columns
+
+Databases created with db.create_all() after the baseline may already have
+some of these objects, so every step checks for them first.
+
+Revision ID: 0002_change_log_topics
+Revises: 0001_baseline
+Create Date: 2026-10-19 12:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_change_log_topics'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(inspector, table):
+    return table in inspector.get_table_names()
+
+
+def _has_column(inspector, table, column):
+    return column in [c['name'] for c in inspector.get_columns(table)]
+
+
+def _has_index(inspector, table, index):
+    return index in [i['name'] for i in inspector.get_indexes(table)]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if not _has_column(inspector, 'truth', 'content_hash'):
+        op.add_column('truth', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    if not _has_column(inspector, 'replication_node', 'last_change_id'):
+        op.add_column('replication_node', sa.Column('last_change_id', sa.Integer(), nullable=True))
+
+    if not _has_table(inspector, 'truth_change'):
+        op.create_table('truth_change',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('truth_id', sa.Integer(), nullable=False),
+            sa.Column('op', sa.String(length=16), nullable=False),
+            sa.Column('payload', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sqlite_autoincrement=True
+        )
+    if not _has_table(inspector, 'topic_term'):
+        op.create_table('topic_term',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('term', sa.String(length=128), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('term')
+        )
+    if not _has_table(inspector, 'topic_cluster'):
+        op.create_table('topic_cluster',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('label', sa.String(length=128), nullable=False),
+            sa.Column('centroid', sa.Text(), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('label')
+        )
+
+    # Refresh after the DDL above so new tables are visible
+    inspector = sa.inspect(op.get_bind())
+    for index, table, columns in [
+        ('ix_truth_change_truth_id', 'truth_change', ['truth_id']),
+        ('ix_truth_updated_at', 'truth', ['updated_at']),
+        ('ix_call_log_created_at', 'call_log', ['created_at']),
+        ('ix_model_state_loaded', 'model_state', ['loaded']),
+        ('ix_replication_node_endpoint', 'replication_node', ['endpoint']),
+    ]:
+        if not _has_index(inspector, table, index):
+            op.create_index(index, table, columns, unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_replication_node_endpoint', table_name='replication_node')
+    op.drop_index('ix_model_state_loaded', table_name='model_state')
+    op.drop_index('ix_call_log_created_at', table_name='call_log')
+    op.drop_index('ix_truth_updated_at', table_name='truth')
+    op.drop_index('ix_truth_change_truth_id', table_name='truth_change')
+    op.drop_table('topic_cluster')
+    op.drop_table('topic_term')
+    op.drop_table('truth_change')
+    with op.batch_alter_table('replication_node') as batch_op:
+        batch_op.drop_column('last_change_id')
+    with op.batch_alter_table('truth') as batch_op:
+        batch_op.drop_column('content_hash')
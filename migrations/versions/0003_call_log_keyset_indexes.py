@@ -0,0 +1,35 @@
+"""Composite call log indexes for keyset pagination
+
+Revision ID: 0003_call_log_keyset
+Revises: 0002_change_log_topics
+Create Date: 2026-10-19 15:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_call_log_keyset'
+down_revision = '0002_change_log_topics'
+branch_labels = None
+depends_on = None
+
+
+def _has_index(inspector, table, index):
+    return index in [i['name'] for i in inspector.get_indexes(table)]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for index, columns in [
+        ('ix_call_log_created_at_id', ['created_at', 'id']),
+        ('ix_call_log_caller_created_at', ['caller_number', 'created_at', 'id']),
+    ]:
+        if not _has_index(inspector, 'call_log', index):
+            op.create_index(index, 'call_log', columns, unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_call_log_caller_created_at', table_name='call_log')
+    op.drop_index('ix_call_log_created_at_id', table_name='call_log')
@@ -0,0 +1,38 @@
+"""Daily call rollups kept when old call logs are archived
+
+Revision ID: 0004_call_daily_rollups
+Revises: 0003_call_log_keyset
+Create Date: 2026-10-19 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_call_daily_rollups'
+down_revision = '0003_call_log_keyset'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'call_daily_rollup' not in inspector.get_table_names():
+        op.create_table('call_daily_rollup',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('calls', sa.Integer(), nullable=True),
+            sa.Column('transcribed', sa.Integer(), nullable=True),
+            sa.Column('duration_total', sa.Integer(), nullable=True),
+            sa.Column('duration_calls', sa.Integer(), nullable=True),
+            sa.Column('intents', sa.Text(), nullable=True),
+            sa.Column('top_queries', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('day')
+        )
+
+
+def downgrade():
+    op.drop_table('call_daily_rollup')
@@ -0,0 +1,58 @@
+"""Per-turn voice analytics and their running totals
+
+Revision ID: 0005_voice_analytics
+Revises: 0004_call_daily_rollups
+Create Date: 2026-10-19 17:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_voice_analytics'
+down_revision = '0004_call_daily_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'voice_turn' not in tables:
+        op.create_table('voice_turn',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('call_sid', sa.String(length=64), nullable=True),
+            sa.Column('channel', sa.String(length=16), nullable=True),
+            sa.Column('intent', sa.String(length=16), nullable=False),
+            sa.Column('search_terms', sa.String(length=256), nullable=True),
+            sa.Column('hit', sa.Boolean(), nullable=True),
+            sa.Column('prefetched', sa.Boolean(), nullable=True),
+            sa.Column('latency_ms', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_voice_turn_call_sid', 'voice_turn', ['call_sid'], unique=False)
+        op.create_index('ix_voice_turn_created_at', 'voice_turn', ['created_at'], unique=False)
+    if 'voice_query_stat' not in tables:
+        op.create_table('voice_query_stat',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('intent', sa.String(length=16), nullable=False),
+            sa.Column('search_terms', sa.String(length=256), nullable=False),
+            sa.Column('turns', sa.Integer(), nullable=True),
+            sa.Column('hits', sa.Integer(), nullable=True),
+            sa.Column('misses', sa.Integer(), nullable=True),
+            sa.Column('prefetched', sa.Integer(), nullable=True),
+            sa.Column('latency_ms_total', sa.Integer(), nullable=True),
+            sa.Column('latency_ms_max', sa.Integer(), nullable=True),
+            sa.Column('last_seen_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('intent', 'search_terms')
+        )
+
+
+def downgrade():
+    op.drop_table('voice_query_stat')
+    op.drop_index('ix_voice_turn_created_at', table_name='voice_turn')
+    op.drop_index('ix_voice_turn_call_sid', table_name='voice_turn')
+    op.drop_table('voice_turn')
@@ -0,0 +1,37 @@
+"""Per-call conversation turns
+
+Revision ID: 0006_call_turns
+Revises: 0005_voice_analytics
+Create Date: 2026-10-19 18:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_call_turns'
+down_revision = '0005_voice_analytics'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'call_turn' not in inspector.get_table_names():
+        op.create_table('call_turn',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('call_sid', sa.String(length=64), nullable=False),
+            sa.Column('turn_index', sa.Integer(), nullable=False),
+            sa.Column('transcript', sa.Text(), nullable=True),
+            sa.Column('response', sa.Text(), nullable=True),
+            sa.Column('intent', sa.String(length=16), nullable=True),
+            sa.Column('search_terms', sa.String(length=256), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('call_sid', 'turn_index')
+        )
+
+
+def downgrade():
+    op.drop_table('call_turn')
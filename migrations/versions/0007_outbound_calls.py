@@ -0,0 +1,39 @@
+"""Outbound call status shared by every worker
+
+Revision ID: 0007_outbound_calls
+Revises: 0006_call_turns
+Create Date: 2026-10-19 21:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_outbound_calls'
+down_revision = '0006_call_turns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'outbound_call' not in inspector.get_table_names():
+        op.create_table('outbound_call',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('batch_id', sa.String(length=32), nullable=True),
+            sa.Column('to_number', sa.String(length=32), nullable=False),
+            sa.Column('status', sa.String(length=16), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=True),
+            sa.Column('call_sid', sa.String(length=64), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_outbound_call_batch_id', 'outbound_call', ['batch_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbound_call_batch_id', table_name='outbound_call')
+    op.drop_table('outbound_call')
@@ -0,0 +1,35 @@
+"""Outbound calls keep their TwiML and owning process so queued calls survive a restart
+
+Revision ID: 0008_outbound_call_owner
+Revises: 0007_outbound_calls
+Create Date: 2026-10-19 23:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_outbound_call_owner'
+down_revision = '0007_outbound_calls'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name'] for column in inspector.get_columns('outbound_call')}
+    if 'twiml' not in columns:
+        op.add_column('outbound_call', sa.Column('twiml', sa.Text(), nullable=True))
+    if 'owner' not in columns:
+        op.add_column('outbound_call', sa.Column('owner', sa.String(length=128), nullable=True))
+    indexes = {index['name'] for index in inspector.get_indexes('outbound_call')}
+    if 'ix_outbound_call_owner' not in indexes:
+        op.create_index('ix_outbound_call_owner', 'outbound_call', ['owner'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbound_call_owner', table_name='outbound_call')
+    with op.batch_alter_table('outbound_call') as batch_op:
+        batch_op.drop_column('owner')
+        batch_op.drop_column('twiml')
@@ -0,0 +1,38 @@
+"""Replica-wide truth keys, and an index on content hashes for replication matching
+
+Revision ID: 0009_truth_uid
+Revises: 0008_outbound_call_owner
+Create Date: 2026-10-20 00:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_truth_uid'
+down_revision = '0008_outbound_call_owner'
+branch_labels = None
+depends_on = None
+
+
+def _has_index(inspector, table, index):
+    return index in [i['name'] for i in inspector.get_indexes(table)]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # Existing truths keep a NULL uid until a peer's copy with the same content lends them one
+    if 'uid' not in [c['name'] for c in inspector.get_columns('truth')]:
+        op.add_column('truth', sa.Column('uid', sa.String(length=32), nullable=True))
+    if not _has_index(inspector, 'truth', 'ix_truth_uid'):
+        op.create_index('ix_truth_uid', 'truth', ['uid'], unique=True)
+    if not _has_index(inspector, 'truth', 'ix_truth_content_hash'):
+        op.create_index('ix_truth_content_hash', 'truth', ['content_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_truth_content_hash', table_name='truth')
+    op.drop_index('ix_truth_uid', table_name='truth')
+    with op.batch_alter_table('truth') as batch_op:
+        batch_op.drop_column('uid')
@@ -1,6 +1,9 @@
 from app import db
 from datetime import datetime
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
+import hashlib
+import uuid
 import json
 
 # Add User model from development guidelines
@@ -28,12 +31,26 @@ class Truth(db.Model):
     source = db.Column(db.String(256))
     vector_embedding = db.Column(db.Text)  # JSON string of vector embedding
     topics = db.Column(db.Text)  # JSON string of topics
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of content, used by anti-entropy
+    # Same on every replica of the truth, whatever ID each gave it; replication matches rows on it
+    uid = db.Column(db.String(32), unique=True, index=True, default=lambda: uuid.uuid4().hex)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def __repr__(self):
         return f'<Truth {self.id}>'
     
+    @staticmethod
+    def hash_content(content):
+        """Return the SHA-256 hex digest of truth content"""
+        return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+    
+    @validates('content')
+    def _update_content_hash(self, key, content):
+        """Keep content_hash in step with every content assignment"""
+        self.content_hash = Truth.hash_content(content)
+        return content
+    
     def get_vector(self):
         """Return the vector embedding as a list of floats"""
         if self.vector_embedding:
@@ -62,7 +79,7 @@ class ModelState(db.Model):
     model_version = db.Column(db.String(64), nullable=False)
     model_path = db.Column(db.String(256), nullable=False)
     quantization = db.Column(db.String(32), default="int4")
-    loaded = db.Column(db.Boolean, default=False)
+    loaded = db.Column(db.Boolean, default=False, index=True)
     last_used = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -71,26 +88,204 @@ class ModelState(db.Model):
         return f'<ModelState {self.model_name} v{self.model_version}>'
 
 class CallLog(db.Model):
+    # Keyset pagination seeks on (created_at, id), optionally within one caller
+    __table_args__ = (
+        db.Index('ix_call_log_created_at_id', 'created_at', 'id'),
+        db.Index('ix_call_log_caller_created_at', 'caller_number', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     twilio_sid = db.Column(db.String(64), unique=True)
     call_duration = db.Column(db.Integer)
     caller_number = db.Column(db.String(32))
     transcript = db.Column(db.Text)
     response = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        """Return the row as JSON-ready values, as served by the API and archived"""
+        return {
+            "id": self.id,
+            "twilio_sid": self.twilio_sid,
+            "caller_number": self.caller_number,
+            "call_duration": self.call_duration,
+            "transcript": self.transcript,
+            "response": self.response,
+            "created_at": self.created_at.isoformat()
+        }
 
     def __repr__(self):
         return f'<CallLog {self.id}>'
 
+class CallDailyRollup(db.Model):
+    """Call totals for one UTC day, computed once the day is over"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, unique=True, nullable=False)
+    calls = db.Column(db.Integer, default=0)
+    transcribed = db.Column(db.Integer, default=0)  # Calls with a transcript
+    duration_total = db.Column(db.Integer, default=0)  # Seconds over calls with a known duration
+    duration_calls = db.Column(db.Integer, default=0)
+    intents = db.Column(db.Text)  # JSON object of intent -> calls
+    top_queries = db.Column(db.Text)  # JSON list of [search terms, count], most asked first
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def get_intents(self):
+        """Return intent counts as a dict"""
+        if self.intents:
+            return json.loads(self.intents)
+        return {}
+
+    def get_top_queries(self):
+        """Return the top queries as a list of [search terms, count]"""
+        if self.top_queries:
+            return json.loads(self.top_queries)
+        return []
+
+    def __repr__(self):
+        return f'<CallDailyRollup {self.day}>'
+
+class CallTurn(db.Model):
+    """One exchange of a call's conversation, in order"""
+    __table_args__ = (db.UniqueConstraint('call_sid', 'turn_index'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    call_sid = db.Column(db.String(64), nullable=False)
+    turn_index = db.Column(db.Integer, nullable=False)  # 1 for the first turn of the call
+    transcript = db.Column(db.Text)
+    response = db.Column(db.Text)
+    intent = db.Column(db.String(16))
+    search_terms = db.Column(db.String(256))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Return the turn as JSON-ready values"""
+        return {
+            "turn_index": self.turn_index,
+            "transcript": self.transcript,
+            "response": self.response,
+            "intent": self.intent,
+            "search_terms": self.search_terms,
+            "created_at": self.created_at.isoformat()
+        }
+
+    def __repr__(self):
+        return f'<CallTurn {self.call_sid} #{self.turn_index}>'
+
+class OutboundCall(db.Model):
+    """One queued outbound call, shared so any worker can report its status"""
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(32), index=True)
+    to_number = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, calling, retrying, placed or failed
+    attempts = db.Column(db.Integer, default=0)
+    twiml = db.Column(db.Text)
+    # Process placing the call (host:pid:nonce); another takes over its unfinished calls once it exits
+    owner = db.Column(db.String(128), index=True)
+    call_sid = db.Column(db.String(64))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def job_id(self):
+        return f"job-{self.id}"
+
+    def to_dict(self):
+        """Return the call's status as served by the API"""
+        return {
+            "id": self.job_id,
+            "to": self.to_number,
+            "batch_id": self.batch_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "call_sid": self.call_sid,
+            "error": self.error,
+            "created_at": self.created_at.isoformat()
+        }
+
+    def __repr__(self):
+        return f'<OutboundCall {self.id} {self.status}>'
+
+class VoiceTurn(db.Model):
+    """One answered caller turn, recorded for voice analytics"""
+    id = db.Column(db.Integer, primary_key=True)
+    call_sid = db.Column(db.String(64), index=True)
+    channel = db.Column(db.String(16))  # gather, record, stream or transcription
+    intent = db.Column(db.String(16), nullable=False)  # store, question, statement or none
+    search_terms = db.Column(db.String(256))  # Normalized terms searched for a question
+    hit = db.Column(db.Boolean)  # Whether a truth answered the question; null when no search ran
+    prefetched = db.Column(db.Boolean, default=False)  # Answered from partial speech
+    latency_ms = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<VoiceTurn {self.id} {self.intent}>'
+
+class VoiceQueryStat(db.Model):
+    """Running totals of voice turns per intent and search terms"""
+    __table_args__ = (db.UniqueConstraint('intent', 'search_terms'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    intent = db.Column(db.String(16), nullable=False)
+    search_terms = db.Column(db.String(256), nullable=False, default='')  # Empty for turns without a search
+    turns = db.Column(db.Integer, default=0)
+    hits = db.Column(db.Integer, default=0)
+    misses = db.Column(db.Integer, default=0)
+    prefetched = db.Column(db.Integer, default=0)
+    latency_ms_total = db.Column(db.Integer, default=0)
+    latency_ms_max = db.Column(db.Integer, default=0)
+    last_seen_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<VoiceQueryStat {self.intent} {self.search_terms}>'
+
 class ReplicationNode(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    endpoint = db.Column(db.String(256), nullable=False)
+    endpoint = db.Column(db.String(256), nullable=False, index=True)
     api_key = db.Column(db.String(256))
     status = db.Column(db.String(32), default="inactive")
     last_sync = db.Column(db.DateTime)
+    last_change_id = db.Column(db.Integer, default=0)  # Replication cursor into TruthChange
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return f'<ReplicationNode {self.name}>'
+
+class TruthChange(db.Model):
+    """Append-only log of truth mutations, tailed by replication"""
+    __table_args__ = {'sqlite_autoincrement': True}  # Never reuse sequence numbers
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # Monotonic sequence
+    truth_id = db.Column(db.Integer, nullable=False, index=True)
+    op = db.Column(db.String(16), nullable=False)  # insert, update or delete
+    payload = db.Column(db.Text)  # JSON snapshot kept for deletes, since the row is gone
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TruthChange {self.id} {self.op} {self.truth_id}>'
+
+class TopicTerm(db.Model):
+    """Vocabulary entry used to tag truths with topics"""
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(128), unique=True, nullable=False)  # Lowercase, single-spaced
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TopicTerm {self.term}>'
+
+class TopicCluster(db.Model):
+    """Centroid of an embedding cluster; its label is used as a truth topic"""
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(128), unique=True, nullable=False)
+    centroid = db.Column(db.Text, nullable=False)  # JSON unit vector
+    size = db.Column(db.Integer, default=0)  # Truths assigned when the job ran
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def get_centroid(self):
+        """Return the centroid as a list of floats"""
+        return json.loads(self.centroid)
+
+    def __repr__(self):
+        return f'<TopicCluster {self.label}>'
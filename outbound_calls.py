@@ -0,0 +1,348 @@
+import os
+import time
+import uuid
+import fcntl
+import heapq
+import random
+import socket
+import logging
+import threading
+import requests
+from sqlalchemy import func
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+from app import app, db, schema_is_current
+from models import OutboundCall
+from db_writer import run_write
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Calls created per second and the burst allowed above it; match the account's CPS limit.
+# Every worker process on the host takes its tokens from one shared bucket
+TWILIO_CALLS_PER_SECOND = float(os.environ.get('TWILIO_CALLS_PER_SECOND', '1'))
+TWILIO_CALL_BURST = int(os.environ.get('TWILIO_CALL_BURST', '1'))
+# Threads placing calls, and the most calls that may wait in the queue
+OUTBOUND_WORKERS = int(os.environ.get('OUTBOUND_WORKERS', '4'))
+OUTBOUND_QUEUE_SIZE = int(os.environ.get('OUTBOUND_QUEUE_SIZE', '10000'))
+# Retries for rate limits, server errors and network failures, with
+# exponential backoff and full jitter
+OUTBOUND_MAX_ATTEMPTS = int(os.environ.get('OUTBOUND_MAX_ATTEMPTS', '4'))
+OUTBOUND_RETRY_BASE_SECONDS = float(os.environ.get('OUTBOUND_RETRY_BASE_SECONDS', '1'))
+OUTBOUND_RETRY_MAX_SECONDS = float(os.environ.get('OUTBOUND_RETRY_MAX_SECONDS', '60'))
+# Finished calls kept in the database for status lookups
+OUTBOUND_HISTORY = int(os.environ.get('OUTBOUND_HISTORY', '10000'))
+OUTBOUND_HTTP_TIMEOUT_SECONDS = float(os.environ.get('OUTBOUND_HTTP_TIMEOUT_SECONDS', '10'))
+# Shared token bucket state, and the lock files marking which processes still own queued calls
+OUTBOUND_BUCKET_PATH = os.environ.get('OUTBOUND_BUCKET_PATH', os.path.join(app.instance_path, 'outbound_calls.bucket'))
+OUTBOUND_OWNERS_DIR = os.environ.get('OUTBOUND_OWNERS_DIR', os.path.join(app.instance_path, 'outbound_owners'))
+# How often resume_queued_calls() checks whether migrations have been applied
+OUTBOUND_SCHEMA_WAIT_SECONDS = float(os.environ.get('OUTBOUND_SCHEMA_WAIT_SECONDS', '5'))
+# Replaces https://api.twilio.com, e.g. to point at a local fake Twilio server in tests
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL', '')
+
+TWILIO_API_ORIGIN = 'https://api.twilio.com'
+
+class TwilioBaseUrlHttpClient(TwilioHttpClient):
+    """Twilio HTTP client that sends API requests to TWILIO_API_BASE_URL"""
+
+    def request(self, method, url, *args, **kwargs):
+        if TWILIO_API_BASE_URL and url.startswith(TWILIO_API_ORIGIN):
+            url = TWILIO_API_BASE_URL.rstrip('/') + url[len(TWILIO_API_ORIGIN):]
+        return super().request(method, url, *args, **kwargs)
+
+def twilio_http_client():
+    return TwilioBaseUrlHttpClient(timeout=OUTBOUND_HTTP_TIMEOUT_SECONDS)
+
+class SharedTokenBucket:
+    """Token bucket kept in a locked file, so every process on the host draws from it
+
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, burst, path):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.path = path
+
+    def _take(self):
+        """Take a token if one is available; returns 0, or the seconds until one will be"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), 'r+') as state:
+            fcntl.flock(state, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                tokens, updated = (float(value) for value in state.read().split())
+            except ValueError:
+                tokens, updated = float(self.capacity), now
+            tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            state.seek(0)
+            state.truncate()
+            state.write(f"{tokens} {now}")
+        return wait
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+def is_retryable(error):
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, requests.exceptions.RequestException)
+
+def retry_delay(attempt):
+    """Full-jitter exponential backoff for the given (1-based) attempt"""
+    return random.uniform(0, min(OUTBOUND_RETRY_MAX_SECONDS, OUTBOUND_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+
+def _create_jobs(to_numbers, twiml, batch_id, owner):
+    calls = [OutboundCall(to_number=number, batch_id=batch_id, twiml=twiml, owner=owner, status="queued")
+             for number in to_numbers]
+    db.session.add_all(calls)
+    db.session.flush()
+    # Forget the oldest finished calls; queued ones are always kept
+    oldest_kept = calls[-1].id - OUTBOUND_HISTORY
+    if oldest_kept > 0:
+        OutboundCall.query.filter(OutboundCall.id <= oldest_kept,
+                                  OutboundCall.status.in_(("placed", "failed"))).delete(synchronize_session=False)
+    return [call.id for call in calls]
+
+def _update_job(call_id, **fields):
+    OutboundCall.query.filter_by(id=call_id).update(fields)
+
+def _claim_jobs(owner, new_owner):
+    """Take over the unfinished calls of an owner that has exited
+
+    Queued and retrying calls are placed by new_owner; a call that was being
+    placed may already have rung, so it is failed rather than placed twice.
+    """
+    owned = OutboundCall.query.filter(OutboundCall.owner == owner if owner else OutboundCall.owner.is_(None))
+    owned.filter(OutboundCall.status == "calling").update(
+        {"status": "failed", "error": "Interrupted while placing the call; not retried"}, synchronize_session=False)
+    return owned.filter(OutboundCall.status.in_(("queued", "retrying"))).update(
+        {"owner": new_owner}, synchronize_session=False)
+
+def _call_id(job_id):
+    try:
+        return int(job_id.removeprefix("job-"))
+    except ValueError:
+        return None
+
+class OutboundDispatcher:
+    """Queue of outbound calls placed by a worker pool at the account's CPS limit
+
+    Requests only enqueue; workers take calls from a schedule ordered by due
+    time, so retries wait their backoff without holding a thread. The schedule
+    belongs to the process that queued the call, which holds a lock file for
+    as long as it runs; every call's status is kept in the database so any
+    worker can report it, and resume_queued() takes over the calls of
+    processes that exited before placing them.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.from_number = None
+        self.calls_per_second = TWILIO_CALLS_PER_SECOND
+        self.burst = TWILIO_CALL_BURST
+        self.bucket = SharedTokenBucket(self.calls_per_second, self.burst, OUTBOUND_BUCKET_PATH)
+        self.owner_id = None
+        self.owner_pid = None
+        self.owner_lock = None
+        self.schedule = []
+        self.condition = threading.Condition()
+        self.jobs = {}
+        self.workers = []
+        self.counters = {"queued": 0, "placed": 0, "retried": 0, "failed": 0}
+
+    def configure(self, client, from_number):
+        self.client = client
+        self.from_number = from_number
+
+    def owner(self):
+        """This process's owner ID, locked until it exits (and taken afresh after a fork)"""
+        with self.condition:
+            if self.owner_pid != os.getpid():
+                os.makedirs(OUTBOUND_OWNERS_DIR, exist_ok=True)
+                owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+                lock_file = open(os.path.join(OUTBOUND_OWNERS_DIR, f"{owner_id}.lock"), 'w')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.owner_id, self.owner_pid, self.owner_lock = owner_id, os.getpid(), lock_file
+            return self.owner_id
+
+    def _ensure_workers(self):
+        self.workers = [w for w in self.workers if w.is_alive()]
+        for _ in range(OUTBOUND_WORKERS - len(self.workers)):
+            worker = threading.Thread(target=self._worker_loop, name="outbound-call", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def enqueue(self, to_number, twiml, batch_id=None):
+        """Queue one call; returns its job ID, or None when the queue is full"""
+        job_ids = self.enqueue_many([to_number], twiml, batch_id)
+        return job_ids[0] if job_ids else None
+
+    def enqueue_many(self, to_numbers, twiml, batch_id=None):
+        """Queue the same call to each number; returns the job IDs of those that fit in the queue"""
+        if self.client is None:
+            raise RuntimeError("Twilio client not initialized")
+        with self.condition:
+            to_numbers = list(to_numbers)[:max(OUTBOUND_QUEUE_SIZE - len(self.schedule), 0)]
+        if not to_numbers:
+            return []
+        with app.app_context():
+            call_ids = run_write(_create_jobs, to_numbers, twiml, batch_id, self.owner())
+        self._schedule([{"id": call_id, "to": to_number, "twiml": twiml, "attempts": 0}
+                        for call_id, to_number in zip(call_ids, to_numbers)])
+        return [f"job-{call_id}" for call_id in call_ids]
+
+    def _schedule(self, jobs):
+        with self.condition:
+            now = time.monotonic()
+            for job in jobs:
+                self.jobs[job["id"]] = job
+                heapq.heappush(self.schedule, (now, job["id"]))
+            self.counters["queued"] += len(jobs)
+            self._ensure_workers()
+            self.condition.notify(len(jobs))
+
+    def _owner_exited(self, owner):
+        """Lock an exited owner's file so no other process claims its calls too; returns the file, or None if it still runs"""
+        name = f"{owner}.lock" if owner else "unowned.lock"
+        lock_file = open(os.path.join(OUTBOUND_OWNERS_DIR, name), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def resume_queued(self):
+        """Place the calls left queued or retrying by processes on this host that have exited; returns how many"""
+        if self.client is None:
+            return 0
+        me = self.owner()
+        host = f"{socket.gethostname()}:"
+        owners = [owner for (owner,) in db.session.query(OutboundCall.owner).filter(
+            OutboundCall.status.in_(("queued", "retrying", "calling"))).distinct()]
+        for owner in owners:
+            # Other hosts' processes hold their locks on their own disks
+            if owner == me or (owner and not owner.startswith(host)):
+                continue
+            lock_file = self._owner_exited(owner)
+            if lock_file is None:
+                continue
+            with lock_file:
+                claimed = run_write(_claim_jobs, owner, me)
+                if owner:
+                    os.remove(lock_file.name)
+            if claimed:
+                logger.info(f"Took over {claimed} outbound calls queued by {owner or 'an earlier version'}")
+        with self.condition:
+            scheduled = set(self.jobs)
+        calls = OutboundCall.query.filter(OutboundCall.owner == me,
+                                          OutboundCall.status.in_(("queued", "retrying"))).order_by(OutboundCall.id).all()
+        jobs = [{"id": call.id, "to": call.to_number, "twiml": call.twiml, "attempts": call.attempts or 0}
+                for call in calls if call.id not in scheduled and call.twiml]
+        if jobs:
+            self._schedule(jobs)
+        return len(jobs)
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                if self.schedule:
+                    due, call_id = self.schedule[0]
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self.schedule)
+                        return self.jobs[call_id]
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait()
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            self.bucket.acquire()
+            with app.app_context():
+                self._place(job)
+
+    def _record(self, job, **fields):
+        try:
+            run_write(_update_job, job["id"], **fields)
+        except Exception as e:
+            logger.error(f"Error recording the status of outbound call job-{job['id']}: {e}")
+
+    def _place(self, job):
+        job["attempts"] += 1
+        self._record(job, status="calling", attempts=job["attempts"])
+        try:
+            call = self.client.calls.create(to=job["to"], from_=self.from_number, twiml=job["twiml"])
+        except Exception as e:
+            if is_retryable(e) and job["attempts"] < OUTBOUND_MAX_ATTEMPTS:
+                delay = retry_delay(job["attempts"])
+                self._record(job, status="retrying", error=str(e))
+                with self.condition:
+                    heapq.heappush(self.schedule, (time.monotonic() + delay, job["id"]))
+                    self.counters["retried"] += 1
+                    self.condition.notify()
+                logger.warning(f"Outbound call job-{job['id']} to {job['to']} failed ({e}); retry in {delay:.1f}s")
+            else:
+                self._record(job, status="failed", error=str(e))
+                with self.condition:
+                    del self.jobs[job["id"]]
+                    self.counters["failed"] += 1
+                logger.error(f"Outbound call job-{job['id']} to {job['to']} failed: {e}")
+            return
+        self._record(job, status="placed", call_sid=call.sid, error=None)
+        with self.condition:
+            del self.jobs[job["id"]]
+            self.counters["placed"] += 1
+        logger.info(f"Outbound call initiated to {job['to']}, SID: {call.sid}")
+
+    def job(self, job_id):
+        call_id = _call_id(job_id)
+        call = db.session.get(OutboundCall, call_id) if call_id is not None else None
+        return call.to_dict() if call else None
+
+    def batch(self, batch_id):
+        """Status counts for the calls of one bulk request"""
+        counts = dict(db.session.query(OutboundCall.status, func.count(OutboundCall.id))
+                      .filter_by(batch_id=batch_id).group_by(OutboundCall.status).all())
+        if not counts:
+            return None
+        return {"batch_id": batch_id, "total": sum(counts.values()), **counts}
+
+    def stats(self):
+        """Counters for the calls this worker has queued and placed"""
+        with self.condition:
+            return {
+                **self.counters,
+                "waiting": len(self.schedule),
+                "workers": len(self.workers),
+                "calls_per_second": self.calls_per_second,
+                "burst": self.burst
+            }
+
+dispatcher = OutboundDispatcher()
+
+def _resume_when_migrated():
+    with app.app_context():
+        while not schema_is_current():
+            time.sleep(OUTBOUND_SCHEMA_WAIT_SECONDS)
+        try:
+            resumed = dispatcher.resume_queued()
+        except Exception as e:
+            logger.error(f"Error resuming queued outbound calls: {e}")
+            return
+        if resumed:
+            logger.info(f"Resumed {resumed} queued outbound calls")
+
+def resume_queued_calls():
+    """Place, in the background once migrations are applied, the calls earlier processes left queued"""
+    threading.Thread(target=_resume_when_migrated, name="outbound-resume", daemon=True).start()
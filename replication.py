@@ -1,15 +1,95 @@
 import os
+import uuid
 import logging
 import json
 import requests
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from app import db
-from models import ReplicationNode, Truth, ModelState, Setting
+from models import ReplicationNode, Truth, ModelState, Setting, TruthChange
+from change_log import (
+    OP_INSERT, OP_UPDATE, OP_DELETE, COMPACTED_THROUGH_KEY, record_truth_change, record_delete,
+    latest_change_id, get_changes_since, collapse_changes, compact_change_log, mark_compacted_through
+)
+from db_profile import stream_query, stream_json_object, bulk_insert
+from db_writer import run_write
+from anti_entropy import (
+    MERKLE_LEAF_SIZE, get_node_hashes, local_leaf_count, refresh_leaf_hashes,
+    tree_height, truths_in_leaves, tombstones_in_leaves
+)
+from settings_cache import get_json, bump_settings_version, invalidate_settings
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Maximum number of change log entries shipped per sync request
+REPLICATION_BATCH_SIZE = int(os.environ.get('REPLICATION_BATCH_SIZE', '1000'))
+
+def serialize_truth(truth):
+    """Serialize a truth for replication payloads"""
+    return {
+        "id": truth.id,
+        "uid": truth.uid,
+        "content": truth.content,
+        "source": truth.source,
+        "topics": truth.get_topics(),
+        "created_at": truth.created_at.isoformat(),
+        "updated_at": truth.updated_at.isoformat()
+    }
+
+def sync_id_sequence():
+    """Move the truth ID sequence past IDs inserted explicitly from a peer"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.flush()
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('truth', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM truth), 1))"
+        ))
+
+def serialize_tombstone(change):
+    """Serialize a logged delete for anti-entropy payloads"""
+    return dict(json.loads(change.payload or '{}'), id=change.truth_id,
+                deleted_at=change.created_at.isoformat())
+
+def resolve_leaves(local_truths, local_deleted, remote_truths, remote_deleted):
+    """Decide what each side takes from the other for a set of differing Merkle leaves
+
+    Truths and tombstones are serialized dicts. A delete wins over a row
+    last updated before it, and a row updated after a delete brings the
+    truth back. Returns (pull_truths, pull_deleted, push_truths, push_deleted).
+    """
+    local_rows = {truth["id"]: truth for truth in local_truths}
+    remote_rows = {truth["id"]: truth for truth in remote_truths}
+    local_gone = {tombstone["id"]: tombstone for tombstone in local_deleted}
+    remote_gone = {tombstone["id"]: tombstone for tombstone in remote_deleted}
+
+    def deleted_after(tombstone, truth):
+        if tombstone is None:
+            return False
+        return truth is None or (datetime.fromisoformat(tombstone["deleted_at"])
+                                 >= datetime.fromisoformat(truth["updated_at"]))
+
+    pull_truths = [t for t in remote_truths if not deleted_after(local_gone.get(t["id"]), t)]
+    push_truths = [t for t in local_truths if not deleted_after(remote_gone.get(t["id"]), t)]
+    pull_deleted = [d for d in remote_deleted
+                    if d["id"] not in local_gone and deleted_after(d, local_rows.get(d["id"]))]
+    push_deleted = [d for d in local_deleted
+                    if d["id"] not in remote_gone and deleted_after(d, remote_rows.get(d["id"]))]
+    return pull_truths, pull_deleted, push_truths, push_deleted
+
+def _add_node(**fields):
+    node = ReplicationNode(**fields)
+    db.session.add(node)
+    db.session.flush()
+    return node.id
+
+def _update_node(node_id, **fields):
+    """Stage new values for a replication node row"""
+    ReplicationNode.query.filter_by(id=node_id).update(fields)
+
+def _delete_node(node_id):
+    ReplicationNode.query.filter_by(id=node_id).delete()
+
 # Create blueprint
 replication_bp = Blueprint('replication', __name__, url_prefix='/api/replication')
 
@@ -52,18 +132,11 @@ def add_node():
             return jsonify({"error": "Node with this endpoint already exists"}), 400
         
         # Create new node
-        node = ReplicationNode(
-            name=name,
-            endpoint=endpoint,
-            api_key=api_key,
-            status="inactive"
-        )
-        db.session.add(node)
-        db.session.commit()
+        node_id = run_write(_add_node, name=name, endpoint=endpoint, api_key=api_key, status="inactive")
         
         return jsonify({
             "message": "Node added successfully",
-            "id": node.id
+            "id": node_id
         })
     except Exception as e:
         db.session.rollback()
@@ -78,8 +151,7 @@ def delete_node(node_id):
         return jsonify({"error": "Node not found"}), 404
     
     try:
-        db.session.delete(node)
-        db.session.commit()
+        run_write(_delete_node, node_id)
         return jsonify({"message": "Node deleted successfully"})
     except Exception as e:
         db.session.rollback()
@@ -94,26 +166,34 @@ def sync_node(node_id):
         return jsonify({"error": "Node not found"}), 404
     
     try:
-        # Get truths to sync
-        last_sync = node.last_sync
-        if last_sync:
-            truths = Truth.query.filter(Truth.updated_at > last_sync).all()
+        cursor = node.last_change_id or 0
+        if cursor == 0:
+            # First sync ships a full snapshot and starts tailing from the current head
+            new_cursor = latest_change_id()
+            truths = stream_query(Truth.query.order_by(Truth.id))
+            deleted = []
+            has_more = False
         else:
-            truths = Truth.query.all()
-        
-        # Prepare data for sync
-        sync_data = {
-            "truths": [
-                {
-                    "id": truth.id,
-                    "content": truth.content,
-                    "source": truth.source,
-                    "topics": truth.get_topics(),
-                    "created_at": truth.created_at.isoformat(),
-                    "updated_at": truth.updated_at.isoformat()
-                } for truth in truths
+            # Tail the change log from the node's cursor
+            changes = get_changes_since(cursor, REPLICATION_BATCH_SIZE)
+            new_cursor = changes[-1].id if changes else cursor
+            has_more = len(changes) == REPLICATION_BATCH_SIZE
+
+            latest = collapse_changes(changes)
+            upsert_ids = [truth_id for truth_id, change in latest.items() if change.op != OP_DELETE]
+            truths = Truth.query.filter(Truth.id.in_(upsert_ids)).all() if upsert_ids else []
+            deleted = [
+                dict(json.loads(change.payload or '{}'), id=truth_id)
+                for truth_id, change in latest.items() if change.op == OP_DELETE
             ]
-        }
+        
+        # Prepare data for sync; truths are streamed into the request body
+        synced = []
+        def serialized_truths():
+            for truth in truths:
+                synced.append(truth.id)
+                yield serialize_truth(truth)
+        body = stream_json_object({"deleted": deleted}, {"truths": serialized_truths()})
         
         # Send data to node
         headers = {
@@ -124,82 +204,132 @@ def sync_node(node_id):
         
         response = requests.post(
             f"{node.endpoint}/api/replication/receive",
-            json=sync_data,
+            data=(chunk.encode('utf-8') for chunk in body),
             headers=headers,
             timeout=30
         )
         
         if response.status_code == 200:
             # Update node status
-            node.status = "active"
-            node.last_sync = datetime.utcnow()
-            db.session.commit()
+            run_write(_update_node, node_id, status="active", last_sync=datetime.utcnow(), last_change_id=new_cursor)
             
             return jsonify({
                 "message": "Sync successful",
-                "synced_truths": len(truths)
+                "synced_truths": len(synced),
+                "deleted_truths": len(deleted),
+                "last_change_id": new_cursor,
+                "has_more": has_more
             })
         else:
-            node.status = "error"
-            db.session.commit()
+            run_write(_update_node, node_id, status="error")
             
             return jsonify({
                 "error": f"Sync failed with status code {response.status_code}",
                 "response": response.text
             }), 500
     except Exception as e:
-        node.status = "error"
-        db.session.commit()
+        db.session.rollback()
+        run_write(_update_node, node_id, status="error")
         
         logger.error(f"Error syncing with node: {e}")
         return jsonify({"error": str(e)}), 500
 
-@replication_bp.route('/receive', methods=['POST'])
-def receive_sync():
-    """Receive sync data from another node"""
-    # Verify authentication if needed
+def check_replication_token():
+    """Return an error response if the request carries a token that is not allowed"""
     auth_header = request.headers.get('Authorization')
     if auth_header:
         token = auth_header.split(' ')[1] if len(auth_header.split(' ')) > 1 else None
         # Check against allowed tokens in settings
-        allowed_tokens = Setting.query.filter_by(key="allowed_replication_tokens").first()
+        allowed_tokens = get_json("allowed_replication_tokens")
         if allowed_tokens:
-            if token not in json.loads(allowed_tokens.value):
+            if token not in allowed_tokens:
                 return jsonify({"error": "Unauthorized"}), 403
+    return None
+
+def find_replica(truth_data):
+    """Return the local row holding the same truth as a peer's, or None
+
+    Rows match on their uid, else on identical content. IDs are not enough:
+    two nodes may have given the same ID to different truths.
+    """
+    uid = truth_data.get('uid')
+    if uid:
+        truth = Truth.query.filter_by(uid=uid).first()
+        if truth:
+            return truth
+    content = truth_data.get('content')
+    if content is None:
+        return None
+    truth = Truth.query.filter_by(content_hash=Truth.hash_content(content)).first()
+    if truth and truth.uid is None and uid:
+        # A row from before uids existed takes the peer's, so later updates match it
+        truth.uid = uid
+    return truth
+
+def apply_replicated_truths(truths, deleted):
+    """Apply truths and deletes received from a peer; returns the number of deletes applied"""
+    for truth_data in truths:
+        existing_truth = find_replica(truth_data)
+        
+        if existing_truth:
+            # Update existing truth if received truth is newer
+            if truth_data.get('updated_at'):
+                received_updated = datetime.fromisoformat(truth_data.get('updated_at'))
+                if received_updated > existing_truth.updated_at:
+                    existing_truth.content = truth_data.get('content')
+                    existing_truth.source = truth_data.get('source')
+                    existing_truth.set_topics(truth_data.get('topics', []))
+                    db.session.add(existing_truth)
+                    record_truth_change(existing_truth, OP_UPDATE)
+        else:
+            # Create new truth, keeping the sender's ID so replicas stay aligned
+            # unless a different truth already has it here
+            truth_id = truth_data.get('id')
+            if truth_id is not None and db.session.get(Truth, truth_id):
+                truth_id = None
+            new_truth = Truth(
+                id=truth_id,
+                uid=truth_data.get('uid') or uuid.uuid4().hex,
+                content=truth_data.get('content'),
+                source=truth_data.get('source')
+            )
+            new_truth.set_topics(truth_data.get('topics', []))
+            db.session.add(new_truth)
+            record_truth_change(new_truth, OP_INSERT)
+    
+    # Process replicated deletes
+    deleted_count = 0
+    for delete_data in deleted:
+        truth = find_replica(delete_data)
+        if truth:
+            record_truth_change(truth, OP_DELETE)
+            db.session.delete(truth)
+            deleted_count += 1
+        elif delete_data.get('id') is not None and not db.session.get(Truth, delete_data['id']):
+            # Never held here; keep the tombstone so Merkle leaves match the sender's
+            record_delete(delete_data['id'], delete_data.get('content'), delete_data.get('source'),
+                          delete_data.get('uid'))
+    
+    sync_id_sequence()
+    return deleted_count
+
+@replication_bp.route('/receive', methods=['POST'])
+def receive_sync():
+    """Receive sync data from another node"""
+    # Verify authentication if needed
+    auth_error = check_replication_token()
+    if auth_error:
+        return auth_error
     
     try:
         data = request.json
         truths = data.get('truths', [])
+        deleted = data.get('deleted', [])
         
-        # Process received truths
-        for truth_data in truths:
-            # Check if truth already exists by ID or content
-            existing_truth = Truth.query.filter_by(id=truth_data.get('id')).first()
-            if not existing_truth:
-                existing_truth = Truth.query.filter_by(content=truth_data.get('content')).first()
-            
-            if existing_truth:
-                # Update existing truth if received truth is newer
-                if truth_data.get('updated_at'):
-                    received_updated = datetime.fromisoformat(truth_data.get('updated_at'))
-                    if received_updated > existing_truth.updated_at:
-                        existing_truth.content = truth_data.get('content')
-                        existing_truth.source = truth_data.get('source')
-                        existing_truth.set_topics(truth_data.get('topics', []))
-                        db.session.add(existing_truth)
-            else:
-                # Create new truth
-                new_truth = Truth(
-                    content=truth_data.get('content'),
-                    source=truth_data.get('source')
-                )
-                new_truth.set_topics(truth_data.get('topics', []))
-                db.session.add(new_truth)
-        
-        db.session.commit()
+        deleted_count = run_write(apply_replicated_truths, truths, deleted)
         
         return jsonify({
-            "message": f"Successfully received {len(truths)} truths"
+            "message": f"Successfully received {len(truths)} truths and {deleted_count} deletes"
         })
     except Exception as e:
         db.session.rollback()
@@ -217,23 +347,14 @@ def clone_system():
         return jsonify({"error": "Target endpoint is required"}), 400
     
     try:
-        # Collect all system data
-        truths = Truth.query.all()
+        # Collect all system data; truths are streamed from a server-side cursor
+        truths = stream_query(Truth.query.order_by(Truth.id))
         model_states = ModelState.query.all()
         settings = Setting.query.all()
         
         # Prepare data for cloning
+        clone_cursor = latest_change_id()
         clone_data = {
-            "truths": [
-                {
-                    "id": truth.id,
-                    "content": truth.content,
-                    "source": truth.source,
-                    "topics": truth.get_topics(),
-                    "created_at": truth.created_at.isoformat(),
-                    "updated_at": truth.updated_at.isoformat()
-                } for truth in truths
-            ],
             "model_states": [
                 {
                     "model_name": ms.model_name,
@@ -259,28 +380,29 @@ def clone_system():
         if api_key:
             headers["Authorization"] = f"Bearer {api_key}"
         
+        body = stream_json_object(clone_data, {"truths": (serialize_truth(truth) for truth in truths)})
         response = requests.post(
             f"{target_endpoint}/api/replication/initialize-clone",
-            json=clone_data,
+            data=(chunk.encode('utf-8') for chunk in body),
             headers=headers,
             timeout=60
         )
         
         if response.status_code == 200:
             # Add as replication node
-            node = ReplicationNode(
+            node_id = run_write(
+                _add_node,
                 name=f"Clone-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}",
                 endpoint=target_endpoint,
                 api_key=api_key,
                 status="active",
-                last_sync=datetime.utcnow()
+                last_sync=datetime.utcnow(),
+                last_change_id=clone_cursor
             )
-            db.session.add(node)
-            db.session.commit()
             
             return jsonify({
                 "message": "Clone successful",
-                "node_id": node.id
+                "node_id": node_id
             })
         else:
             return jsonify({
@@ -291,6 +413,74 @@ def clone_system():
         logger.error(f"Error cloning system: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _replace_with_clone(truths, model_states, settings):
+    """Stage the replacement of this node's truths, model states and settings with a clone's"""
+    # Clear existing data (optional). The replaced truths are logged as
+    # deletes, so peers tailing this node's log drop them too
+    now = datetime.utcnow()
+    changes = [{"truth_id": truth_id, "op": OP_DELETE, "created_at": now,
+                "payload": json.dumps({"content": content, "source": source, "uid": uid})}
+               for truth_id, content, source, uid in
+               db.session.query(Truth.id, Truth.content, Truth.source, Truth.uid).order_by(Truth.id)]
+    db.session.query(Truth).delete()
+    db.session.query(TruthChange).delete()
+    db.session.query(ModelState).delete()
+    db.session.query(Setting).delete()
+    
+    # Import truths in bulk (COPY on Postgres), keeping the sender's IDs
+    rows = []
+    for truth_data in truths:
+        if truth_data.get('id') is None:
+            new_truth = Truth(uid=truth_data.get('uid') or uuid.uuid4().hex,
+                              content=truth_data.get('content'), source=truth_data.get('source'))
+            new_truth.set_topics(truth_data.get('topics', []))
+            db.session.add(new_truth)
+            record_truth_change(new_truth, OP_INSERT)
+            continue
+        rows.append({
+            "id": truth_data['id'],
+            "uid": truth_data.get('uid') or uuid.uuid4().hex,
+            "content": truth_data.get('content'),
+            "source": truth_data.get('source'),
+            "topics": json.dumps(truth_data.get('topics', [])),
+            "content_hash": Truth.hash_content(truth_data.get('content')),
+            "created_at": datetime.fromisoformat(truth_data['created_at']) if truth_data.get('created_at') else now,
+            "updated_at": datetime.fromisoformat(truth_data['updated_at']) if truth_data.get('updated_at') else now
+        })
+    bulk_insert(db.session, Truth, rows,
+                ["id", "uid", "content", "source", "topics", "content_hash", "created_at", "updated_at"])
+    sync_id_sequence()
+    changes.extend({"truth_id": row["id"], "op": OP_INSERT, "payload": None, "created_at": now}
+                   for row in rows)
+    bulk_insert(db.session, TruthChange, changes, ["truth_id", "op", "payload", "created_at"])
+    
+    # Import model states
+    for ms_data in model_states:
+        new_ms = ModelState(
+            model_name=ms_data.get('model_name'),
+            model_version=ms_data.get('model_version'),
+            model_path=ms_data.get('model_path'),
+            quantization=ms_data.get('quantization'),
+            loaded=ms_data.get('loaded', False)
+        )
+        db.session.add(new_ms)
+    
+    # Import settings; the sender's change log position does not apply here
+    for setting_data in settings:
+        if setting_data.get('key') == COMPACTED_THROUGH_KEY:
+            continue
+        new_setting = Setting(
+            key=setting_data.get('key'),
+            value=setting_data.get('value'),
+            description=setting_data.get('description')
+        )
+        db.session.add(new_setting)
+    # The clone replaced the truths wholesale: readers behind it rebuild
+    # from the truth table rather than tail the log
+    db.session.flush()
+    mark_compacted_through(latest_change_id())
+    bump_settings_version()
+
 @replication_bp.route('/initialize-clone', methods=['POST'])
 def initialize_clone():
     """Initialize this instance as a clone of another system"""
@@ -303,41 +493,8 @@ def initialize_clone():
         model_states = data.get('model_states', [])
         settings = data.get('settings', [])
         
-        # Clear existing data (optional)
-        db.session.query(Truth).delete()
-        db.session.query(ModelState).delete()
-        db.session.query(Setting).delete()
-        
-        # Import truths
-        for truth_data in truths:
-            new_truth = Truth(
-                content=truth_data.get('content'),
-                source=truth_data.get('source')
-            )
-            new_truth.set_topics(truth_data.get('topics', []))
-            db.session.add(new_truth)
-        
-        # Import model states
-        for ms_data in model_states:
-            new_ms = ModelState(
-                model_name=ms_data.get('model_name'),
-                model_version=ms_data.get('model_version'),
-                model_path=ms_data.get('model_path'),
-                quantization=ms_data.get('quantization'),
-                loaded=ms_data.get('loaded', False)
-            )
-            db.session.add(new_ms)
-        
-        # Import settings
-        for setting_data in settings:
-            new_setting = Setting(
-                key=setting_data.get('key'),
-                value=setting_data.get('value'),
-                description=setting_data.get('description')
-            )
-            db.session.add(new_setting)
-        
-        db.session.commit()
+        run_write(_replace_with_clone, truths, model_states, settings)
+        invalidate_settings()
         
         return jsonify({
             "message": "Clone initialization successful",
@@ -349,3 +506,147 @@ def initialize_clone():
         db.session.rollback()
         logger.error(f"Error initializing clone: {e}")
         return jsonify({"error": str(e)}), 500
+
+@replication_bp.route('/changes/compact', methods=['POST'])
+def compact_changes():
+    """Compact change log entries already consumed by every node"""
+    try:
+        removed = run_write(compact_change_log)
+        return jsonify({
+            "message": "Change log compacted",
+            "removed_entries": removed,
+            "latest_change_id": latest_change_id()
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error compacting change log: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@replication_bp.route('/merkle', methods=['POST'])
+def merkle_hashes():
+    """Return Merkle tree hashes over truth ID ranges for anti-entropy"""
+    auth_error = check_replication_token()
+    if auth_error:
+        return auth_error
+    
+    try:
+        data = request.json or {}
+        refresh_leaf_hashes()
+        leaf_count = local_leaf_count()
+        nodes = [(int(level), int(index)) for level, index in data.get('nodes', [])]
+        if not nodes:
+            # Without explicit nodes, return the root of the local tree
+            nodes = [(tree_height(leaf_count), 0)]
+        
+        return jsonify({
+            "leaf_size": MERKLE_LEAF_SIZE,
+            "leaf_count": leaf_count,
+            "nodes": [list(node) for node in nodes],
+            "hashes": get_node_hashes(nodes)
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error computing Merkle hashes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@replication_bp.route('/merkle/rows', methods=['POST'])
+def merkle_rows():
+    """Return the truths and tombstones covered by the given Merkle leaves"""
+    auth_error = check_replication_token()
+    if auth_error:
+        return auth_error
+    
+    try:
+        leaves = (request.json or {}).get('leaves', [])
+        return jsonify({
+            "truths": [serialize_truth(truth) for truth in truths_in_leaves(leaves)],
+            "deleted": [serialize_tombstone(change) for change in tombstones_in_leaves(leaves)]
+        })
+    except Exception as e:
+        logger.error(f"Error loading Merkle leaf rows: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@replication_bp.route('/reconcile/<int:node_id>', methods=['POST'])
+def reconcile_node(node_id):
+    """Reconcile with a diverged node by exchanging Merkle hashes"""
+    node = ReplicationNode.query.get(node_id)
+    if not node:
+        return jsonify({"error": "Node not found"}), 404
+    
+    headers = {
+        "Content-Type": "application/json"
+    }
+    if node.api_key:
+        headers["Authorization"] = f"Bearer {node.api_key}"
+    
+    def remote(path, payload):
+        response = requests.post(
+            f"{node.endpoint}/api/replication/{path}",
+            json=payload,
+            headers=headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    try:
+        remote_root = remote('merkle', {})
+        if remote_root.get('leaf_size') != MERKLE_LEAF_SIZE:
+            return jsonify({"error": "Node uses a different Merkle leaf size"}), 400
+        
+        # Both trees must be walked from the same root
+        refresh_leaf_hashes()
+        leaf_count = max(local_leaf_count(), remote_root.get('leaf_count', 1))
+        
+        # Descend level by level, following only the subtrees whose hashes differ
+        frontier = [(tree_height(leaf_count), 0)]
+        differing_leaves = []
+        hashes_exchanged = 0
+        while frontier:
+            remote_hashes = remote('merkle', {"nodes": [list(n) for n in frontier]})['hashes']
+            local_hashes = get_node_hashes(frontier)
+            hashes_exchanged += len(frontier)
+            
+            next_frontier = []
+            for (level, index), local_hash, remote_hash in zip(frontier, local_hashes, remote_hashes):
+                if local_hash == remote_hash:
+                    continue
+                if level == 0:
+                    differing_leaves.append(index)
+                else:
+                    next_frontier.extend([(level - 1, index * 2), (level - 1, index * 2 + 1)])
+            frontier = next_frontier
+        
+        pulled = pushed = 0
+        if differing_leaves:
+            # Compare both sides' rows and tombstones in the differing ranges;
+            # newer rows win, and deletes are only undone by later updates
+            remote_rows = remote('merkle/rows', {"leaves": differing_leaves})
+            local_truths = [serialize_truth(truth) for truth in truths_in_leaves(differing_leaves)]
+            local_deleted = [serialize_tombstone(change) for change in tombstones_in_leaves(differing_leaves)]
+            pull_truths, pull_deleted, push_truths, push_deleted = resolve_leaves(
+                local_truths, local_deleted, remote_rows['truths'], remote_rows.get('deleted', []))
+            
+            run_write(apply_replicated_truths, pull_truths, pull_deleted)
+            pulled = len(pull_truths) + len(pull_deleted)
+            
+            # Push the local side so the node converges the same way
+            remote('receive', {"truths": push_truths, "deleted": push_deleted})
+            pushed = len(push_truths) + len(push_deleted)
+        
+        run_write(_update_node, node_id, status="active", last_sync=datetime.utcnow())
+        
+        return jsonify({
+            "message": "Reconciliation successful",
+            "hashes_compared": hashes_exchanged,
+            "differing_ranges": len(differing_leaves),
+            "pulled_truths": pulled,
+            "pushed_truths": pushed
+        })
+    except Exception as e:
+        db.session.rollback()
+        run_write(_update_node, node_id, status="error")
+        
+        logger.error(f"Error reconciling with node: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cross-encoder used for second-stage scoring; loaded in the background the
+# first time a search asks for reranking, with lexical scoring until then
+RERANKER_MODEL = os.environ.get('RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANKER_ENABLED = os.environ.get('RERANKER_ENABLED', 'true').lower() == 'true'
+# Candidate count bounds for one rerank call
+RERANK_MAX_CANDIDATES = int(os.environ.get('RERANK_MAX_CANDIDATES', '20'))
+RERANK_MIN_CANDIDATES = int(os.environ.get('RERANK_MIN_CANDIDATES', '3'))
+# Time a rerank call may spend scoring; the candidate count shrinks to fit it
+RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS', '50'))
+# Weight of the latest measurement in the per-pair cost average
+RERANK_EWMA_ALPHA = 0.2
+
+cross_encoder = None
+_model_lock = threading.Lock()
+_model_failed = False
+_model_loader = None
+_loader_lock = threading.Lock()
+
+# Moving average of scoring cost per (query, passage) pair, shared by all requests
+_stats_lock = threading.Lock()
+_pair_cost_ms = None
+_calls = 0
+_pairs_scored = 0
+
+_token_pattern = re.compile(r"[a-z0-9']+")
+
+def _load_cross_encoder():
+    """Load the cross-encoder once; returns None when it is unavailable"""
+    global cross_encoder, _model_failed
+
+    if cross_encoder is not None or _model_failed or not RERANKER_ENABLED:
+        return cross_encoder
+    with _model_lock:
+        if cross_encoder is None and not _model_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                cross_encoder = CrossEncoder(RERANKER_MODEL, device='cpu')
+                logger.info(f"Loaded cross-encoder {RERANKER_MODEL}")
+            except Exception as e:
+                # Same placeholder behaviour as the LLM: keep serving with a lexical scorer
+                _model_failed = True
+                logger.warning(f"Cross-encoder unavailable ({e}); using lexical overlap scoring")
+    return cross_encoder
+
+def warm_model():
+    """Start loading the cross-encoder in a background thread, if it is not loaded or loading"""
+    global _model_loader
+
+    if cross_encoder is not None or _model_failed or not RERANKER_ENABLED:
+        return
+    with _loader_lock:
+        if _model_loader is None:
+            _model_loader = threading.Thread(target=_load_cross_encoder, name="reranker-load", daemon=True)
+            _model_loader.start()
+
+def is_ready():
+    """Whether the cross-encoder is loaded; starts loading it otherwise, without waiting"""
+    if cross_encoder is None:
+        warm_model()
+    return cross_encoder is not None
+
+def _lexical_scores(query, passages):
+    """Placeholder scorer: share of query terms found in each passage"""
+    query_terms = set(_token_pattern.findall(query.lower()))
+    if not query_terms:
+        return [0.0] * len(passages)
+    scores = []
+    for passage in passages:
+        passage_terms = set(_token_pattern.findall(passage.lower()))
+        scores.append(len(query_terms & passage_terms) / len(query_terms))
+    return scores
+
+def score_pairs(query, passages):
+    """Score every passage against the query in one batched pass
+
+    Uses lexical scoring while the cross-encoder is loading, so a request
+    never waits for the model.
+    """
+    if not is_ready():
+        return _lexical_scores(query, passages)
+    return [float(score) for score in cross_encoder.predict([(query, passage) for passage in passages])]
+
+def candidate_budget(top_k):
+    """Return how many first-stage candidates to fetch for a rerank of top_k
+
+    The count is the number of pairs that fit in RERANK_BUDGET_MS at the
+    recently measured cost per pair, so it shrinks automatically when the
+    process is under load.
+    """
+    ceiling = max(RERANK_MAX_CANDIDATES, top_k)
+    floor = min(max(RERANK_MIN_CANDIDATES, top_k), ceiling)
+    with _stats_lock:
+        pair_cost = _pair_cost_ms
+    if not pair_cost:
+        return ceiling
+    return max(floor, min(ceiling, int(RERANK_BUDGET_MS / pair_cost)))
+
+def _record_cost(elapsed_ms, pairs):
+    """Fold one call's measured cost into the moving average"""
+    global _pair_cost_ms, _calls, _pairs_scored
+
+    with _stats_lock:
+        cost = elapsed_ms / pairs
+        if _pair_cost_ms is None:
+            _pair_cost_ms = cost
+        else:
+            _pair_cost_ms = RERANK_EWMA_ALPHA * cost + (1 - RERANK_EWMA_ALPHA) * _pair_cost_ms
+        _calls += 1
+        _pairs_scored += pairs
+
+def rerank(query, truths, top_k):
+    """Reorder candidate truths by cross-encoder score and keep the best top_k"""
+    if len(truths) <= 1:
+        return list(truths)[:top_k]
+
+    start = time.perf_counter()
+    try:
+        scores = score_pairs(query, [t.content for t in truths])
+    except Exception as e:
+        logger.error(f"Error reranking candidates: {e}")
+        return list(truths)[:top_k]
+    _record_cost((time.perf_counter() - start) * 1000, len(truths))
+
+    # Stable sort keeps first-stage order between equal scores
+    order = sorted(range(len(truths)), key=lambda i: -scores[i])
+    return [truths[i] for i in order[:top_k]]
+
+def rerank_stats():
+    """Return the reranker mode and its cost measurements"""
+    budget = candidate_budget(1)
+    with _stats_lock:
+        return {
+            "model": RERANKER_MODEL if cross_encoder is not None else "lexical",
+            "model_loading": cross_encoder is None and _model_loader is not None and _model_loader.is_alive(),
+            "calls": _calls,
+            "pairs_scored": _pairs_scored,
+            "pair_cost_ms": round(_pair_cost_ms, 4) if _pair_cost_ms else None,
+            "budget_ms": RERANK_BUDGET_MS,
+            "candidate_budget": budget
+        }
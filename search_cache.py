@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from change_log import latest_change_id
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Memory bounds and lifetime of cached entries
+SEARCH_CACHE_EMBEDDING_MB = float(os.environ.get('SEARCH_CACHE_EMBEDDING_MB', '32'))
+SEARCH_CACHE_RESULT_MB = float(os.environ.get('SEARCH_CACHE_RESULT_MB', '16'))
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get('SEARCH_CACHE_TTL_SECONDS', '300'))
+# How often the truth generation is re-read from the database; writes made by
+# this worker invalidate immediately, writes by other workers within this delay
+SEARCH_CACHE_GENERATION_CHECK_SECONDS = float(os.environ.get('SEARCH_CACHE_GENERATION_CHECK_SECONDS', '1'))
+
+# Rough per-entry overhead of the dict, tuple and key objects
+_ENTRY_OVERHEAD_BYTES = 200
+
+class BoundedCache:
+    """LRU cache bounded by an estimate of its memory use, with a TTL per entry"""
+
+    def __init__(self, name, max_bytes, ttl):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expires, generation)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, generation=None):
+        """Return the cached value, or None if missing, expired or from an older generation"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires, entry_generation = entry
+            if expires < time.monotonic() or entry_generation != generation:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size, generation=None):
+        """Store a value, evicting least recently used entries to stay within bounds"""
+        size += _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, time.monotonic() + self.ttl, generation)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+# Query text -> embedding; embeddings do not depend on the truth table
+embedding_cache = BoundedCache("embeddings", int(SEARCH_CACHE_EMBEDDING_MB * 1024 * 1024), SEARCH_CACHE_TTL_SECONDS)
+# (query, type, limit, rerank, filters) -> ranked truth IDs for one truth generation
+result_cache = BoundedCache("results", int(SEARCH_CACHE_RESULT_MB * 1024 * 1024), SEARCH_CACHE_TTL_SECONDS)
+
+_generation = None
+_generation_checked = 0.0
+_generation_lock = threading.Lock()
+
+def normalize_query(text):
+    """Normalize query text so trivially different spellings share cache entries"""
+    return ' '.join(text.lower().split())
+
+def current_generation():
+    """Return the truth generation (change log head), re-read at most once per check interval"""
+    global _generation, _generation_checked
+
+    with _generation_lock:
+        now = time.monotonic()
+        if _generation is None or now - _generation_checked >= SEARCH_CACHE_GENERATION_CHECK_SECONDS:
+            _generation = latest_change_id()
+            _generation_checked = now
+        return _generation
+
+def invalidate_results():
+    """Force the next lookup to re-read the generation; called after local truth writes"""
+    global _generation
+
+    with _generation_lock:
+        _generation = None
+
+def cached_embedding(text, compute):
+    """Return the embedding of a query, computing and caching it on a miss"""
+    key = normalize_query(text)
+    vector = embedding_cache.get(key)
+    if vector is None:
+        vector = compute(text)
+        if vector is not None:
+            embedding_cache.put(key, vector, vector.nbytes + len(key))
+    return vector
+
+def result_key(query, search_type, limit, use_reranker, filters):
+    """Build the result cache key for a search request"""
+    filter_items = []
+    for name, value in sorted(filters.items()):
+        if isinstance(value, list):
+            value = tuple(sorted(value))
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        filter_items.append((name, value))
+    return (normalize_query(query), search_type, limit, bool(use_reranker), tuple(filter_items))
+
+def get_cached_results(key, generation):
+    """Return cached truth IDs for a search key and generation, or None"""
+    return result_cache.get(key, generation)
+
+def cache_results(key, truth_ids, generation):
+    """Remember the truth IDs returned for a search key
+
+    generation must be read before the search ran, so results computed
+    concurrently with a write are never tagged with the newer generation.
+    """
+    result_cache.put(key, list(truth_ids), 8 * len(truth_ids) + len(key[0]), generation)
+
+def cache_stats():
+    """Return hit/miss counters for both cache levels"""
+    return {
+        "embeddings": embedding_cache.stats(),
+        "results": result_cache.stats(),
+        "generation": _generation,
+        "ttl_seconds": SEARCH_CACHE_TTL_SECONDS
+    }
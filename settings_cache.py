@@ -0,0 +1,100 @@
+import os
+import time
+import json
+import logging
+import threading
+from app import db
+from models import Setting
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# How often a worker re-reads the settings version; changes saved by this
+# worker apply immediately, changes saved by other workers within this delay
+SETTINGS_CACHE_CHECK_SECONDS = float(os.environ.get('SETTINGS_CACHE_CHECK_SECONDS', '5'))
+
+VERSION_KEY = "settings_version"
+
+# Every setting as loaded by this worker, and the version it was loaded at
+_settings = None
+_loaded_version = None
+_last_checked = 0.0
+# Decoded JSON values keyed by (key, raw value), so a changed value is decoded again
+_decoded = {}
+_cache_lock = threading.Lock()
+
+def _stored_version():
+    value = db.session.query(Setting.value).filter_by(key=VERSION_KEY).scalar()
+    return int(value) if value else 0
+
+def _current_settings():
+    """Return the cached settings, reloading them if another worker bumped the version"""
+    global _settings, _loaded_version, _last_checked
+
+    with _cache_lock:
+        now = time.monotonic()
+        if _settings is not None and now - _last_checked < SETTINGS_CACHE_CHECK_SECONDS:
+            return _settings
+        version = _stored_version()
+        _last_checked = now
+        if _settings is None or version != _loaded_version:
+            _settings = {key: value for key, value in db.session.query(Setting.key, Setting.value)}
+            _loaded_version = version
+            _decoded.clear()
+            logger.info(f"Loaded {len(_settings)} settings (version {version})")
+        return _settings
+
+def get_setting(key, default=None):
+    """Return a setting's raw string value"""
+    return _current_settings().get(key, default)
+
+def get_int(key, default=0):
+    value = get_setting(key)
+    try:
+        return int(value) if value is not None else default
+    except ValueError:
+        logger.warning(f"Setting {key} is not an integer: {value!r}")
+        return default
+
+def get_bool(key, default=False):
+    value = get_setting(key)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def get_json(key, default=None):
+    """Return a setting decoded from JSON; the result is shared, so do not modify it"""
+    settings = _current_settings()
+    value = settings.get(key)
+    if value is None:
+        return default
+    cache_key = (key, value)
+    decoded = _decoded.get(cache_key)
+    if decoded is None:
+        try:
+            decoded = json.loads(value)
+        except ValueError:
+            logger.warning(f"Setting {key} is not valid JSON")
+            return default
+        _decoded[cache_key] = decoded
+    return decoded
+
+def bump_settings_version():
+    """Stage a settings version bump; call before committing any setting change"""
+    setting = Setting.query.filter_by(key=VERSION_KEY).first()
+    if setting:
+        setting.value = str(int(setting.value) + 1)
+    else:
+        db.session.add(Setting(
+            key=VERSION_KEY,
+            value="1",
+            description="Version of the settings, bumped whenever they are saved"
+        ))
+
+def invalidate_settings():
+    """Reload the settings on the next lookup; called after this worker saves them"""
+    global _settings
+
+    with _cache_lock:
+        _settings = None
+        _decoded.clear()
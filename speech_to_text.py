@@ -0,0 +1,197 @@
+import io
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from app import app, db
+from models import CallLog
+from db_writer import run_write
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Local Whisper model (faster-whisper / CTranslate2), loaded in the background
+# the first time a call needs it
+STT_ENABLED = os.environ.get('STT_ENABLED', 'true').lower() == 'true'
+STT_MODEL = os.environ.get('STT_MODEL', 'base.en')
+STT_DEVICE = os.environ.get('STT_DEVICE', 'cpu')
+STT_COMPUTE_TYPE = os.environ.get('STT_COMPUTE_TYPE', 'int8')
+# Recordings transcribed at once, and CPU threads each of them may use
+STT_WORKERS = int(os.environ.get('STT_WORKERS', '2'))
+STT_CPU_THREADS = int(os.environ.get('STT_CPU_THREADS', '2'))
+STT_BEAM_SIZE = int(os.environ.get('STT_BEAM_SIZE', '1'))
+# Recording downloads: chunk size, size limit and timeout
+STT_DOWNLOAD_CHUNK_BYTES = int(os.environ.get('STT_DOWNLOAD_CHUNK_BYTES', '65536'))
+STT_MAX_RECORDING_BYTES = int(os.environ.get('STT_MAX_RECORDING_BYTES', str(50 * 1024 * 1024)))
+STT_DOWNLOAD_TIMEOUT_SECONDS = float(os.environ.get('STT_DOWNLOAD_TIMEOUT_SECONDS', '30'))
+# Replaces the scheme and host of RecordingUrl, e.g. to fetch from a local
+# stand-in for the Twilio media API when testing offline
+TWILIO_MEDIA_BASE_URL = os.environ.get('TWILIO_MEDIA_BASE_URL', '')
+
+# Recordings are only fetched from the Twilio API, which gets the account credentials
+TWILIO_API_HOST = 'api.twilio.com'
+
+whisper_model = None
+_model_lock = threading.Lock()
+_model_failed = False
+_model_loader = None
+_loader_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+
+# Counters for the status endpoint
+_stats_lock = threading.Lock()
+_stats = {"queued": 0, "transcribed": 0, "failed": 0, "audio_seconds": 0.0, "processing_seconds": 0.0}
+
+def _load_model():
+    """Load the Whisper model once; returns None when it is unavailable"""
+    global whisper_model, _model_failed
+
+    if whisper_model is not None or _model_failed or not STT_ENABLED:
+        return whisper_model
+    with _model_lock:
+        if whisper_model is None and not _model_failed:
+            try:
+                from faster_whisper import WhisperModel
+                # num_workers lets the pool's threads transcribe in parallel on one model
+                whisper_model = WhisperModel(STT_MODEL, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE,
+                                             cpu_threads=STT_CPU_THREADS, num_workers=STT_WORKERS)
+                logger.info(f"Loaded Whisper model {STT_MODEL} ({STT_COMPUTE_TYPE} on {STT_DEVICE})")
+            except Exception as e:
+                _model_failed = True
+                logger.warning(f"Local speech-to-text unavailable: {e}")
+    return whisper_model
+
+def is_available():
+    """Load the model if needed and say whether it is usable; blocks while it loads"""
+    return _load_model() is not None
+
+def warm_model():
+    """Start loading the model in a background thread, if it is not loaded or loading"""
+    global _model_loader
+
+    if whisper_model is not None or _model_failed or not STT_ENABLED:
+        return
+    with _loader_lock:
+        if _model_loader is None:
+            _model_loader = threading.Thread(target=_load_model, name="stt-load", daemon=True)
+            _model_loader.start()
+
+def is_ready():
+    """Whether the model is loaded; starts loading it otherwise, without waiting"""
+    if whisper_model is None:
+        warm_model()
+    return whisper_model is not None
+
+def media_url(recording_url):
+    """Point a RecordingUrl at TWILIO_MEDIA_BASE_URL when one is configured"""
+    if not TWILIO_MEDIA_BASE_URL:
+        return recording_url
+    base = urlsplit(TWILIO_MEDIA_BASE_URL)
+    parts = urlsplit(recording_url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip('/') + parts.path, parts.query, ''))
+
+def is_trusted_recording_url(recording_url):
+    """Whether a RecordingUrl points at the Twilio API or the configured TWILIO_MEDIA_BASE_URL host"""
+    try:
+        parts = urlsplit(recording_url or '')
+        port = parts.port
+    except ValueError:
+        return False
+    if parts.username or parts.password:
+        return False
+    if parts.scheme == 'https' and parts.hostname == TWILIO_API_HOST and port in (None, 443):
+        return True
+    if TWILIO_MEDIA_BASE_URL:
+        base = urlsplit(TWILIO_MEDIA_BASE_URL)
+        return (parts.scheme, parts.netloc) == (base.scheme, base.netloc)
+    return False
+
+def download_recording(recording_url):
+    """Stream a recording into memory in chunks; returns a file-like object"""
+    if not is_trusted_recording_url(recording_url):
+        raise ValueError(f"Refusing to fetch a recording from {recording_url}")
+    auth = None
+    if os.environ.get('TWILIO_ACCOUNT_SID') and os.environ.get('TWILIO_AUTH_TOKEN'):
+        auth = (os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN'])
+    audio = io.BytesIO()
+    with requests.get(media_url(recording_url), auth=auth, stream=True,
+                      timeout=STT_DOWNLOAD_TIMEOUT_SECONDS) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=STT_DOWNLOAD_CHUNK_BYTES):
+            audio.write(chunk)
+            if audio.tell() > STT_MAX_RECORDING_BYTES:
+                raise ValueError(f"Recording is larger than {STT_MAX_RECORDING_BYTES} bytes")
+    audio.seek(0)
+    return audio
+
+def transcribe(audio):
+    """Transcribe a file-like audio object; returns (text, audio seconds)"""
+    model = _load_model()
+    if model is None:
+        raise RuntimeError("Local speech-to-text is not available")
+    # Segments are decoded lazily as the model works through the audio
+    segments, info = model.transcribe(audio, beam_size=STT_BEAM_SIZE, vad_filter=True,
+                                      condition_on_previous_text=False)
+    text = ' '.join(segment.text.strip() for segment in segments)
+    return text.strip(), info.duration
+
+def _store_transcript(call_sid, transcript, response=None):
+    """Stage the transcript (and the answer, if any) on a call log row"""
+    call_log = CallLog.query.filter_by(twilio_sid=call_sid).first()
+    if call_log:
+        call_log.transcript = transcript
+        if response is not None:
+            call_log.response = response
+
+def _process_recording(call_sid, recording_url, caller_number):
+    from voice_pipeline import answer_turn
+
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            transcript, duration = transcribe(download_recording(recording_url))
+            run_write(_store_transcript, call_sid, transcript)
+            response = answer_turn(call_sid, transcript, caller_number, "record") if transcript else None
+            if response is not None:
+                run_write(_store_transcript, call_sid, transcript, response)
+            elapsed = time.perf_counter() - started
+            with _stats_lock:
+                _stats["transcribed"] += 1
+                _stats["audio_seconds"] += duration
+                _stats["processing_seconds"] += elapsed
+            logger.info(f"Transcribed {duration:.1f}s recording for {call_sid} in {elapsed:.2f}s")
+            return transcript, response
+        except Exception as e:
+            db.session.rollback()
+            with _stats_lock:
+                _stats["failed"] += 1
+            logger.error(f"Error transcribing recording for {call_sid}: {e}")
+            raise
+
+def submit_recording(call_sid, recording_url, caller_number=None):
+    """Queue a recording for transcription; returns a future of (transcript, response)
+
+    Returns None when local speech-to-text is disabled, unavailable or
+    still loading, so the webhook never waits for the model.
+    """
+    if not is_ready():
+        return None
+    with _stats_lock:
+        _stats["queued"] += 1
+    return _executor.submit(_process_recording, call_sid, recording_url, caller_number)
+
+def stt_stats():
+    """Return the model in use and the transcription counters"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["model"] = STT_MODEL if whisper_model is not None else None
+    stats["model_loading"] = whisper_model is None and _model_loader is not None and _model_loader.is_alive()
+    stats["workers"] = STT_WORKERS
+    if stats["processing_seconds"]:
+        # Seconds of audio transcribed per second of work
+        stats["speed"] = round(stats["audio_seconds"] / stats["processing_seconds"], 2)
+    return stats
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# The app reads its configuration from the environment when it is imported,
+# so point it at a throwaway database and index before any test imports it
+_tmp = tempfile.mkdtemp(prefix="zion-steward-tests-")
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault('INDEX_DIR', os.path.join(_tmp, 'index'))
+os.environ.setdefault('TWILIO_VALIDATE_SIGNATURES', 'false')
+os.environ.setdefault('CALL_RETENTION_INTERVAL_SECONDS', '0')
+os.environ.setdefault('VOICE_ANALYTICS_ENABLED', 'false')
+os.environ.setdefault('OUTBOUND_BUCKET_PATH', os.path.join(_tmp, 'outbound_calls.bucket'))
+os.environ.setdefault('OUTBOUND_OWNERS_DIR', os.path.join(_tmp, 'outbound_owners'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+import pytest
+from app import app, db
+from models import Truth, TruthChange, Setting, ReplicationNode
+from change_log import (OP_INSERT, OP_DELETE, COMPACTED_THROUGH_KEY, record_truth_change, compact_change_log,
+                        latest_change_id)
+from anti_entropy import MERKLE_LEAF_SIZE, get_node_hashes, tombstones_in_leaves
+from replication import apply_replicated_truths, resolve_leaves
+from db_writer import run_write
+
+T0 = datetime(2026, 1, 1)
+
+def _truth(truth_id, updated_at, content="Faith precedes the miracle"):
+    return {"id": truth_id, "content": content, "source": "test", "topics": [],
+            "created_at": T0.isoformat(), "updated_at": updated_at.isoformat()}
+
+def _tombstone(truth_id, deleted_at, content="Faith precedes the miracle"):
+    return {"id": truth_id, "content": content, "source": "test", "deleted_at": deleted_at.isoformat()}
+
+@pytest.fixture
+def clean_db():
+    with app.app_context():
+        db.session.query(Truth).delete()
+        db.session.query(TruthChange).delete()
+        db.session.query(Setting).filter_by(key=COMPACTED_THROUGH_KEY).delete()
+        db.session.query(ReplicationNode).delete()
+        db.session.commit()
+        yield
+        db.session.rollback()
+        db.session.query(ReplicationNode).delete()
+        db.session.commit()
+
+def test_delete_newer_than_the_row_is_not_undone():
+    local = [_truth(1, T0)]
+    remote_deleted = [_tombstone(1, T0 + timedelta(minutes=1))]
+    pull_truths, pull_deleted, push_truths, push_deleted = resolve_leaves(local, [], [], remote_deleted)
+    assert (pull_truths, push_truths, push_deleted) == ([], [], [])
+    assert [d["id"] for d in pull_deleted] == [1]
+
+def test_update_after_a_delete_brings_the_truth_back():
+    remote = [_truth(1, T0 + timedelta(minutes=2))]
+    local_deleted = [_tombstone(1, T0 + timedelta(minutes=1))]
+    pull_truths, pull_deleted, push_truths, push_deleted = resolve_leaves([], local_deleted, remote, [])
+    assert [t["id"] for t in pull_truths] == [1]
+    assert (pull_deleted, push_truths, push_deleted) == ([], [], [])
+
+def test_deletes_reach_peers_that_never_held_the_truth():
+    local_deleted = [_tombstone(1, T0)]
+    remote_deleted = [_tombstone(2, T0)]
+    pull_truths, pull_deleted, push_truths, push_deleted = resolve_leaves([], local_deleted, [], remote_deleted)
+    assert [d["id"] for d in pull_deleted] == [2]
+    assert [d["id"] for d in push_deleted] == [1]
+
+def test_tombstones_count_in_leaf_hashes(clean_db):
+    truth = Truth(content="Charity is the pure love of Christ", source="test")
+    db.session.add(truth)
+    record_truth_change(truth, OP_INSERT)
+    db.session.commit()
+    leaf = truth.id // MERKLE_LEAF_SIZE
+    with_row = get_node_hashes([(0, leaf)])[0]
+
+    record_truth_change(truth, OP_DELETE)
+    db.session.delete(truth)
+    db.session.commit()
+    deleted = get_node_hashes([(0, leaf)])[0]
+    assert deleted != with_row
+    assert [change.truth_id for change in tombstones_in_leaves([leaf])] == [truth.id]
+
+def test_delete_of_an_unknown_truth_keeps_its_tombstone(clean_db):
+    apply_replicated_truths([], [{"id": 42, "content": "Gone elsewhere", "source": "peer"}])
+    db.session.commit()
+    assert [change.truth_id for change in tombstones_in_leaves([42 // MERKLE_LEAF_SIZE])] == [42]
+
+@pytest.mark.parametrize("node", [(65, 0), (-1, 0), (0, -1), (10, 2 ** 54)])
+def test_out_of_range_tree_nodes_are_rejected(clean_db, node):
+    with pytest.raises(ValueError):
+        get_node_hashes([node])
+    response = app.test_client().post('/api/replication/merkle', json={"nodes": [list(node)]})
+    assert response.status_code == 400
+
+def _add_and_delete(content, truth_id=None):
+    """Insert a truth and delete it again; returns its ID"""
+    truth = Truth(id=truth_id, content=content, source="test")
+    db.session.add(truth)
+    record_truth_change(truth, OP_INSERT)
+    db.session.flush()
+    truth_id = truth.id
+    record_truth_change(truth, OP_DELETE)
+    db.session.delete(truth)
+    db.session.commit()
+    return truth_id
+
+def _node(name, last_change_id):
+    node = ReplicationNode(name=name, endpoint=f"http://{name}.example")
+    db.session.add(node)
+    db.session.flush()
+    # Set after the insert, since the column default would replace a None
+    node.last_change_id = last_change_id
+    db.session.commit()
+
+def test_compaction_keeps_recent_tombstones(clean_db):
+    # Explicit IDs, since SQLite hands a deleted truth's ID to the next insert
+    deleted_id = _add_and_delete("Wickedness never was happiness", 100)
+    kept = Truth(id=101, content="Men are that they might have joy", source="test")
+    db.session.add(kept)
+    record_truth_change(kept, OP_INSERT)
+    db.session.commit()
+    _node("peer", latest_change_id())
+
+    assert run_write(compact_change_log) == 1  # Only the superseded insert
+    leaf = deleted_id // MERKLE_LEAF_SIZE
+    assert deleted_id in [change.truth_id for change in tombstones_in_leaves([leaf])]
+
+    # Once the tombstone is past the retention horizon it is dropped
+    TruthChange.query.filter_by(truth_id=deleted_id).update({"created_at": datetime.utcnow() - timedelta(days=365)})
+    db.session.commit()
+    assert run_write(compact_change_log) == 1
+    assert deleted_id not in [change.truth_id for change in tombstones_in_leaves([leaf])]
+
+def test_node_that_never_pulled_holds_back_compaction(clean_db):
+    _add_and_delete("Wickedness never was happiness")
+    _node("caught-up", latest_change_id())
+    _node("new", None)
+
+    assert run_write(compact_change_log) == 0
+    assert TruthChange.query.count() == 2
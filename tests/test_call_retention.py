@@ -0,0 +1,37 @@
+import os
+import sys
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCHEDULER_SCRIPT = """
+import time
+import app
+import call_retention
+
+def settled_state():
+    for _ in range(200):
+        state = call_retention._last_run.get("state")
+        if state not in (None, "idle", "running"):
+            return state
+        time.sleep(0.05)
+
+# Importing app, as flask db upgrade and scripts do, must not start the scheduler
+print(call_retention._retention_thread is None)
+import main
+print(settled_state())
+with app.app.app_context():
+    app.upgrade_database()
+call_retention._last_run.clear()
+call_retention._wake.set()
+print(settled_state())
+"""
+
+def test_scheduler_starts_with_the_server_and_waits_for_migrations(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'retention.db'}", DB_AUTO_MIGRATE="false",
+               CALL_RETENTION_INTERVAL_SECONDS="3600", INDEX_DIR=str(tmp_path / "index"),
+               CALL_ARCHIVE_DIR=str(tmp_path / "archive"), PYTHONPATH=REPO_DIR)
+    result = subprocess.run([sys.executable, "-c", SCHEDULER_SCRIPT], capture_output=True, text=True,
+                            cwd=tmp_path, env=env, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.splitlines()[-3:] == ["True", "waiting for migrations", "finished"]
@@ -0,0 +1,57 @@
+import pytest
+from app import app, db
+from models import CallTurn
+import conversation_memory
+from conversation_memory import get_session, remember_turn, end_session
+from voice_pipeline import is_follow_up
+
+CALL_SID = "CA-memory-test"
+
+@pytest.fixture
+def call():
+    with app.app_context():
+        CallTurn.query.filter_by(call_sid=CALL_SID).delete()
+        db.session.commit()
+        end_session(CALL_SID)
+        yield CALL_SID
+        end_session(CALL_SID)
+        db.session.rollback()
+
+@pytest.mark.parametrize("transcript", [
+    "Tell me more.", "Can you tell me more about that, please?", "What else?", "Is there anything else?", "Go on",
+])
+def test_follow_ups(transcript):
+    assert is_follow_up(transcript)
+
+@pytest.mark.parametrize("transcript", [
+    "How do I go on a mission?",
+    "What else did Joseph Smith teach about faith?",
+    "Say more about baptism",
+    "What elsewhere",
+])
+def test_new_questions_are_not_follow_ups(transcript):
+    assert not is_follow_up(transcript)
+
+def test_turn_after_another_worker_answered_is_kept(call):
+    session = get_session(call)
+    assert session.turn_count == 0
+    # Two turns answered by another worker while this one held the session
+    for turn_index in (1, 2):
+        db.session.add(CallTurn(call_sid=call, turn_index=turn_index, transcript=f"question {turn_index}",
+                                response=f"answer {turn_index}", intent="statement"))
+    db.session.commit()
+
+    remember_turn(call, "question 3", "answer 3", "statement")
+
+    stored = [row.turn_index for row in CallTurn.query.filter_by(call_sid=call).order_by(CallTurn.turn_index)]
+    assert stored == [1, 2, 3]
+    session = get_session(call)
+    assert session.turn_count == 3
+    assert [turn["transcript"] for turn in session.turns] == ["question 1", "question 2", "question 3"]
+
+def test_turns_in_one_worker_are_numbered_in_order(call):
+    for number in range(1, 4):
+        remember_turn(call, f"question {number}", f"answer {number}", "statement")
+    stored = [row.turn_index for row in CallTurn.query.filter_by(call_sid=call).order_by(CallTurn.turn_index)]
+    assert stored == [1, 2, 3]
+    assert conversation_memory.get_session(call).turn_count == 3
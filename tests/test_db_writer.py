@@ -0,0 +1,42 @@
+import time
+import threading
+import pytest
+from app import app
+import db_writer
+from db_writer import run_write
+
+def test_write_still_running_at_the_timeout_is_waited_for(monkeypatch):
+    monkeypatch.setattr(db_writer, 'DB_WRITE_TIMEOUT_SECONDS', 0.1)
+    def slow_write():
+        time.sleep(0.3)
+        return "committed"
+    with app.app_context():
+        assert run_write(slow_write) == "committed"
+
+def test_write_that_never_started_is_withdrawn(monkeypatch):
+    monkeypatch.setattr(db_writer, 'DB_WRITE_TIMEOUT_SECONDS', 0.1)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def blocking_write():
+        started.set()
+        release.wait(5)
+
+    def blocked():
+        with app.app_context():
+            run_write(blocking_write)
+    thread = threading.Thread(target=blocked)
+    thread.start()
+    try:
+        assert started.wait(5)
+        with app.app_context():
+            with pytest.raises(TimeoutError):
+                run_write(lambda: ran.append(True))
+    finally:
+        release.set()
+        thread.join(5)
+
+    with app.app_context():
+        run_write(lambda: None)
+    assert ran == []
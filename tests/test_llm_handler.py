@@ -0,0 +1,37 @@
+from app import app, db
+from models import CallTurn
+import llm_handler
+from conversation_memory import remember_turn, end_session
+
+CALL_SID = "CA-llm-test"
+
+def test_prior_turn_reaches_the_model_input(monkeypatch):
+    inputs = []
+    def generate(model_input, search_results, max_length=512):
+        inputs.append(model_input)
+        return "Steward reply"
+    monkeypatch.setattr(llm_handler, '_generate', generate)
+
+    with app.app_context():
+        CallTurn.query.filter_by(call_sid=CALL_SID).delete()
+        db.session.commit()
+        end_session(CALL_SID)
+        try:
+            client = app.test_client()
+            first = client.post('/api/llm/generate', json={"prompt": "What is faith?", "call_sid": CALL_SID})
+            assert first.get_json() == {"response": "Steward reply"}
+            assert "Caller: What is faith?" in inputs[0]
+
+            remember_turn(CALL_SID, "Tell me about baptism", "Baptism is by immersion.", "question", "baptism")
+            client.post('/api/llm/generate', json={"prompt": "What is faith?", "call_sid": CALL_SID})
+
+            assert inputs[1] != inputs[0]
+            assert "Caller: Tell me about baptism" in inputs[1]
+            assert "Steward: Baptism is by immersion." in inputs[1]
+            # Another call does not see this call's turns
+            client.post('/api/llm/generate', json={"prompt": "What is faith?", "call_sid": "CA-llm-other"})
+            assert inputs[2] == inputs[0]
+        finally:
+            end_session(CALL_SID)
+            CallTurn.query.filter_by(call_sid=CALL_SID).delete()
+            db.session.commit()
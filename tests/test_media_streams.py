@@ -0,0 +1,207 @@
+import json
+import time
+import wave
+import base64
+import asyncio
+import threading
+import numpy as np
+import pytest
+from twilio.request_validator import RequestValidator
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+from websockets.exceptions import InvalidStatus
+import media_streams
+import voice_prompts
+from media_streams import MediaStreamSession, REPLY_ERROR_TEXT, SAMPLE_RATE, ulaw_decode, ulaw_encode
+
+AUTH_TOKEN = "test-auth-token"
+PUBLIC_URL = "wss://voice.example.com/media-stream"
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+class FakeStream(FakeWebSocket):
+    """A websocket whose incoming messages come from script(stream), an async generator"""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = script
+
+    def __aiter__(self):
+        return self.script(self)
+
+    def events(self):
+        return [message["event"] for message in self.sent]
+
+    async def wait_for(self, event, timeout=5):
+        deadline = time.monotonic() + timeout
+        while event not in self.events():
+            assert time.monotonic() < deadline, f"no {event} sent: {self.events()}"
+            await asyncio.sleep(0.01)
+
+def _frames(count, speech):
+    """count 20 ms media messages of a loud tone, or of silence"""
+    t = np.arange(SAMPLE_RATE // 50) / SAMPLE_RATE
+    samples = (np.sin(2 * np.pi * 440 * t) * 10000 if speech else np.zeros(len(t))).astype(np.int16)
+    payload = base64.b64encode(ulaw_encode(samples)).decode('ascii')
+    return [{"event": "media", "streamSid": "MZ-test", "media": {"payload": payload}}] * count
+
+START = {"event": "start", "streamSid": "MZ-test",
+         "start": {"callSid": "CA-stream-test", "customParameters": {"caller": "+15550000100"}}}
+
+@pytest.fixture
+def turn_stubs(monkeypatch):
+    """Stub STT, answering and synthesis; records what each was given"""
+    calls = {"heard": [], "answered": [], "spoken": [], "prefetched": []}
+    def transcribe(audio):
+        calls["heard"].append(len(audio))
+        return "What is faith"
+    def answer_turn(call_sid, caller, transcript):
+        calls["answered"].append((call_sid, caller, transcript))
+        return "Faith is a hope. It is not a perfect knowledge."
+    def synthesize(text):
+        calls["spoken"].append(text)
+        return np.zeros(160, dtype=np.int16)
+    monkeypatch.setattr(media_streams, '_transcribe_utterance', transcribe)
+    monkeypatch.setattr(media_streams, '_answer_turn', answer_turn)
+    monkeypatch.setattr(media_streams, 'synthesize', synthesize)
+    monkeypatch.setattr(media_streams, 'prefetch_answer', lambda call_sid, text: calls["prefetched"].append(text))
+    monkeypatch.setattr(media_streams, 'MEDIA_STREAM_PARTIAL_MS', 1000)
+    return calls
+
+def test_utterance_is_answered_and_barge_in_clears_the_reply(turn_stubs):
+    async def script(stream):
+        yield json.dumps(START)
+        # Background, 1.2 s of speech, then enough silence to end the utterance
+        for message in _frames(10, False) + _frames(60, True) + _frames(20, False):
+            yield json.dumps(message)
+        await stream.wait_for("mark")
+        assert session.speaking
+        # The caller talks over the reply
+        for message in _frames(5, True):
+            yield json.dumps(message)
+        yield json.dumps({"event": "stop"})
+
+    stream = FakeStream(script)
+    session = MediaStreamSession(stream)
+    asyncio.run(session.run())
+
+    # The utterance keeps the pre-roll and runs to the end of the silence
+    assert len(turn_stubs["heard"]) == 2 and turn_stubs["heard"][-1] >= 60 * 160
+    assert turn_stubs["prefetched"] == ["What is faith"]
+    assert turn_stubs["answered"] == [("CA-stream-test", "+15550000100", "What is faith")]
+    assert turn_stubs["spoken"] == ["Faith is a hope.", "It is not a perfect knowledge."]
+    assert stream.events() == ["media", "media", "mark", "clear"]
+    assert all(message["streamSid"] == "MZ-test" for message in stream.sent)
+    assert not session.speaking and session.turns == 1
+
+def test_barge_in_cancels_a_turn_still_being_answered(turn_stubs, monkeypatch):
+    answering = threading.Event()
+    release = threading.Event()
+    def slow_answer(call_sid, caller, transcript):
+        answering.set()
+        release.wait(5)
+        return "Too late."
+    monkeypatch.setattr(media_streams, '_answer_turn', slow_answer)
+
+    async def script(stream):
+        yield json.dumps(START)
+        for message in _frames(10, True) + _frames(20, False):
+            yield json.dumps(message)
+        while not answering.is_set():
+            await asyncio.sleep(0.01)
+        for message in _frames(5, True):
+            yield json.dumps(message)
+        reply_task = session.reply_task
+        await asyncio.sleep(0)
+        assert reply_task.cancelled()
+        release.set()
+        yield json.dumps({"event": "stop"})
+
+    stream = FakeStream(script)
+    session = MediaStreamSession(stream)
+    try:
+        asyncio.run(session.run())
+    finally:
+        release.set()
+
+    assert turn_stubs["spoken"] == [] and stream.sent == []
+    assert session.turns == 0
+
+def test_rendered_prompt_is_played_without_a_voice(monkeypatch, tmp_path):
+    monkeypatch.setattr(voice_prompts, 'PROMPT_AUDIO_DIR', str(tmp_path))
+    monkeypatch.setattr(voice_prompts, 'VOICE_PROMPT_AUDIO', True)
+    monkeypatch.setattr(voice_prompts, '_recordings', {})
+    monkeypatch.setattr(media_streams, 'synthesize', lambda text: None)
+    recording = (np.sin(np.arange(1600) / 10) * 8000).astype(np.int16)
+    with wave.open(str(tmp_path / voice_prompts._audio_filename("turn_error")), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(recording.tobytes())
+
+    session = MediaStreamSession(FakeWebSocket())
+    asyncio.run(session.speak(REPLY_ERROR_TEXT, time.perf_counter()))
+    # Dynamic text has nothing to play it with, so nothing is sent for it
+    asyncio.run(session.speak("Faith is a hope.", time.perf_counter()))
+
+    events = [message["event"] for message in session.websocket.sent]
+    assert events == ["media", "mark"]
+    played = ulaw_decode(base64.b64decode(session.websocket.sent[0]["media"]["payload"]))
+    assert len(played) == len(recording)
+    assert np.abs(played.astype(np.int32) - recording).max() < 400
+    # The recording may still be playing, so it can still be barged in on
+    assert session.speaking
+
+def test_failed_turn_speaks_the_fallback(monkeypatch):
+    spoken = []
+    def answer_turn(call_sid, caller, transcript):
+        raise RuntimeError("search backend is down")
+    def synthesize(text):
+        spoken.append(text)
+        return np.zeros(160, dtype=np.int16)
+    monkeypatch.setattr(media_streams, '_transcribe_utterance', lambda audio: "What is faith")
+    monkeypatch.setattr(media_streams, '_answer_turn', answer_turn)
+    monkeypatch.setattr(media_streams, 'synthesize', synthesize)
+
+    session = MediaStreamSession(FakeWebSocket())
+    session.call_sid = "CA-stream-test"
+    asyncio.run(session.reply(np.zeros(800, dtype=np.float32)))
+
+    assert " ".join(spoken) == REPLY_ERROR_TEXT
+    events = [message["event"] for message in session.websocket.sent]
+    assert "media" in events and events[-1] == "mark"
+
+def _handshake(headers):
+    """Open a stream to a local server; returns the HTTP status of the upgrade"""
+    async def handler(websocket):
+        await websocket.close()
+
+    async def attempt():
+        async with serve(handler, '127.0.0.1', 0, process_request=media_streams.authorize_stream) as server:
+            port = server.sockets[0].getsockname()[1]
+            try:
+                async with connect(f"ws://127.0.0.1:{port}/media-stream", additional_headers=headers):
+                    return 101
+            except InvalidStatus as e:
+                return e.response.status_code
+    return asyncio.run(attempt())
+
+@pytest.fixture
+def signed_streams(monkeypatch):
+    monkeypatch.setenv('TWILIO_AUTH_TOKEN', AUTH_TOKEN)
+    monkeypatch.setattr(media_streams, 'TWILIO_VALIDATE_SIGNATURES', True)
+    monkeypatch.setattr(media_streams, 'MEDIA_STREAM_URL', PUBLIC_URL)
+
+def test_unsigned_stream_is_refused(signed_streams):
+    assert _handshake({}) == 403
+    forged = RequestValidator("another-token").compute_signature(PUBLIC_URL, {})
+    assert _handshake({'X-Twilio-Signature': forged}) == 403
+
+def test_signed_stream_is_accepted(signed_streams):
+    signature = RequestValidator(AUTH_TOKEN).compute_signature(PUBLIC_URL, {})
+    assert _handshake({'X-Twilio-Signature': signature}) == 101
@@ -0,0 +1,156 @@
+import json
+import time
+import socket
+import threading
+import multiprocessing
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from twilio.rest import Client
+from app import app, db
+from models import OutboundCall
+import outbound_calls
+from outbound_calls import OutboundDispatcher, SharedTokenBucket, twilio_http_client
+
+ACCOUNT_SID = "AC00000000000000000000000000000000"
+CALLS_PATH = f"/2010-04-01/Accounts/{ACCOUNT_SID}/Calls.json"
+
+@pytest.fixture
+def fake_twilio(monkeypatch):
+    """Local stand-in for the Twilio calls API
+
+    Answers each number with the statuses queued for it in order, then 201.
+    """
+    responses = {}
+    attempts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != CALLS_PATH:
+                self.send_error(404)
+                return
+            form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+            to_number = form["To"][0]
+            attempts.append(to_number)
+            queued = responses.get(to_number, [])
+            status = queued.pop(0) if queued else 201
+            if status == 201:
+                body = {"sid": f"CA{len(attempts):032d}", "to": to_number, "status": "queued"}
+            else:
+                body = {"code": 20429 if status == 429 else 21211, "message": f"Error {status}", "status": status}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(outbound_calls, 'TWILIO_API_BASE_URL', f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(outbound_calls, 'TWILIO_CALLS_PER_SECOND', 100.0)
+    monkeypatch.setattr(outbound_calls, 'OUTBOUND_RETRY_BASE_SECONDS', 0.05)
+    dispatcher = OutboundDispatcher()
+    dispatcher.configure(Client(ACCOUNT_SID, "token", http_client=twilio_http_client()), "+15550000000")
+    yield dispatcher, responses, attempts
+    server.shutdown()
+    server.server_close()
+
+def _wait_for(dispatcher, job_id, statuses=("placed", "failed"), timeout=10):
+    deadline = time.monotonic() + timeout
+    with app.app_context():
+        while time.monotonic() < deadline:
+            job = dispatcher.job(job_id)
+            if job and job["status"] in statuses:
+                return job
+            time.sleep(0.02)
+    raise AssertionError(f"{job_id} did not finish: {job}")
+
+def test_rate_limited_call_is_retried(fake_twilio):
+    dispatcher, responses, attempts = fake_twilio
+    responses["+15550000001"] = [429, 429]
+
+    job = _wait_for(dispatcher, dispatcher.enqueue("+15550000001", "<Response/>"))
+
+    assert job["status"] == "placed" and job["attempts"] == 3
+    assert job["call_sid"] and job["error"] is None
+    assert attempts == ["+15550000001"] * 3
+    assert dispatcher.counters["retried"] == 2
+
+def test_client_error_fails_without_retrying(fake_twilio):
+    dispatcher, responses, attempts = fake_twilio
+    responses["+15550000002"] = [400]
+
+    job = _wait_for(dispatcher, dispatcher.enqueue("+15550000002", "<Response/>"))
+
+    assert job["status"] == "failed" and job["attempts"] == 1
+    assert "Error 400" in job["error"]
+    assert len(attempts) == 1
+
+def test_status_is_visible_to_other_workers(fake_twilio):
+    dispatcher, responses, attempts = fake_twilio
+    with app.app_context():
+        job_ids = dispatcher.enqueue_many(["+15550000003", "+15550000004"], "<Response/>", batch_id="batch-shared")
+    for job_id in job_ids:
+        _wait_for(dispatcher, job_id)
+
+    # A worker that did not queue the calls reads their status from the database
+    other = OutboundDispatcher()
+    with app.app_context():
+        assert other.job(job_ids[0])["to"] == "+15550000003"
+        assert other.batch("batch-shared") == {"batch_id": "batch-shared", "total": 2, "placed": 2}
+        assert other.job("job-unknown") is None
+
+def _take_tokens(path, start, count, stamps):
+    bucket = SharedTokenBucket(20.0, 1, path)
+    while time.time() < start:
+        time.sleep(0.001)
+    for _ in range(count):
+        bucket.acquire()
+        stamps.put(time.time())
+
+def test_rate_is_shared_between_processes(tmp_path):
+    context = multiprocessing.get_context('fork')
+    stamps = context.Queue()
+    start = time.time() + 0.5
+    processes = [context.Process(target=_take_tokens, args=(str(tmp_path / "bucket"), start, 5, stamps))
+                 for _ in range(2)]
+    for process in processes:
+        process.start()
+    taken = sorted(stamps.get(timeout=10) for _ in range(10))
+    for process in processes:
+        process.join(10)
+
+    # One bucket of 20 per second for both: 10 tokens, the first from the burst,
+    # take at least 9 / 20 seconds (a bucket per process would take 4 / 20)
+    assert taken[-1] - taken[0] >= 0.4
+
+def test_calls_left_queued_by_an_exited_process_are_placed(fake_twilio):
+    dispatcher, responses, attempts = fake_twilio
+    running = OutboundDispatcher()
+    with app.app_context():
+        exited = f"{socket.gethostname()}:999999:exited"
+        calls = [OutboundCall(to_number="+15550000005", twiml="<Response/>", owner=exited, status="queued"),
+                 OutboundCall(to_number="+15550000006", twiml="<Response/>", owner=exited, status="retrying", attempts=1),
+                 OutboundCall(to_number="+15550000007", twiml="<Response/>", owner=exited, status="calling", attempts=1),
+                 # Still owned by a running process
+                 OutboundCall(to_number="+15550000008", twiml="<Response/>", owner=running.owner(),
+                              status="queued")]
+        db.session.add_all(calls)
+        db.session.commit()
+        job_ids = [call.job_id for call in calls]
+
+        assert dispatcher.resume_queued() == 2
+        # Another worker starting later finds nothing left to take over
+        assert OutboundDispatcher().resume_queued() == 0
+
+    assert _wait_for(dispatcher, job_ids[0])["status"] == "placed"
+    assert _wait_for(dispatcher, job_ids[1])["attempts"] == 2
+    with app.app_context():
+        assert dispatcher.job(job_ids[2])["status"] == "failed"
+        assert dispatcher.job(job_ids[3])["status"] == "queued"
+    assert sorted(attempts) == ["+15550000005", "+15550000006"]
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import subprocess
+import threading
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app import db
+from models import Truth, VoiceTurn, VoiceQueryStat, TopicTerm, Setting
+from db_profile import bulk_insert, normalize_database_url, stream_query
+from voice_analytics import _add_query_stats
+from topic_matcher import VERSION_KEY as VOCABULARY_VERSION_KEY, _insert_new_terms, _bump_version
+
+pgserver = pytest.importorskip("pgserver")
+pytest.importorskip("psycopg2")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Values COPY CSV has to carry through unchanged
+AWKWARD_TEXT = [
+    'He said "be still" and knew',
+    "Line one\nline two\r\nline three",
+    "Commas, quotes \"\" and a trailing backslash \\",
+    "\\N",
+    "",
+    "Ünïcödé — and emoji 🙏",
+]
+
+@pytest.fixture(scope="module")
+def postgres(tmp_path_factory):
+    """A throwaway Postgres server; yields a function returning the URL of a new database"""
+    server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode='stop')
+    created = []
+
+    def new_database(name):
+        server.psql(f"CREATE DATABASE {name};")
+        created.append(name)
+        return normalize_database_url(server.get_uri(name))
+
+    yield new_database
+    for name in created:
+        server.psql(f"DROP DATABASE IF EXISTS {name} WITH (FORCE);")
+    server.cleanup()
+
+def test_bulk_insert_and_stream_query(postgres):
+    engine = create_engine(postgres("bulk_insert_test"))
+    db.metadata.create_all(engine, tables=[Truth.__table__, VoiceTurn.__table__])
+    now = datetime(2026, 1, 2, 3, 4, 5, 678901)
+
+    with Session(engine) as session:
+        truths = [{"id": number + 1, "content": text, "source": None if number % 2 else f"source {number}",
+                   "topics": None, "content_hash": Truth.hash_content(text), "created_at": now, "updated_at": now}
+                  for number, text in enumerate(AWKWARD_TEXT)]
+        bulk_insert(session, Truth, truths,
+                    ["id", "content", "source", "topics", "content_hash", "created_at", "updated_at"])
+        turns = [{"call_sid": "CA1", "channel": "gather", "intent": "question", "search_terms": text or None,
+                  "hit": hit, "prefetched": False, "latency_ms": 12, "created_at": now}
+                 for text, hit in zip(AWKWARD_TEXT, [True, False, None, True, False, None])]
+        bulk_insert(session, VoiceTurn, turns,
+                    ["call_sid", "channel", "intent", "search_terms", "hit", "prefetched", "latency_ms", "created_at"])
+        session.commit()
+
+    with Session(engine) as session:
+        streamed = list(stream_query(session.query(Truth).order_by(Truth.id), batch_rows=2))
+        assert [t.content for t in streamed] == AWKWARD_TEXT
+        assert [t.source for t in streamed] == [t["source"] for t in truths]
+        assert all(t.topics is None and t.created_at == now for t in streamed)
+
+        stored = list(stream_query(session.query(VoiceTurn).order_by(VoiceTurn.id), batch_rows=2))
+        assert [t.search_terms for t in stored] == [t["search_terms"] for t in turns]
+        assert [t.hit for t in stored] == [True, False, None, True, False, None]
+    engine.dispose()
+
+CLONE_SCRIPT = """
+import json, sys
+from app import app, db
+from models import Truth, TruthChange
+client = app.test_client()
+response = client.post('/api/replication/initialize-clone', json=json.load(sys.stdin))
+assert response.status_code == 200, response.get_data(as_text=True)
+with app.app_context():
+    # Truths added after the clone must not collide with the imported IDs
+    added = Truth(content="Added after the clone", source="local")
+    db.session.add(added)
+    db.session.commit()
+    print(json.dumps({
+        "truths": [[t.id, t.content, t.source, t.get_topics()] for t in Truth.query.order_by(Truth.id)],
+        "logged": sorted(c.truth_id for c in TruthChange.query.filter_by(op="insert")),
+    }))
+"""
+
+def test_initialize_clone_round_trip(postgres, tmp_path):
+    url = postgres("clone_test")
+    truths = [{"id": 10 + number, "content": text or "(empty)", "source": None if number % 2 else "peer",
+               "topics": ["faith", 'quoted "topic"'] if number % 3 == 0 else [],
+               "created_at": "2026-01-02T03:04:05.678901", "updated_at": "2026-01-02T03:04:05"}
+              for number, text in enumerate(AWKWARD_TEXT)]
+    env = dict(os.environ, DATABASE_URL=url, INDEX_DIR=str(tmp_path / "index"), PYTHONPATH=REPO_DIR)
+    result = subprocess.run([sys.executable, "-c", CLONE_SCRIPT], input=json.dumps({"truths": truths}),
+                            capture_output=True, text=True, cwd=tmp_path, env=env, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    cloned = json.loads(result.stdout.strip().splitlines()[-1])
+    expected = [[t["id"], t["content"], t["source"], t["topics"]] for t in truths]
+    assert cloned["truths"][:-1] == expected
+    assert cloned["truths"][-1][0] > truths[-1]["id"]
+    assert cloned["logged"] == [t["id"] for t in truths]
+
+def test_concurrent_first_query_stats_are_all_counted(postgres):
+    engine = create_engine(postgres("query_stat_test"))
+    db.metadata.create_all(engine, tables=[VoiceQueryStat.__table__])
+    now = datetime(2026, 1, 2, 3, 4, 5)
+    delta = {"turns": 1, "hits": 1, "misses": 0, "prefetched": 0,
+             "latency_ms_total": 40, "latency_ms_max": 40, "last_seen_at": now}
+    workers = 8
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def flush(number):
+        # Every worker adds the first turn for the same question at the same moment
+        try:
+            with Session(engine) as session:
+                session.connection()
+                barrier.wait()
+                _add_query_stats(session, {("question", "faith"): dict(delta, latency_ms_max=number)})
+                session.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=flush, args=(number,)) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with Session(engine) as session:
+        stat = session.query(VoiceQueryStat).one()
+        assert (stat.turns, stat.hits, stat.latency_ms_total, stat.latency_ms_max) == (workers, workers, 40 * workers, workers - 1)
+    engine.dispose()
+
+def test_concurrent_term_adds_do_not_conflict(postgres):
+    engine = create_engine(postgres("topic_term_test"))
+    db.metadata.create_all(engine, tables=[TopicTerm.__table__, Setting.__table__])
+    workers = 8
+    barrier = threading.Barrier(workers)
+    added = []
+    errors = []
+
+    def add(number):
+        # Every worker adds the same new term at the same moment, plus one of its own
+        try:
+            with Session(engine) as session:
+                session.connection()
+                barrier.wait()
+                terms = _insert_new_terms(session, ["endurance", f"term {number}"])
+                _bump_version(session)
+                session.commit()
+                added.extend(terms)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add, args=(number,)) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(added) == sorted(["endurance"] + [f"term {number}" for number in range(workers)])
+    with Session(engine) as session:
+        assert session.query(TopicTerm).count() == workers + 1
+        assert session.query(TopicTerm).filter(TopicTerm.created_at.is_(None)).count() == 0
+        assert session.query(Setting).filter_by(key=VOCABULARY_VERSION_KEY).one().value == str(workers)
+    engine.dispose()
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+import pytest
+from app import app, db
+from models import Truth, TruthChange
+from replication import apply_replicated_truths
+
+LATER = datetime.utcnow() + timedelta(days=1)
+
+@pytest.fixture
+def local_truth():
+    with app.app_context():
+        db.session.query(Truth).delete()
+        db.session.query(TruthChange).delete()
+        truth = Truth(id=7, content="Faith precedes the miracle", source="local")
+        db.session.add(truth)
+        db.session.commit()
+        yield truth
+        db.session.rollback()
+
+def _peer_truth(content, uid="peer-uid", truth_id=7, updated_at=LATER):
+    return {"id": truth_id, "uid": uid, "content": content, "source": "peer", "topics": [],
+            "created_at": updated_at.isoformat(), "updated_at": updated_at.isoformat()}
+
+def test_peer_truth_with_the_same_id_does_not_overwrite_an_unrelated_row(local_truth):
+    apply_replicated_truths([_peer_truth("Charity never faileth")], [])
+    db.session.commit()
+
+    assert db.session.get(Truth, 7).content == "Faith precedes the miracle"
+    inserted = Truth.query.filter_by(uid="peer-uid").one()
+    assert inserted.content == "Charity never faileth" and inserted.id != 7
+
+    # Later updates of the peer's truth reach its row, not the one holding its ID
+    apply_replicated_truths([_peer_truth("Charity is the pure love of Christ", updated_at=LATER + timedelta(hours=1))], [])
+    db.session.commit()
+    assert db.session.get(Truth, inserted.id).content == "Charity is the pure love of Christ"
+    assert db.session.get(Truth, 7).content == "Faith precedes the miracle"
+    assert Truth.query.count() == 2
+
+def test_delete_of_an_unrelated_truth_with_the_same_id_keeps_the_row(local_truth):
+    assert apply_replicated_truths([], [{"id": 7, "uid": "peer-uid", "content": "Charity never faileth"}]) == 0
+    db.session.commit()
+    assert db.session.get(Truth, 7).content == "Faith precedes the miracle"
+
+def test_row_from_before_uids_matches_on_content(local_truth):
+    Truth.query.filter_by(id=7).update({"uid": None})
+    db.session.commit()
+
+    apply_replicated_truths([_peer_truth("Faith precedes the miracle", truth_id=12)], [])
+    db.session.commit()
+
+    assert Truth.query.count() == 1
+    assert db.session.get(Truth, 7).uid == "peer-uid"
+    assert apply_replicated_truths([], [{"id": 12, "uid": "peer-uid", "content": "Faith precedes the miracle"}]) == 1
@@ -0,0 +1,24 @@
+import threading
+from types import SimpleNamespace
+import reranker
+
+def test_rerank_uses_lexical_scores_while_the_model_loads(monkeypatch):
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_load():
+        loading.set()
+        release.wait(5)
+
+    monkeypatch.setattr(reranker, 'cross_encoder', None)
+    monkeypatch.setattr(reranker, '_model_failed', False)
+    monkeypatch.setattr(reranker, '_model_loader', None)
+    monkeypatch.setattr(reranker, 'RERANKER_ENABLED', True)
+    monkeypatch.setattr(reranker, '_load_cross_encoder', slow_load)
+    truths = [SimpleNamespace(content="Prayer brings peace"), SimpleNamespace(content="Faith precedes the miracle")]
+    try:
+        assert reranker.rerank("what is faith", truths, 1) == [truths[1]]
+        assert loading.wait(5)
+        assert reranker.rerank_stats()["model_loading"]
+    finally:
+        release.set()
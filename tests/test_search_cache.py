@@ -0,0 +1,116 @@
+import zlib
+import numpy as np
+import pytest
+from app import app, db
+from models import Truth, TruthChange
+from change_log import OP_INSERT, record_truth_change
+import memory_manager
+import search_cache
+import truth_store
+from memory_manager import TruthIndex, dimension, wait_for_index_updates
+
+def _embedding(text):
+    """Deterministic bag-of-words embedding, so queries sharing words land near each other"""
+    vector = np.zeros(dimension)
+    for word in search_cache.normalize_query(text).split():
+        vector += np.random.default_rng(zlib.crc32(word.encode())).normal(size=dimension)
+    return vector
+
+@pytest.fixture
+def search_index(tmp_path, monkeypatch):
+    """A fresh index and empty caches over an empty truth table"""
+    index = TruthIndex()
+    monkeypatch.setattr(memory_manager, 'INDEX_DIR', str(tmp_path / "index"))
+    monkeypatch.setattr(memory_manager, 'truth_index', index)
+    monkeypatch.setattr(truth_store, 'truth_index', index)
+    monkeypatch.setattr(memory_manager, 'get_embedding', _embedding)
+    monkeypatch.setattr(truth_store, 'get_embedding', _embedding)
+    search_cache.embedding_cache.clear()
+    search_cache.result_cache.clear()
+    with app.app_context():
+        db.session.query(Truth).delete()
+        db.session.query(TruthChange).delete()
+        db.session.commit()
+        search_cache.invalidate_results()
+        yield index
+        db.session.rollback()
+
+def _add(client, content):
+    response = client.post('/api/truth/add', json={"content": content, "source": "search-test"})
+    assert response.status_code == 200
+    return response.json["id"]
+
+def _catch_up(index):
+    """Wait for local index writes and bring the index generation up to the log head"""
+    wait_for_index_updates()
+    index.refresh(force=True)
+
+def _result_ids(response):
+    assert response.status_code == 200
+    return [truth["id"] for truth in response.json["results"]]
+
+def test_batch_results_match_single_searches_and_share_the_cache(search_index):
+    client = app.test_client()
+    for content in ["Faith is a principle of action", "Prayer brings peace to the soul",
+                    "Charity is the pure love of Christ", "Faith and works go together"]:
+        _add(client, content)
+    _catch_up(search_index)
+    queries = ["faith action", "prayer peace", "love of Christ", "faith action"]
+
+    for search_type in ("semantic", "text"):
+        text_queries = queries if search_type == "semantic" else ["Faith", "peace", "love", "Faith"]
+        # Cold batch first, then the single searches answer from what it cached
+        batch = client.post('/api/truth/search/batch', json={"queries": text_queries, "type": search_type,
+                                                              "limit": 2})
+        assert batch.status_code == 200
+        batch_ids = [[truth["id"] for truth in results] for results in batch.json["results"]]
+        hits = search_cache.result_cache.hits
+        single_ids = [_result_ids(client.get('/api/truth/search',
+                                             query_string={"query": query, "type": search_type, "limit": 2}))
+                      for query in text_queries]
+        assert batch_ids == single_ids
+        assert all(batch_ids)
+        assert search_cache.result_cache.hits - hits == len(text_queries)
+
+    # A batch of queries already searched one by one is answered from the cache too
+    hits = search_cache.result_cache.hits
+    again = client.post('/api/truth/search/batch', json={"queries": queries, "limit": 2})
+    assert [[truth["id"] for truth in results] for results in again.json["results"]] == \
+        [_result_ids(client.get('/api/truth/search', query_string={"query": query, "limit": 2}))
+         for query in queries]
+    assert search_cache.result_cache.hits - hits == 2 * len(queries) - 1
+
+def test_writes_invalidate_cached_results(search_index, monkeypatch):
+    client = app.test_client()
+    first = _add(client, "Faith is a principle of action")
+    _catch_up(search_index)
+    search = lambda search_type: _result_ids(client.get('/api/truth/search', query_string={
+        "query": "faith", "type": search_type, "limit": 5}))
+
+    assert search("text") == [first] and search("semantic") == [first]
+    hits = search_cache.result_cache.hits
+    assert search("text") == [first] and search("semantic") == [first]
+    assert search_cache.result_cache.hits - hits == 2
+
+    # A local add bumps the generation, so neither cached list is served again
+    second = _add(client, "Faith precedes the miracle")
+    _catch_up(search_index)
+    assert sorted(search("text")) == [first, second]
+    assert sorted(search("semantic")) == [first, second]
+
+    response = client.delete(f'/api/truth/delete/{first}')
+    assert response.status_code == 200
+    _catch_up(search_index)
+    assert search("text") == [second] and search("semantic") == [second]
+
+    # Another worker's write is seen once the generation is re-read
+    monkeypatch.setattr(search_cache, 'SEARCH_CACHE_GENERATION_CHECK_SECONDS', 0)
+    truth = Truth(content="Faith without works is dead", source="other-worker")
+    truth.set_vector(_embedding(truth.content).tolist())
+    db.session.add(truth)
+    db.session.flush()
+    record_truth_change(truth, OP_INSERT)
+    db.session.commit()
+    search_index.refresh(force=True)
+    assert sorted(search("text")) == [second, truth.id]
+    assert sorted(search("semantic")) == [second, truth.id]
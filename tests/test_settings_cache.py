@@ -0,0 +1,64 @@
+import pytest
+from app import app, db
+from models import Setting
+import settings_cache
+from settings_cache import get_setting, get_json, bump_settings_version
+
+def _write_elsewhere(key, value, bump=True):
+    """Save a setting the way another worker would, without touching this worker's cache"""
+    setting = Setting.query.filter_by(key=key).first()
+    if setting:
+        setting.value = value
+    else:
+        db.session.add(Setting(key=key, value=value))
+    if bump:
+        bump_settings_version()
+    db.session.commit()
+
+@pytest.fixture
+def version_reads(monkeypatch):
+    reads = []
+    original = settings_cache._stored_version
+    def stored_version():
+        reads.append(True)
+        return original()
+    monkeypatch.setattr(settings_cache, '_stored_version', stored_version)
+    monkeypatch.setattr(settings_cache, 'SETTINGS_CACHE_CHECK_SECONDS', 3600)
+    with app.app_context():
+        settings_cache.invalidate_settings()
+        yield reads
+        db.session.rollback()
+        db.session.query(Setting).filter(Setting.key.in_(["system_prompt", "allowed_replication_tokens"])).delete()
+        db.session.commit()
+        settings_cache.invalidate_settings()
+
+def test_other_workers_changes_load_when_the_version_bumps(version_reads, monkeypatch):
+    _write_elsewhere("system_prompt", "Answer briefly.")
+    assert get_setting("system_prompt") == "Answer briefly."
+    for _ in range(20):
+        get_setting("system_prompt")
+    assert len(version_reads) == 1
+
+    # Within the check interval the cached value is served without a query
+    _write_elsewhere("system_prompt", "Answer in full.")
+    assert get_setting("system_prompt") == "Answer briefly."
+
+    # Once it is checked, the bumped version reloads every setting
+    monkeypatch.setattr(settings_cache, 'SETTINGS_CACHE_CHECK_SECONDS', 0)
+    assert get_setting("system_prompt") == "Answer in full."
+
+    # A value written without a bump is not reloaded, as the version did not change
+    _write_elsewhere("system_prompt", "Unannounced.", bump=False)
+    assert get_setting("system_prompt") == "Answer in full."
+
+def test_saving_settings_applies_at_once_and_redecodes_json(version_reads):
+    _write_elsewhere("allowed_replication_tokens", '["token-a"]')
+    assert get_json("allowed_replication_tokens") == ["token-a"]
+    assert get_json("allowed_replication_tokens") is get_json("allowed_replication_tokens")
+
+    response = app.test_client().post('/api/upgrader/settings', json={
+        "system_prompt": "Be kind.", "allowed_replication_tokens": '["token-b"]'})
+    assert response.status_code == 200
+    # Saved by this worker, so no check interval applies
+    assert get_setting("system_prompt") == "Be kind."
+    assert get_json("allowed_replication_tokens") == ["token-b"]
@@ -0,0 +1,112 @@
+import os
+import wave
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from conftest import FIXTURES_DIR
+from app import app, db
+from models import CallLog
+import speech_to_text
+
+RECORDING_PATH = "/2010-04-01/Accounts/AC00000000000000000000000000000000/Recordings/RE00000000000000000000000000000000"
+RECORDING_URL = "https://api.twilio.com" + RECORDING_PATH
+
+class FakeWhisperModel:
+    """Stands in for WhisperModel: checks it was given the WAV and returns a fixed transcript"""
+
+    def __init__(self, text):
+        self.text = text
+        self.frames = None
+
+    def transcribe(self, audio, **kwargs):
+        with wave.open(audio) as recording:
+            self.frames = recording.getnframes()
+            duration = self.frames / recording.getframerate()
+        return iter([SimpleNamespace(text=f" {self.text}")]), SimpleNamespace(duration=duration)
+
+@pytest.fixture
+def media_server(monkeypatch):
+    """Local stand-in for the Twilio media API serving the WAV fixture"""
+    with open(os.path.join(FIXTURES_DIR, 'recording.wav'), 'rb') as f:
+        recording = f.read()
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if self.path != RECORDING_PATH:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/x-wav')
+            self.send_header('Content-Length', str(len(recording)))
+            self.end_headers()
+            self.wfile.write(recording)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(speech_to_text, 'TWILIO_MEDIA_BASE_URL', f"http://127.0.0.1:{server.server_port}")
+    yield requests_seen
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def call_log():
+    with app.app_context():
+        db.session.add(CallLog(twilio_sid="CA-stt-test", caller_number="+15550100"))
+        db.session.commit()
+    yield "CA-stt-test"
+    with app.app_context():
+        CallLog.query.filter_by(twilio_sid="CA-stt-test").delete()
+        db.session.commit()
+
+def test_process_recording_through_media_base_url(media_server, call_log, monkeypatch):
+    model = FakeWhisperModel("What is faith")
+    monkeypatch.setattr(speech_to_text, 'whisper_model', model)
+
+    transcript, response = speech_to_text._process_recording(call_log, RECORDING_URL, "+15550100")
+
+    assert media_server == [RECORDING_PATH]
+    assert model.frames == 4000
+    assert transcript == "What is faith"
+    assert response
+    with app.app_context():
+        row = CallLog.query.filter_by(twilio_sid=call_log).one()
+        assert row.transcript == "What is faith"
+        assert row.response == response
+
+@pytest.mark.parametrize("url", [
+    "http://169.254.169.254/latest/meta-data",
+    "http://api.twilio.com" + RECORDING_PATH,
+    "https://api.twilio.com.example.com" + RECORDING_PATH,
+    "https://api.twilio.com@example.com" + RECORDING_PATH,
+])
+def test_untrusted_recording_urls_are_not_fetched(url, media_server):
+    assert not speech_to_text.is_trusted_recording_url(url)
+    with pytest.raises(ValueError):
+        speech_to_text.download_recording(url)
+    assert media_server == []
+
+def test_submit_recording_does_not_wait_for_the_model(monkeypatch):
+    loaded = threading.Event()
+    release = threading.Event()
+
+    def slow_load():
+        loaded.set()
+        release.wait(5)
+
+    monkeypatch.setattr(speech_to_text, 'whisper_model', None)
+    monkeypatch.setattr(speech_to_text, '_model_failed', False)
+    monkeypatch.setattr(speech_to_text, '_model_loader', None)
+    monkeypatch.setattr(speech_to_text, 'STT_ENABLED', True)
+    monkeypatch.setattr(speech_to_text, '_load_model', slow_load)
+    try:
+        assert speech_to_text.submit_recording("CA-loading", RECORDING_URL) is None
+        assert loaded.wait(5)
+    finally:
+        release.set()
@@ -0,0 +1,28 @@
+from app import app
+import topic_matcher
+from topic_matcher import add_terms, extract_topics, remove_term
+
+def test_vocabulary_version_is_read_at_most_once_per_interval(monkeypatch):
+    reads = []
+    original = topic_matcher.vocabulary_version
+    def vocabulary_version():
+        reads.append(True)
+        return original()
+    monkeypatch.setattr(topic_matcher, 'vocabulary_version', vocabulary_version)
+    monkeypatch.setattr(topic_matcher, 'TOPIC_VOCABULARY_CHECK_SECONDS', 3600)
+    monkeypatch.setattr(topic_matcher, '_matcher_version', None)
+
+    with app.app_context():
+        assert "faith" in extract_topics("Faith without works is dead")
+        first_call_reads = len(reads)
+        for _ in range(20):
+            extract_topics("Scripture and revelation")
+        assert len(reads) == first_call_reads
+
+        # Terms changed by this worker apply at once
+        try:
+            add_terms(["endurance"])
+            assert "endurance" in extract_topics("Endurance to the end")
+        finally:
+            remove_term("endurance")
+        assert "endurance" not in extract_topics("Endurance to the end")
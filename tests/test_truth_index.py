@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+import numpy as np
+import pytest
+from app import app, db
+from models import Truth, TruthChange, Setting
+from change_log import OP_INSERT, OP_RETAG, COMPACTED_THROUGH_KEY, record_truth_change
+from db_writer import run_write
+import memory_manager
+from memory_manager import TruthIndex, dimension
+from topic_clusters import _retag_truths
+
+def _add_truth(content, topics=None):
+    truth = Truth(content=content, source="test")
+    truth.set_topics(topics)
+    truth.set_vector(np.random.rand(dimension).tolist())
+    db.session.add(truth)
+    record_truth_change(truth, OP_INSERT)
+    db.session.commit()
+    return truth.id
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_manager, 'INDEX_DIR', str(tmp_path / "index"))
+    with app.app_context():
+        db.session.query(Truth).delete()
+        db.session.query(TruthChange).delete()
+        db.session.query(Setting).filter_by(key=COMPACTED_THROUGH_KEY).delete()
+        db.session.commit()
+        yield tmp_path / "index"
+        db.session.rollback()
+
+def test_index_is_rebuilt_after_a_clone(index_dir):
+    old_ids = {_add_truth("Faith is a principle of action"), _add_truth("Prayer brings peace")}
+    worker = TruthIndex()
+    worker.refresh(force=True)
+    assert set(worker.slots) == old_ids
+
+    response = app.test_client().post('/api/replication/initialize-clone', json={"truths": [
+        {"id": 500, "content": "Charity never faileth", "source": "clone"},
+        {"id": 501, "content": "Families can be together forever", "source": "clone"},
+    ]})
+    assert response.status_code == 200
+
+    # A worker that was running during the clone, and one starting from the old snapshot
+    worker.refresh(force=True)
+    assert set(worker.slots) == {500, 501}
+    fresh = TruthIndex()
+    fresh.refresh(force=True)
+    assert set(fresh.slots) == {500, 501}
+
+def test_index_rebuilds_when_the_log_is_behind_it(index_dir):
+    truth_id = _add_truth("Repentance is a gift")
+    worker = TruthIndex()
+    worker.refresh(force=True)
+    db.session.query(Truth).delete()
+    db.session.query(TruthChange).delete()
+    db.session.commit()
+
+    worker.refresh(force=True)
+    assert truth_id not in worker.slots
+    assert worker.generation == 0
+
+def test_save_snapshot_keeps_a_newer_published_snapshot(index_dir):
+    _add_truth("Scripture study strengthens testimony")
+    newer = TruthIndex()
+    newer.refresh(force=True)
+    newer.generation += 10
+    newer_path = newer.save_snapshot()
+    # Old enough to be pruned if the older writer did not know it was current
+    os.utime(newer_path, (time.time() - 3600, time.time() - 3600))
+
+    older = TruthIndex()
+    older.build_from_database()
+    older.save_snapshot()
+
+    assert older._current_snapshot() == (newer.generation, newer_path)
+    assert os.path.isdir(newer_path)
+
+def test_old_format_snapshot_is_rebuilt(index_dir):
+    truth_id = _add_truth("The glory of God is intelligence")
+    # A snapshot written before created.npy, postings.json and FORMAT existed
+    old_path = index_dir / "gen-1000-1-1"
+    old_path.mkdir(parents=True)
+    np.save(old_path / "ids.npy", np.array([truth_id], dtype=np.int64))
+    np.save(old_path / "vectors.npy", np.random.rand(1, dimension).astype(np.float32))
+    (index_dir / "CURRENT").write_text(old_path.name)
+
+    worker = TruthIndex()
+    worker.refresh(force=True)
+
+    assert worker.generation is not None
+    assert set(worker.slots) == {truth_id}
+    generation, path = worker._current_snapshot()
+    assert path != str(old_path)
+    assert os.path.exists(os.path.join(path, 'postings.json'))
+
+def test_recall_estimate_is_bounded_and_does_not_hold_the_lock(index_dir, monkeypatch):
+    for number in range(50):
+        _add_truth(f"Truth number {number}")
+    worker = TruthIndex()
+    worker.refresh(force=True)
+    assert worker.main.codes is not None
+
+    scanned = []
+    original = memory_manager.IndexSegment.top_k_batch
+    def top_k_batch(segment, query_vectors, k, rerank_factor=None, filters=None):
+        # Another thread must be able to take the lock while the scans run
+        acquired = []
+        def take_lock():
+            if worker.lock.acquire(timeout=1):
+                acquired.append(True)
+                worker.lock.release()
+        thread = threading.Thread(target=take_lock)
+        thread.start()
+        thread.join()
+        assert acquired
+        scanned.append(len(query_vectors))
+        return original(segment, query_vectors, k, rerank_factor, filters)
+    monkeypatch.setattr(memory_manager.IndexSegment, 'top_k_batch', top_k_batch)
+    monkeypatch.setattr(memory_manager, 'INDEX_RECALL_MAX_SAMPLE', 20)
+
+    recall = worker.estimate_recall(sample_size=10 ** 9, top_k=5)
+    assert 0.0 <= recall <= 1.0
+    assert sum(scanned) == 2 * 20
+
+def test_search_batch_scans_outside_the_lock(index_dir, monkeypatch):
+    ids = [_add_truth(f"Truth number {number}", ["faith"] if number % 2 else None) for number in range(40)]
+    worker = TruthIndex()
+    worker.refresh(force=True)
+    worker.upsert(1000, np.random.rand(dimension), keys=("topic:faith",))
+    queries = [worker.main.vectors[worker.slots[ids[1]][1]], np.random.rand(dimension)]
+    expected = worker.search_batch(queries, 5, filters={"topics": ["faith"]})
+
+    original = memory_manager.IndexSegment.top_k_batch
+    def top_k_batch(segment, query_vectors, k, rerank_factor=None, filters=None):
+        # A write lands while the scan runs; it must not wait for the scan
+        # nor show up in it half applied
+        def write():
+            if worker.lock.acquire(timeout=1):
+                worker.delete(1000)
+                worker.upsert(1001, queries[1], keys=("topic:faith",))
+                worker.lock.release()
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join()
+        assert 1001 in worker.slots
+        return original(segment, query_vectors, k, rerank_factor, filters)
+    monkeypatch.setattr(memory_manager.IndexSegment, 'top_k_batch', top_k_batch)
+
+    assert worker.search_batch(queries, 5, filters={"topics": ["faith"]}) == expected
+    monkeypatch.setattr(memory_manager.IndexSegment, 'top_k_batch', original)
+    assert worker.search(queries[1], 1, filters={"topics": ["faith"]}) == [1001]
+
+def test_local_adds_are_indexed_once(index_dir, monkeypatch):
+    worker = TruthIndex()
+    monkeypatch.setattr(memory_manager, 'truth_index', worker)
+    worker.refresh(force=True)
+    compactions = []
+    monkeypatch.setattr(worker, 'compact', lambda: compactions.append(True))
+
+    client = app.test_client()
+    ids = [client.post('/api/truth/add', json={"content": f"Local truth {number}"}).get_json()["id"]
+           for number in range(100)]
+    memory_manager.wait_for_index_updates()
+    worker.refresh(force=True)
+
+    assert set(worker.slots) == set(ids)
+    assert worker.delta.tombstones == 0 and worker.main.tombstones == 0
+    assert not worker.needs_compaction() and compactions == []
+
+def _ids_under(worker, key):
+    return {int(truth_id) for segment in (worker.main, worker.delta)
+            for truth_id in segment.ids[:segment.size][segment.bitmap(key) & segment.live[:segment.size]]}
+
+def test_retagging_moves_postings_without_rewriting_rows(index_dir):
+    # Two truths in the snapshot's main segment, one tailed into the delta segment
+    worker = TruthIndex()
+    main_ids = [_add_truth(f"Snapshot truth {number}", ["faith", "cluster-a"]) for number in range(2)]
+    worker.refresh(force=True)
+    delta_id = _add_truth("Tailed truth", ["cluster-a"])
+    worker.refresh(force=True)
+    updated_at = {truth.id: truth.updated_at for truth in Truth.query}
+    rows = (worker.main.size, worker.delta.size)
+
+    label_of = {main_ids[0]: "cluster-b", main_ids[1]: "cluster-a", delta_id: "cluster-b"}
+    assert run_write(_retag_truths, label_of, {"cluster-a", "cluster-b"}) == 2
+    assert sorted(c.truth_id for c in TruthChange.query.filter_by(op=OP_RETAG)) == sorted([main_ids[0], delta_id])
+    worker.refresh(force=True)
+
+    assert (worker.main.size, worker.delta.size) == rows
+    assert worker.main.tombstones == 0 and worker.delta.tombstones == 0
+    assert _ids_under(worker, "topic:cluster-b") == {main_ids[0], delta_id}
+    assert _ids_under(worker, "topic:cluster-a") == {main_ids[1]}
+    assert _ids_under(worker, "topic:faith") == set(main_ids)
+    db.session.expire_all()
+    assert Truth.query.get(main_ids[0]).get_topics() == ["faith", "cluster-b"]
+    assert {truth.id: truth.updated_at for truth in Truth.query} == updated_at
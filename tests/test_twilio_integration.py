@@ -0,0 +1,166 @@
+import io
+import csv
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+import pytest
+from app import app, db
+from models import CallLog
+import twilio_integration
+import voice_pipeline
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Stub the truth search behind voice answers; records the questions it was asked"""
+    asked = []
+    def search_answer(transcript, search_terms=None, already_said=None):
+        asked.append(transcript)
+        return f"Based on what I know: an answer to {transcript}", "faith", True
+    monkeypatch.setattr(voice_pipeline, 'search_answer', search_answer)
+    monkeypatch.setattr(twilio_integration, 'TWILIO_VOICE_MODE', 'gather')
+    return asked
+
+def _speech(client, call_sid, transcript):
+    response = client.post('/api/twilio/process-speech', data={
+        "CallSid": call_sid, "From": "+15550000300", "SpeechResult": transcript, "Confidence": "0.9"})
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+def _partial(client, call_sid, stable, unstable):
+    response = client.post('/api/twilio/speech-partial', data={
+        "CallSid": call_sid, "StableSpeechResult": stable, "UnstableSpeechResult": unstable})
+    assert response.status_code == 200
+
+def test_gather_turn_reuses_the_answer_started_from_partial_speech(searches):
+    client = app.test_client()
+    voice = client.post('/api/twilio/voice', data={"CallSid": "CA-gather-1", "From": "+15550000300"})
+    twiml = voice.get_data(as_text=True)
+    assert '<Gather' in twiml and 'input="speech"' in twiml
+    assert 'partialResultCallback="/api/twilio/speech-partial"' in twiml
+
+    _partial(client, "CA-gather-1", "What is", "What is faith")
+    # The final result differs only in case and punctuation, so the answer is reused
+    twiml = _speech(client, "CA-gather-1", "What is faith?")
+    assert searches == ["What is faith"]
+    assert "an answer to What is faith" in twiml and '<Gather' in twiml
+    with app.app_context():
+        log = CallLog.query.filter_by(twilio_sid="CA-gather-1").one()
+        assert (log.transcript, log.response) == ("What is faith?", "Based on what I know: an answer to What is faith")
+
+def test_gather_turn_searches_again_when_the_words_changed(searches):
+    client = app.test_client()
+    _partial(client, "CA-gather-2", "", "What is prayer")
+    twiml = _speech(client, "CA-gather-2", "What is repentance")
+    assert "an answer to What is repentance" in twiml
+    # The speculative search runs in the background, so it may finish last
+    deadline = time.monotonic() + 5
+    while len(searches) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(searches) == ["What is prayer", "What is repentance"]
+
+    # Partial results that are not questions are not answered ahead of time
+    _partial(client, "CA-gather-2", "", "Store this truth: prayer brings peace")
+    assert voice_pipeline._prefetched.get("CA-gather-2") is None
+
+def test_final_result_waits_for_an_answer_still_being_prefetched(searches, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    def slow_search(transcript, search_terms=None, already_said=None):
+        searches.append(transcript)
+        started.set()
+        release.wait(5)
+        return "Based on what I know: faith is a hope", "faith", True
+    monkeypatch.setattr(voice_pipeline, 'search_answer', slow_search)
+
+    client = app.test_client()
+    _partial(client, "CA-gather-3", "", "What is faith")
+    assert started.wait(5)
+    threading.Timer(0.2, release.set).start()
+    twiml = _speech(client, "CA-gather-3", "what is faith")
+    assert searches == ["What is faith"]
+    assert "faith is a hope" in twiml
+
+CALLER = "+15550000400"
+BASE_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+@pytest.fixture
+def call_logs():
+    """Add a call log for CALLER at BASE_TIME plus minutes; returns its ID"""
+    added = []
+    def add(minutes, transcript=None, caller=CALLER):
+        log = CallLog(twilio_sid=f"CA-logs-{len(added)}-{minutes}", caller_number=caller, transcript=transcript,
+                      response="Answered" if transcript else None,
+                      created_at=BASE_TIME + timedelta(minutes=minutes))
+        db.session.add(log)
+        db.session.commit()
+        added.append(log.id)
+        return log.id
+    with app.app_context():
+        CallLog.query.filter(CallLog.twilio_sid.like("CA-logs-%")).delete(synchronize_session=False)
+        db.session.commit()
+        yield add
+        db.session.rollback()
+        CallLog.query.filter(CallLog.id.in_(added)).delete(synchronize_session=False)
+        db.session.commit()
+
+def test_keyset_pages_stay_stable_while_calls_are_logged(call_logs):
+    # Three calls share a timestamp, so the ID breaks the tie
+    minutes = [0, 1, 2, 2, 2, 3, 4]
+    ids = [call_logs(minute) for minute in minutes]
+    expected = [log_id for _, log_id in sorted(zip(minutes, ids), reverse=True)]
+    client = app.test_client()
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"caller": CALLER, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get('/api/twilio/logs', query_string=params).json
+        seen += [log["id"] for log in page["logs"]]
+        cursor = page["next_cursor"]
+        pages += 1
+        if not cursor:
+            break
+        # New calls arrive at the top while the client is paging
+        call_logs(10 + pages)
+    assert seen == expected
+    assert pages == 4
+
+    # A call older than the cursor position still shows up on a later page
+    first = client.get('/api/twilio/logs', query_string={"caller": CALLER, "limit": 9}).json
+    older = call_logs(-1)
+    rest = client.get('/api/twilio/logs', query_string={"caller": CALLER, "limit": 9,
+                                                        "cursor": first["next_cursor"]}).json
+    assert [log["id"] for log in rest["logs"]] == [ids[0], older]
+    assert rest["next_cursor"] is None
+
+    assert client.get('/api/twilio/logs', query_string={"cursor": "not-a-cursor"}).status_code == 400
+
+def test_export_streams_filtered_logs_as_ndjson_and_csv(call_logs):
+    transcribed = [call_logs(0, 'What is "faith", anyway?\nAnd prayer'), call_logs(5, "Store this truth")]
+    call_logs(3)
+    call_logs(4, "Another caller", caller="+15550000401")
+    client = app.test_client()
+    params = {"caller": CALLER, "has_transcript": "true"}
+
+    response = client.get('/api/twilio/logs/export', query_string=params)
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'attachment; filename=call-logs-' in response.headers['Content-Disposition']
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    with app.app_context():
+        assert rows == [db.session.get(CallLog, log_id).to_dict() for log_id in reversed(transcribed)]
+
+    response = client.get('/api/twilio/logs/export', query_string=dict(params, format="csv"))
+    assert response.mimetype == 'text/csv'
+    table = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert table[0] == twilio_integration.CALL_LOG_EXPORT_FIELDS
+    assert [row[0] for row in table[1:]] == [str(log_id) for log_id in reversed(transcribed)]
+    assert table[2][4] == 'What is "faith", anyway?\nAnd prayer'
+
+    # Nothing matched: CSV is just the header, NDJSON is empty
+    empty = {"caller": "+15550000499"}
+    assert client.get('/api/twilio/logs/export', query_string=empty).get_data(as_text=True) == ""
+    assert client.get('/api/twilio/logs/export', query_string=dict(empty, format="csv")).get_data(as_text=True) \
+        .splitlines() == [",".join(twilio_integration.CALL_LOG_EXPORT_FIELDS)]
+    assert client.get('/api/twilio/logs/export', query_string={"format": "xml"}).status_code == 400
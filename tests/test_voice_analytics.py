@@ -0,0 +1,23 @@
+from datetime import datetime
+from app import app, db
+from models import VoiceTurn, VoiceQueryStat
+from db_writer import run_write
+import voice_analytics
+
+def _turn(search_terms, hit, latency_ms):
+    return {"call_sid": "CA-analytics", "channel": "gather", "intent": "question", "search_terms": search_terms,
+            "hit": hit, "prefetched": False, "latency_ms": latency_ms, "created_at": datetime.utcnow()}
+
+def test_batches_add_to_existing_and_new_totals():
+    with app.app_context():
+        db.session.query(VoiceTurn).delete()
+        db.session.query(VoiceQueryStat).delete()
+        db.session.commit()
+
+        run_write(voice_analytics._apply_turns, [_turn("faith", True, 10), _turn("faith", False, 30)])
+        run_write(voice_analytics._apply_turns, [_turn("faith", True, 20), _turn("prayer", None, 5)])
+
+        stats = {s.search_terms: (s.turns, s.hits, s.misses, s.latency_ms_total, s.latency_ms_max)
+                 for s in VoiceQueryStat.query}
+        assert stats == {"faith": (3, 2, 1, 60, 30), "prayer": (1, 0, 0, 5, 5)}
+        assert VoiceTurn.query.count() == 4
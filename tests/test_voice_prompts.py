@@ -0,0 +1,74 @@
+import wave
+import pytest
+from app import app
+import voice_prompts
+import twilio_integration
+from voice_prompts import prompt
+
+def _render(directory, name):
+    """Write a prompt recording the way render_prompt_audio does, as a deploy step would"""
+    directory.mkdir(exist_ok=True)
+    with wave.open(str(directory / voice_prompts._audio_filename(name)), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(voice_prompts.PROMPT_SAMPLE_RATE)
+        wav.writeframes(b'\0\0' * 800)
+
+@pytest.fixture
+def prompt_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "prompts"
+    monkeypatch.setattr(voice_prompts, 'PROMPT_AUDIO_DIR', str(directory))
+    monkeypatch.setattr(voice_prompts, 'VOICE_PROMPT_AUDIO', True)
+    monkeypatch.setattr(voice_prompts, 'VOICE_PROMPT_CHECK_SECONDS', 0)
+    monkeypatch.setattr(voice_prompts, '_fragments', {})
+    monkeypatch.setattr(voice_prompts, '_fragments_checked', 0.0)
+    monkeypatch.setattr(voice_prompts, '_fragments_signature', None)
+    return directory
+
+def test_fragments_are_reused_until_the_prompt_signature_changes(prompt_dir, monkeypatch):
+    builds = []
+    original = voice_prompts._render_prompt
+    def render_prompt(name):
+        builds.append(name)
+        return original(name)
+    monkeypatch.setattr(voice_prompts, '_render_prompt', render_prompt)
+
+    assert prompt("welcome").startswith('<Say')
+    assert prompt("welcome") is prompt("welcome")
+    assert builds == ["welcome"]
+
+    # Recordings rendered by another process replace <Say> without a restart
+    _render(prompt_dir, "welcome")
+    assert prompt("welcome") == f'<Play>/static/audio/prompts/{voice_prompts._audio_filename("welcome")}</Play>'
+
+    # So does turning recorded prompts off, or changing the voice they were rendered with
+    monkeypatch.setattr(voice_prompts, 'VOICE_PROMPT_AUDIO', False)
+    assert prompt("welcome").startswith('<Say')
+    monkeypatch.setattr(voice_prompts, 'VOICE_PROMPT_AUDIO', True)
+    monkeypatch.setenv('TTS_PIPER_MODEL', 'another-voice.onnx')
+    assert prompt("welcome").startswith('<Say')
+    assert builds == ["welcome"] * 4
+
+    # Between checks the cached fragment is served as is
+    monkeypatch.setattr(voice_prompts, 'VOICE_PROMPT_CHECK_SECONDS', 3600)
+    _render(prompt_dir, "welcome")
+    assert prompt("welcome").startswith('<Say')
+
+def test_voice_webhook_picks_up_rendered_prompts(prompt_dir, monkeypatch):
+    monkeypatch.setattr(twilio_integration, 'TWILIO_VOICE_MODE', 'gather')
+    client = app.test_client()
+    def voice(call_sid):
+        response = client.post('/api/twilio/voice', data={"CallSid": call_sid, "From": "+15550000200"})
+        assert response.status_code == 200
+        return response.get_data(as_text=True)
+
+    before = voice("CA-prompts-1")
+    assert voice_prompts.PROMPTS["listening"] in before and '<Play>' not in before
+
+    _render(prompt_dir, "listening")
+    after = voice("CA-prompts-2")
+    # The prompt inside the cached <Gather> fragment is rebuilt with its recording
+    gather = after[after.index('<Gather'):after.index('</Gather>')]
+    assert voice_prompts._audio_filename("listening") in gather
+    assert voice_prompts.PROMPTS["listening"] not in after
+    assert voice_prompts.PROMPTS["welcome"] in after
@@ -0,0 +1,54 @@
+import os
+import logging
+import threading
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Optional Piper voice model for local speech synthesis
+TTS_PIPER_MODEL = os.environ.get('TTS_PIPER_MODEL', '')
+
+piper_voice = None
+_voice_lock = threading.Lock()
+_voice_failed = False
+
+def _load_voice():
+    """Load the Piper voice once; returns None when none is configured or it fails"""
+    global piper_voice, _voice_failed
+
+    if piper_voice is not None or _voice_failed or not TTS_PIPER_MODEL:
+        return piper_voice
+    with _voice_lock:
+        if piper_voice is None and not _voice_failed:
+            try:
+                from piper import PiperVoice
+                piper_voice = PiperVoice.load(TTS_PIPER_MODEL)
+                logger.info(f"Loaded Piper voice {TTS_PIPER_MODEL}")
+            except Exception as e:
+                _voice_failed = True
+                logger.warning(f"Piper voice unavailable: {e}")
+    return piper_voice
+
+def is_available():
+    return _load_voice() is not None
+
+def resample(samples, from_rate, to_rate):
+    """Linear resampling; enough for 8 kHz telephone audio"""
+    if from_rate == to_rate or len(samples) == 0:
+        return np.asarray(samples, dtype=np.float32)
+    count = int(round(len(samples) * to_rate / from_rate))
+    positions = np.arange(count) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+def synthesize(text, sample_rate):
+    """Synthesize text to int16 samples at sample_rate; None without a voice"""
+    voice = _load_voice()
+    if voice is None:
+        return None
+    if hasattr(voice, 'synthesize_stream_raw'):
+        raw = b''.join(voice.synthesize_stream_raw(text))
+    else:
+        raw = b''.join(chunk.audio_int16_bytes for chunk in voice.synthesize(text))
+    samples = np.frombuffer(raw, dtype=np.int16).astype(np.float32)
+    return resample(samples, voice.config.sample_rate, sample_rate).astype(np.int16)
@@ -0,0 +1,295 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from collections import Counter
+import numpy as np
+from sqlalchemy import bindparam
+from app import app, db
+from models import Truth, TruthChange, TopicCluster, Setting
+from change_log import OP_RETAG
+from db_writer import run_write
+from db_profile import bulk_insert
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of clusters; 0 picks one from the corpus size
+CLUSTER_COUNT = int(os.environ.get('CLUSTER_COUNT', '0'))
+CLUSTER_BATCH_SIZE = int(os.environ.get('CLUSTER_BATCH_SIZE', '1024'))
+CLUSTER_ITERATIONS = int(os.environ.get('CLUSTER_ITERATIONS', '100'))
+# Clusters probed per query when centroids are used as a coarse quantizer;
+# 0 scans every row. Only enable once every truth carries a cluster topic.
+CLUSTER_NPROBE = int(os.environ.get('CLUSTER_NPROBE', '0'))
+# How often workers check for centroids published by a newer job
+CLUSTER_REFRESH_SECONDS = float(os.environ.get('CLUSTER_REFRESH_SECONDS', '5'))
+
+VERSION_KEY = "topic_cluster_version"
+
+_STOPWORDS = set("""a an and are as at be been but by for from has have he her his i if in into is it its
+not of on or our she so that the their them they this to was we were what when which who will with
+you your all any can do does did had may more must no one only other shall should than then there
+these those us also about after before being both each how just like most much over such through
+unto upon ye thee thou thy hath""".split())
+_word_pattern = re.compile(r"[a-z][a-z']{2,}")
+
+# Centroids loaded in this worker
+_centroids = None
+_labels = []
+_loaded_version = None
+_last_checked = 0.0
+_load_lock = threading.Lock()
+
+# State of the background job in this worker
+_job_thread = None
+_job_status = {"state": "idle"}
+
+def _cluster_version():
+    setting = Setting.query.filter_by(key=VERSION_KEY).first()
+    return int(setting.value) if setting else 0
+
+def load_centroids(force=False):
+    """Reload persisted centroids when a newer clustering job has published them"""
+    global _centroids, _labels, _loaded_version, _last_checked
+
+    now = time.monotonic()
+    if not force and _loaded_version is not None and now - _last_checked < CLUSTER_REFRESH_SECONDS:
+        return
+    with _load_lock:
+        _last_checked = now
+        version = _cluster_version()
+        if version == _loaded_version:
+            return
+        clusters = TopicCluster.query.order_by(TopicCluster.id).all()
+        if clusters:
+            _centroids = np.array([c.get_centroid() for c in clusters], dtype=np.float32)
+            _labels = [c.label for c in clusters]
+        else:
+            _centroids, _labels = None, []
+        _loaded_version = version
+        logger.info(f"Loaded {len(_labels)} topic clusters (version {version})")
+
+def _nearest(vectors, centroids):
+    """Index of the nearest centroid for each row, in chunks to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), 8192):
+        block = np.asarray(vectors[start:start + 8192], dtype=np.float32)
+        assignments[start:start + 8192] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def mini_batch_kmeans(vectors, k, batch_size=CLUSTER_BATCH_SIZE, iterations=CLUSTER_ITERATIONS, seed=0):
+    """Spherical mini-batch k-means over unit vectors; returns unit centroids
+
+    Each iteration assigns one random batch and moves every centroid towards
+    its batch members with a per-centroid learning rate of 1/count, so the
+    cost per iteration does not depend on the corpus size.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+
+    # k-means++ seeding on a sample
+    sample = np.asarray(vectors[rng.choice(n, size=min(n, max(10 * k, batch_size)), replace=False)],
+                        dtype=np.float32)
+    centroids = [sample[rng.integers(len(sample))]]
+    distances = 1 - sample @ centroids[0]
+    for _ in range(1, k):
+        weights = np.clip(distances, 0, None) ** 2
+        total = weights.sum()
+        choice = rng.choice(len(sample), p=weights / total) if total > 0 else rng.integers(len(sample))
+        centroids.append(sample[choice])
+        distances = np.minimum(distances, 1 - sample @ sample[choice])
+    centroids = np.array(centroids, dtype=np.float32)
+
+    counts = np.zeros(k)
+    for _ in range(iterations):
+        batch = np.asarray(vectors[rng.choice(n, size=min(n, batch_size), replace=False)], dtype=np.float32)
+        assignments = np.argmax(batch @ centroids.T, axis=1)
+        for cluster in np.unique(assignments):
+            members = batch[assignments == cluster]
+            counts[cluster] += len(members)
+            rate = len(members) / counts[cluster]
+            centroids[cluster] = (1 - rate) * centroids[cluster] + rate * members.mean(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+def _label_clusters(assignments, ids, k):
+    """Name each cluster after the words most over-represented among its truths"""
+    corpus_counts = Counter()
+    cluster_counts = [Counter() for _ in range(k)]
+    cluster_of = dict(zip(ids.tolist(), assignments.tolist()))
+    query = db.session.query(Truth.id, Truth.content).execution_options(yield_per=2000)
+    for truth_id, content in query:
+        cluster = cluster_of.get(truth_id)
+        if cluster is None:
+            continue
+        words = set(w for w in _word_pattern.findall(content.lower()) if w not in _STOPWORDS)
+        corpus_counts.update(words)
+        cluster_counts[cluster].update(words)
+
+    total = max(len(assignments), 1)
+    labels, used = [], set()
+    for cluster, counts in enumerate(cluster_counts):
+        size = max(int((assignments == cluster).sum()), 1)
+        ranked = sorted(counts, key=lambda w: (-(counts[w] / size) / (corpus_counts[w] / total), w))
+        words = []
+        for word in ranked:
+            # Skip inflections of a word already in the label ("river", "rivers")
+            if not any(word.startswith(w) or w.startswith(word) for w in words):
+                words.append(word)
+            if len(words) == 2:
+                break
+        label = '-'.join(words) or f"cluster-{cluster}"
+        if label in used:
+            label = f"{label}-{cluster}"
+        used.add(label)
+        labels.append(label)
+    return labels
+
+def with_cluster_topic(topics, cluster_label, old_labels=()):
+    """Replace any cluster topic in a topic list with cluster_label"""
+    topics = [t for t in topics if t not in old_labels and t != "general"]
+    if cluster_label:
+        topics.append(cluster_label)
+    return topics or ["general"]
+
+def assign_cluster_topic(topics, vector):
+    """Add the nearest cluster's label to the topics of a new or updated truth"""
+    load_centroids()
+    if _centroids is None or vector is None:
+        return topics
+    vector = np.asarray(vector, dtype=np.float32)
+    vector = vector / max(np.linalg.norm(vector), 1e-12)
+    label = _labels[int(np.argmax(_centroids @ vector))]
+    return with_cluster_topic(topics, label)
+
+def probe_labels(query_vector, nprobe=CLUSTER_NPROBE):
+    """Return the labels of the clusters nearest a query, or None when probing is off"""
+    if nprobe <= 0:
+        return None
+    load_centroids()
+    if _centroids is None or nprobe >= len(_labels):
+        return None
+    scores = _centroids @ np.asarray(query_vector, dtype=np.float32)
+    return sorted(_labels[i] for i in np.argpartition(-scores, nprobe - 1)[:nprobe])
+
+def _publish_clusters(labels, centroids, sizes):
+    """Stage the new clusters in place of the old; returns the old labels"""
+    old_labels = {c.label for c in TopicCluster.query.all()}
+    TopicCluster.query.delete()
+    db.session.add_all([
+        TopicCluster(label=label, centroid=json.dumps(centroid), size=size)
+        for label, centroid, size in zip(labels, centroids, sizes)
+    ])
+    setting = Setting.query.filter_by(key=VERSION_KEY).first()
+    if setting:
+        setting.value = str(int(setting.value) + 1)
+    else:
+        db.session.add(Setting(key=VERSION_KEY, value="1",
+                               description="Version of the topic clusters, bumped by each clustering job"))
+    return old_labels
+
+def _retag_truths(label_of, old_labels):
+    """Stage the cluster topic of each truth by ID; returns how many changed
+
+    Only truths whose cluster topic differs are written: their topics in one
+    executemany, logged as retags so indexes move them between posting lists
+    instead of re-adding their rows. Cluster topics are derived, so the
+    updated_at that decides replication conflicts is left as it was.
+    """
+    changed = []
+    for truth_id, topics in db.session.query(Truth.id, Truth.topics).filter(Truth.id.in_(list(label_of))):
+        topics = json.loads(topics) if topics else []
+        new_topics = with_cluster_topic(topics, label_of[truth_id], old_labels)
+        if new_topics != topics:
+            changed.append({"truth_id": truth_id, "new_topics": json.dumps(new_topics)})
+    if not changed:
+        return 0
+    truth = Truth.__table__
+    db.session.execute(truth.update()
+                       .where(truth.c.id == bindparam('truth_id'))
+                       .values(topics=bindparam('new_topics'), updated_at=truth.c.updated_at), changed)
+    now = datetime.utcnow()
+    bulk_insert(db.session, TruthChange,
+                [{"truth_id": row["truth_id"], "op": OP_RETAG, "payload": None, "created_at": now} for row in changed],
+                ["truth_id", "op", "payload", "created_at"])
+    return len(changed)
+
+def run_clustering_job():
+    """Cluster every indexed embedding, persist the centroids and retag truths
+
+    Topic changes go through the change log as retags, so index postings,
+    search caches and replicas pick them up like any other truth change.
+    """
+    from memory_manager import truth_index, initialize_index
+
+    if truth_index.generation is None:
+        initialize_index()
+    with truth_index.lock:
+        if len(truth_index) == 0:
+            return 0
+        ids, vectors, _, _ = truth_index._merged_rows()
+
+    n = len(ids)
+    k = CLUSTER_COUNT or int(np.clip(np.sqrt(n / 2), 2, 256))
+    k = min(k, n)
+    _job_status.update({"state": "training", "truths": n, "clusters": k})
+    centroids = mini_batch_kmeans(vectors, k)
+    assignments = _nearest(vectors, centroids)
+    labels = _label_clusters(assignments, ids, k)
+    sizes = np.bincount(assignments, minlength=k)
+
+    # Publish the new centroids
+    _job_status["state"] = "publishing"
+    old_labels = run_write(_publish_clusters, labels, centroids.tolist(), sizes.tolist())
+
+    # Retag truths whose cluster topic changed
+    _job_status["state"] = "assigning"
+    old_labels |= set(labels)
+    label_of = dict(zip(ids.tolist(), (labels[a] for a in assignments.tolist())))
+    retagged = 0
+    truth_ids = sorted(label_of)
+    for start in range(0, len(truth_ids), 500):
+        chunk = {truth_id: label_of[truth_id] for truth_id in truth_ids[start:start + 500]}
+        retagged += run_write(_retag_truths, chunk, old_labels)
+
+    load_centroids(force=True)
+    logger.info(f"Clustering job finished: {k} clusters over {n} truths, {retagged} retagged")
+    return retagged
+
+def _job_main():
+    with app.app_context():
+        started = time.time()
+        try:
+            retagged = run_clustering_job()
+            _job_status.update({"state": "finished", "retagged": retagged,
+                                "seconds": round(time.time() - started, 2)})
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Clustering job failed: {e}")
+            _job_status.update({"state": "failed", "error": str(e)})
+        finally:
+            db.session.remove()
+
+def start_clustering_job():
+    """Start the clustering job in the background; returns False if one is running"""
+    global _job_thread
+
+    if _job_thread is not None and _job_thread.is_alive():
+        return False
+    _job_status.clear()
+    _job_status["state"] = "starting"
+    _job_thread = threading.Thread(target=_job_main, name="topic-clustering", daemon=True)
+    _job_thread.start()
+    return True
+
+def clustering_status():
+    """Return the persisted clusters and the state of this worker's last job"""
+    clusters = TopicCluster.query.order_by(TopicCluster.size.desc()).all()
+    return {
+        "job": dict(_job_status),
+        "version": _cluster_version(),
+        "clusters": [{"label": c.label, "size": c.size} for c in clusters]
+    }
@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import logging
+import threading
+from sqlalchemy import Integer, Text, cast
+from app import db
+from models import TopicTerm, Setting
+from db_writer import run_write
+from db_profile import upsert_insert
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Vocabulary seeded into an empty TopicTerm table
+DEFAULT_TOPICS = [
+    "faith", "revelation", "scripture", "prophecy", "truth",
+    "wisdom", "knowledge", "salvation", "redemption", "covenant"
+]
+
+VERSION_KEY = "topic_vocabulary_version"
+
+# How often a worker re-reads the vocabulary version; terms changed by this
+# worker apply immediately, terms changed by other workers within this delay
+TOPIC_VOCABULARY_CHECK_SECONDS = float(os.environ.get('TOPIC_VOCABULARY_CHECK_SECONDS', '5'))
+
+# Compiled matcher for the vocabulary version it was built from
+_matcher = None
+_matcher_version = None
+_matcher_checked = 0.0
+_matcher_lock = threading.Lock()
+
+def normalize_term(term):
+    """Lowercase a term and collapse its whitespace"""
+    return ' '.join(term.lower().split())
+
+def vocabulary_version():
+    """Return the vocabulary version, bumped whenever terms are added or removed"""
+    setting = Setting.query.filter_by(key=VERSION_KEY).first()
+    return int(setting.value) if setting else 0
+
+def _bump_version(session):
+    """Stage a vocabulary version bump; safe when workers bump or create it at once"""
+    statement = upsert_insert(session, Setting).values(
+        key=VERSION_KEY, value="1", description="Version of the topic vocabulary, bumped on every change")
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[Setting.key], set_={"value": cast(cast(Setting.value, Integer) + 1, Text)}))
+
+def _insert_new_terms(session, terms):
+    """Stage the terms not yet in the vocabulary; returns those this call added
+
+    Terms another worker adds at the same moment are skipped by ON CONFLICT
+    rather than failing the whole write on the unique term.
+    """
+    if not terms:
+        return []
+    statement = upsert_insert(session, TopicTerm).values([{"term": term} for term in terms])
+    inserted = {term for term, in session.execute(
+        statement.on_conflict_do_nothing(index_elements=[TopicTerm.term]).returning(TopicTerm.term))}
+    return [term for term in terms if term in inserted]
+
+def _seed_vocabulary():
+    if vocabulary_version() != 0 or TopicTerm.query.first() is not None:
+        return False
+    if not _insert_new_terms(db.session, DEFAULT_TOPICS):
+        return False
+    _bump_version(db.session)
+    return True
+
+def ensure_default_vocabulary():
+    """Seed the default topics the first time the vocabulary is used"""
+    if vocabulary_version() == 0 and TopicTerm.query.first() is None:
+        if run_write(_seed_vocabulary):
+            logger.info(f"Seeded topic vocabulary with {len(DEFAULT_TOPICS)} default terms")
+
+def _insert_terms(terms):
+    added = _insert_new_terms(db.session, list(dict.fromkeys(filter(None, map(normalize_term, terms)))))
+    if added:
+        _bump_version(db.session)
+    return added
+
+def add_terms(terms):
+    """Add terms to the vocabulary; returns the terms that were new"""
+    ensure_default_vocabulary()
+    added = run_write(_insert_terms, list(terms))
+    if added:
+        _recheck_matcher()
+    return added
+
+def _delete_term(term):
+    topic_term = TopicTerm.query.filter_by(term=normalize_term(term)).first()
+    if not topic_term:
+        return False
+    db.session.delete(topic_term)
+    _bump_version(db.session)
+    return True
+
+def remove_term(term):
+    """Remove a term from the vocabulary; returns False if it was not present"""
+    ensure_default_vocabulary()
+    if not run_write(_delete_term, term):
+        return False
+    _recheck_matcher()
+    return True
+
+def _trie_pattern(node):
+    """Turn a character trie into a regex where shared prefixes are matched once"""
+    terminal = '' in node
+    alternatives = []
+    for char in sorted(key for key in node if key):
+        # Whitespace inside multi-word terms matches any run of whitespace
+        piece = r'\s+' if char == ' ' else re.escape(char)
+        alternatives.append(piece + _trie_pattern(node[char]))
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and not terminal:
+        return alternatives[0]
+    group = '(?:' + '|'.join(alternatives) + ')'
+    return group + '?' if terminal else group
+
+def build_matcher(terms):
+    """Compile one regex matching any term as a whole word (plurals included)
+
+    Building the alternation from a trie means each text position walks at
+    most one branch per character, so matching stays linear in the text
+    length however many terms the vocabulary holds.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = True
+    if not trie:
+        return None
+    return re.compile(r'\b(' + _trie_pattern(trie) + r')(?:e?s)?\b')
+
+def _recheck_matcher():
+    """Make the next lookup re-read the vocabulary version; called after local term changes"""
+    global _matcher_checked
+
+    with _matcher_lock:
+        _matcher_checked = 0.0
+
+def _get_matcher():
+    """Return the compiled matcher, rebuilding it only when the vocabulary changed
+
+    The version is re-read at most once per TOPIC_VOCABULARY_CHECK_SECONDS,
+    so most calls do not touch the database.
+    """
+    global _matcher, _matcher_version, _matcher_checked
+
+    with _matcher_lock:
+        if _matcher_version is not None and time.monotonic() - _matcher_checked < TOPIC_VOCABULARY_CHECK_SECONDS:
+            return _matcher
+
+    version = vocabulary_version()
+    if version == 0:
+        ensure_default_vocabulary()
+        version = vocabulary_version()
+    with _matcher_lock:
+        if version != _matcher_version:
+            terms = [t.term for t in TopicTerm.query.with_entities(TopicTerm.term)]
+            _matcher = build_matcher(terms)
+            _matcher_version = version
+            logger.info(f"Built topic matcher for {len(terms)} terms (vocabulary version {version})")
+        _matcher_checked = time.monotonic()
+        return _matcher
+
+def extract_topics(content):
+    """Return vocabulary terms found in content, in order of first appearance"""
+    matcher = _get_matcher()
+    found_topics = []
+    if matcher:
+        seen = set()
+        for match in matcher.finditer(content.lower()):
+            topic = ' '.join(match.group(1).split())
+            if topic not in seen:
+                seen.add(topic)
+                found_topics.append(topic)
+
+    # Default topic if none found
+    if not found_topics:
+        found_topics = ["general"]
+
+    return found_topics
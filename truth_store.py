@@ -1,17 +1,60 @@
 import os
 import json
 import logging
-from flask import Blueprint, request, jsonify, render_template
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, render_template, stream_with_context
+from sqlalchemy import or_
 from app import db
-from models import Truth
-from memory_manager import add_to_index, remove_from_index, search_similar_truths, get_embedding
+from models import Truth, TopicTerm
+from memory_manager import (add_to_index, remove_from_index, search_similar_truths,
+                            search_similar_truths_batch, get_embedding, truth_index)
+from change_log import OP_INSERT, OP_UPDATE, OP_DELETE, record_truth_change
+from db_profile import stream_query, stream_json_object
+from db_writer import run_write
+from reranker import rerank, candidate_budget, rerank_stats
+from topic_matcher import extract_topics, ensure_default_vocabulary, add_terms, remove_term, vocabulary_version
+from topic_clusters import assign_cluster_topic, start_clustering_job, clustering_status
+from search_cache import (current_generation, invalidate_results, result_key,
+                          get_cached_results, cache_results, cache_stats)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Upper bound on the number of queries accepted by one batch search request
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', '100'))
+
 # Create blueprint
 truth_bp = Blueprint('truth', __name__, url_prefix='/api/truth')
 
+def _insert_truth(content, source, vector, topics):
+    """Stage a new truth and its change log entry; returns the new ID and the entry's sequence"""
+    truth = Truth(content=content, source=source)
+    truth.set_vector(vector)
+    truth.set_topics(topics)
+    db.session.add(truth)
+    change = record_truth_change(truth, OP_INSERT)
+    db.session.flush()
+    return truth.id, change.id
+
+def _update_truth_row(truth_id, content, source, vector, topics):
+    """Stage new content, embedding and topics for a truth; returns the change entry's sequence"""
+    truth = Truth.query.get(truth_id)
+    truth.content = content
+    if source is not None:
+        truth.source = source
+    truth.set_vector(vector)
+    truth.set_topics(topics)
+    change = record_truth_change(truth, OP_UPDATE)
+    db.session.flush()
+    return change.id
+
+def _delete_truth_row(truth_id):
+    """Stage the deletion of a truth"""
+    truth = Truth.query.get(truth_id)
+    if truth:
+        record_truth_change(truth, OP_DELETE)
+        db.session.delete(truth)
+
 @truth_bp.route('/add', methods=['POST'])
 def add_truth(data=None):
     """Add a new truth to the database"""
@@ -30,28 +73,26 @@ def add_truth(data=None):
             return None
     
     try:
-        # Create new truth
-        truth = Truth(content=content, source=source)
-        
         # Generate embedding - skipped if ML is disabled
+        vector = None
         try:
             embedding = get_embedding(content)
             if embedding is not None:
-                truth.set_vector(embedding.tolist())
+                vector = embedding.tolist()
         except Exception as embed_error:
             logger.warning(f"Could not generate embedding for truth: {embed_error}")
         
-        # Extract topics (simplified implementation)
-        topics = extract_topics(content)
-        truth.set_topics(topics)
+        # Extract topics (simplified implementation), plus the nearest cluster topic
+        topics = assign_cluster_topic(extract_topics(content), vector)
         
-        # Save to database
-        db.session.add(truth)
-        db.session.commit()
+        # Save to database (through the single writer thread on SQLite)
+        truth_id, change_id = run_write(_insert_truth, content, source, vector, topics)
+        invalidate_results()
+        truth = Truth.query.get(truth_id)
         
         # Add to search index - skipped if ML is disabled
         try:
-            add_to_index(truth)
+            add_to_index(truth, change_id)
         except Exception as index_error:
             logger.warning(f"Could not add truth to search index: {index_error}")
         
@@ -85,8 +126,8 @@ def delete_truth(truth_id):
         remove_from_index(truth_id)
         
         # Delete from database
-        db.session.delete(truth)
-        db.session.commit()
+        run_write(_delete_truth_row, truth_id)
+        invalidate_results()
         
         return jsonify({"message": "Truth deleted successfully"})
     except Exception as e:
@@ -109,26 +150,20 @@ def update_truth(truth_id):
         return jsonify({"error": "Content is required"}), 400
     
     try:
-        # Update truth
-        truth.content = content
-        if source is not None:
-            truth.source = source
-        
         # Update embedding
         embedding = get_embedding(content)
-        if embedding is not None:
-            truth.set_vector(embedding.tolist())
+        vector = embedding.tolist() if embedding is not None else truth.get_vector()
         
         # Update topics
-        topics = extract_topics(content)
-        truth.set_topics(topics)
+        topics = assign_cluster_topic(extract_topics(content), vector)
         
         # Save changes
-        db.session.commit()
+        change_id = run_write(_update_truth_row, truth_id, content, source, vector, topics)
+        invalidate_results()
+        db.session.refresh(truth)
         
-        # Update in search index (remove and re-add)
-        remove_from_index(truth_id)
-        add_to_index(truth)
+        # Queue the new embedding; the index replaces the old row in the background
+        add_to_index(truth, change_id)
         
         return jsonify({
             "message": "Truth updated successfully",
@@ -139,36 +174,172 @@ def update_truth(truth_id):
         logger.error(f"Error updating truth: {e}")
         return jsonify({"error": str(e)}), 500
 
+def parse_search_filters(args):
+    """Read optional search filters (topic, source_prefix, created_after, created_before) from query args"""
+    topics = args.getlist('topic')
+    if args.get('topics'):
+        topics += [t.strip() for t in args.get('topics').split(',') if t.strip()]
+    created_after = args.get('created_after')
+    created_before = args.get('created_before')
+    return {
+        "topics": topics or None,
+        "source_prefix": args.get('source_prefix') or None,
+        "created_after": datetime.fromisoformat(created_after) if created_after else None,
+        "created_before": datetime.fromisoformat(created_before) if created_before else None,
+    }
+
+def filter_truth_query(query, topics=None, source_prefix=None, created_after=None, created_before=None):
+    """Apply search filters to a SQL query over truths"""
+    if topics:
+        # Topics are stored as a JSON list, so match the quoted topic name
+        query = query.filter(or_(*[Truth.topics.ilike(f'%"{topic.lower()}"%') for topic in topics]))
+    if source_prefix:
+        query = query.filter(Truth.source.startswith(source_prefix, autoescape=True))
+    if created_after:
+        query = query.filter(Truth.created_at >= created_after)
+    if created_before:
+        query = query.filter(Truth.created_at < created_before)
+    return query
+
+def retrieve_truths(query, limit=5, search_type='semantic', use_reranker=False, **filters):
+    """Return the best truths for a query, optionally re-ranked by the cross-encoder
+
+    With use_reranker the first stage fetches a larger candidate set (sized to
+    the current latency budget) and the reranker keeps the best `limit`.
+    Result IDs are cached per truth generation, so repeated queries cost one
+    primary-key lookup until the next write.
+    """
+    generation = current_generation()
+    key = result_key(query, search_type, limit, use_reranker, filters)
+    cached_ids = get_cached_results(key, generation)
+    if cached_ids is not None:
+        truths = {t.id: t for t in Truth.query.filter(Truth.id.in_(cached_ids)).all()} if cached_ids else {}
+        return [truths[truth_id] for truth_id in cached_ids if truth_id in truths]
+
+    fetch = candidate_budget(limit) if use_reranker else limit
+    if search_type == 'semantic':
+        results = search_similar_truths(query, fetch, **filters)
+    else:
+        text_query = filter_truth_query(Truth.query.filter(Truth.content.ilike(f'%{query}%')), **filters)
+        results = text_query.limit(fetch).all()
+    if use_reranker:
+        results = rerank(query, results, limit)
+
+    # Semantic results are only cached once the index has caught up with the
+    # writes that produced this generation
+    if search_type != 'semantic' or (truth_index.generation or 0) >= generation:
+        cache_results(key, [t.id for t in results], generation)
+    return results
+
+def retrieve_truths_batch(queries, limit=5, search_type='semantic', **filters):
+    """Return the best truths for each query, through the same result cache as retrieve_truths
+
+    Cached queries cost one shared primary-key lookup; the rest are searched
+    together, semantic ones in a single pass over the index.
+    """
+    generation = current_generation()
+    keys = [result_key(query, search_type, limit, False, filters) for query in queries]
+    ranked_ids = {}
+    missed = {}
+    for query, key in zip(queries, keys):
+        if key in ranked_ids or key in missed:
+            continue
+        cached_ids = get_cached_results(key, generation)
+        if cached_ids is None:
+            missed[key] = query
+        else:
+            ranked_ids[key] = cached_ids
+
+    found = {}
+    if missed:
+        if search_type == 'semantic':
+            batches = search_similar_truths_batch(list(missed.values()), limit, **filters)
+        else:
+            # Text queries run back to back on the request's database connection
+            batches = [
+                filter_truth_query(Truth.query.filter(Truth.content.ilike(f'%{query}%')), **filters)
+                .limit(limit).all()
+                for query in missed.values()
+            ]
+        cacheable = search_type != 'semantic' or (truth_index.generation or 0) >= generation
+        for key, results in zip(missed, batches):
+            ranked_ids[key] = [t.id for t in results]
+            found.update((t.id, t) for t in results)
+            if cacheable:
+                cache_results(key, ranked_ids[key], generation)
+
+    cached_ids = {truth_id for ids in ranked_ids.values() for truth_id in ids} - found.keys()
+    if cached_ids:
+        found.update((t.id, t) for t in Truth.query.filter(Truth.id.in_(cached_ids)).all())
+    return [[found[truth_id] for truth_id in ranked_ids[key] if truth_id in found] for key in keys]
+
 @truth_bp.route('/search', methods=['GET'])
 def search_truths():
     """Search for truths by content or semantic similarity"""
     query = request.args.get('query', '')
     search_type = request.args.get('type', 'semantic')  # 'semantic' or 'text'
     limit = int(request.args.get('limit', 5))
+    use_reranker = request.args.get('rerank', 'false').lower() in ('1', 'true')
     
     if not query:
         return jsonify({"error": "Query is required"}), 400
     
     try:
-        if search_type == 'semantic':
-            # Semantic search using vector embeddings
-            results = search_similar_truths(query, limit)
-            return jsonify({
-                "results": [
-                    {
-                        "id": t.id,
-                        "content": t.content,
-                        "source": t.source,
-                        "topics": t.get_topics(),
-                        "created_at": t.created_at.isoformat()
-                    } for t in results
-                ]
-            })
-        else:
-            # Text-based search
-            results = Truth.query.filter(Truth.content.ilike(f'%{query}%')).limit(limit).all()
-            return jsonify({
-                "results": [
+        filters = parse_search_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+    
+    try:
+        results = retrieve_truths(query, limit, search_type, use_reranker, **filters)
+        return jsonify({
+            "results": [
+                {
+                    "id": t.id,
+                    "content": t.content,
+                    "source": t.source,
+                    "topics": t.get_topics(),
+                    "created_at": t.created_at.isoformat()
+                } for t in results
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Error searching truths: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@truth_bp.route('/search/batch', methods=['POST'])
+def search_truths_batch():
+    """Run several searches in one request
+
+    Expects {"queries": [...], "type": "semantic"|"text", "limit": 5} plus the
+    optional filters of /search (topics as a list). Results are returned as one
+    list per query, in the same order as the queries.
+    """
+    data = request.json or {}
+    queries = data.get('queries')
+    search_type = data.get('type', 'semantic')
+    limit = int(data.get('limit', 5))
+
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "queries must be a non-empty list of strings"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+
+    try:
+        topics = data.get('topics')
+        filters = {
+            "topics": [topics] if isinstance(topics, str) else topics or None,
+            "source_prefix": data.get('source_prefix') or None,
+            "created_after": datetime.fromisoformat(data['created_after']) if data.get('created_after') else None,
+            "created_before": datetime.fromisoformat(data['created_before']) if data.get('created_before') else None,
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+
+    try:
+        batches = retrieve_truths_batch(queries, limit, search_type, **filters)
+        return jsonify({
+            "results": [
+                [
                     {
                         "id": t.id,
                         "content": t.content,
@@ -176,12 +347,18 @@ def search_truths():
                         "topics": t.get_topics(),
                         "created_at": t.created_at.isoformat()
                     } for t in results
-                ]
-            })
+                ] for results in batches
+            ]
+        })
     except Exception as e:
-        logger.error(f"Error searching truths: {e}")
+        logger.error(f"Error running batch search: {e}")
         return jsonify({"error": str(e)}), 500
 
+@truth_bp.route('/search/cache', methods=['GET'])
+def get_search_cache_stats():
+    """Get hit/miss counters of the query embedding and search result caches"""
+    return jsonify(cache_stats())
+
 @truth_bp.route('/by-topic/<topic>', methods=['GET'])
 def get_truths_by_topic(topic):
     """Get truths by topic"""
@@ -217,20 +394,21 @@ def get_truths_by_topic(topic):
 
 @truth_bp.route('/all', methods=['GET'])
 def get_all_truths():
-    """Get all truths"""
+    """Get all truths, streamed so memory stays flat for large stores"""
+    def serialize(truths):
+        for t in truths:
+            yield {
+                "id": t.id,
+                "content": t.content,
+                "source": t.source,
+                "topics": t.get_topics(),
+                "created_at": t.created_at.isoformat()
+            }
+
     try:
-        truths = Truth.query.all()
-        return jsonify({
-            "truths": [
-                {
-                    "id": t.id,
-                    "content": t.content,
-                    "source": t.source,
-                    "topics": t.get_topics(),
-                    "created_at": t.created_at.isoformat()
-                } for t in truths
-            ]
-        })
+        truths = stream_query(Truth.query.order_by(Truth.id))
+        body = stream_json_object({}, {"truths": serialize(truths)})
+        return Response(stream_with_context(body), mimetype='application/json')
     except Exception as e:
         logger.error(f"Error getting all truths: {e}")
         return jsonify({"error": str(e)}), 500
@@ -253,25 +431,78 @@ def get_all_topics():
         logger.error(f"Error getting all topics: {e}")
         return jsonify({"error": str(e)}), 500
 
-def extract_topics(content):
-    """
-    Extract topics from content
-    Simple implementation - in a real system, this would use more sophisticated NLP
-    """
-    # Simple keyword extraction - this is a placeholder
-    # In a production system, you'd use NER, keyword extraction, or topic modeling
-    common_topics = [
-        "faith", "revelation", "scripture", "prophecy", "truth",
-        "wisdom", "knowledge", "salvation", "redemption", "covenant"
-    ]
-    
-    found_topics = []
-    for topic in common_topics:
-        if topic.lower() in content.lower():
-            found_topics.append(topic)
-    
-    # Default topic if none found
-    if not found_topics:
-        found_topics = ["general"]
-    
-    return found_topics
+@truth_bp.route('/topics/vocabulary', methods=['GET'])
+def get_topic_vocabulary():
+    """Get the terms used to tag truths with topics"""
+    try:
+        ensure_default_vocabulary()
+        terms = [t.term for t in TopicTerm.query.order_by(TopicTerm.term).all()]
+        return jsonify({"terms": terms, "version": vocabulary_version()})
+    except Exception as e:
+        logger.error(f"Error getting topic vocabulary: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@truth_bp.route('/topics/vocabulary', methods=['POST'])
+def add_topic_vocabulary():
+    """Add terms to the topic vocabulary; existing truths keep their topics until updated"""
+    data = request.json or {}
+    terms = data.get('terms')
+    if isinstance(terms, str):
+        terms = [terms]
+    if not terms or not all(isinstance(t, str) for t in terms):
+        return jsonify({"error": "terms must be a string or a list of strings"}), 400
+
+    try:
+        added = add_terms(terms)
+        return jsonify({"added": added, "version": vocabulary_version()})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error adding topic terms: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@truth_bp.route('/topics/vocabulary/<path:term>', methods=['DELETE'])
+def delete_topic_vocabulary(term):
+    """Remove a term from the topic vocabulary"""
+    try:
+        if not remove_term(term):
+            return jsonify({"error": "Term not found"}), 404
+        return jsonify({"message": "Term removed", "version": vocabulary_version()})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error removing topic term: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@truth_bp.route('/clusters', methods=['GET'])
+def get_topic_clusters():
+    """Get the embedding clusters used as topics and the clustering job state"""
+    try:
+        return jsonify(clustering_status())
+    except Exception as e:
+        logger.error(f"Error getting topic clusters: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@truth_bp.route('/clusters/rebuild', methods=['POST'])
+def rebuild_topic_clusters():
+    """Start the background clustering job"""
+    if not start_clustering_job():
+        return jsonify({"error": "A clustering job is already running"}), 409
+    return jsonify({"message": "Clustering job started"}), 202
+
+@truth_bp.route('/index/stats', methods=['GET'])
+def get_index_stats():
+    """Get vector index size, memory use, reranker cost and (optionally) measured recall"""
+    try:
+        if truth_index.generation is None:
+            truth_index.refresh(force=True)
+        stats = truth_index.stats()
+        stats["reranker"] = rerank_stats()
+        if request.args.get('recall'):
+            stats["recall"] = truth_index.estimate_recall(
+                sample_size=int(request.args.get('sample', 100)),
+                top_k=int(request.args.get('k', 10)),
+                rerank_factor=int(request.args['rerank']) if 'rerank' in request.args else None
+            )
+        return jsonify(stats)
+    except Exception as e:
+        logger.error(f"Error getting index stats: {e}")
+        return jsonify({"error": str(e)}), 500
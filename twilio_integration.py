@@ -1,14 +1,36 @@
+import io
 import os
+import csv
 import time
+import uuid
+import base64
 import logging
-from flask import Blueprint, request, Response, jsonify
+from datetime import datetime
+from xml.sax.saxutils import escape
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import Blueprint, request, Response, jsonify, stream_with_context
 from twilio.twiml.voice_response import VoiceResponse
 from twilio.rest import Client
+from sqlalchemy import and_, or_
 from app import db
 from models import CallLog
+from db_writer import run_write
+from db_profile import stream_query
 # LLM is still disabled as we don't have the ML packages
-# from llm_handler import generate_text
+# from llm_handler import generate_response
 from truth_store import add_truth, search_truths
+from speech_to_text import is_trusted_recording_url, submit_recording, stt_stats, warm_model
+from twilio_security import twilio_webhook
+from outbound_calls import dispatcher, twilio_http_client
+from call_retention import call_stats, retention_status, request_retention_run
+from voice_analytics import voice_analytics, recent_turns
+from conversation_memory import get_session, end_session, memory_stats
+from voice_prompts import (
+    VOICE, cached_fragment, document, pause, prompt, prompt_stats, render_verbs, say, verb
+)
+from voice_pipeline import (
+    DEFAULT_RESPONSE, answer_turn, prefetch_answer
+)
 import json
 
 # Configure logging
@@ -17,6 +39,20 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 twilio_bp = Blueprint('twilio', __name__, url_prefix='/api/twilio')
 
+def _log_new_call(call_sid, caller_number, transcript=None):
+    """Stage a call log row for a new call; returns its ID"""
+    call_log = CallLog(twilio_sid=call_sid, caller_number=caller_number, transcript=transcript)
+    db.session.add(call_log)
+    db.session.flush()
+    return call_log.id
+
+def _update_call_log(call_sid, **fields):
+    """Stage new values for a call log row"""
+    call_log = CallLog.query.filter_by(twilio_sid=call_sid).first()
+    if call_log:
+        for name, value in fields.items():
+            setattr(call_log, name, value)
+
 # Twilio credentials from environment variables
 account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
 auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
@@ -26,68 +62,126 @@ phone_number = os.environ.get('TWILIO_PHONE_NUMBER')
 twilio_client = None
 if account_sid and auth_token:
     try:
-        twilio_client = Client(account_sid, auth_token)
+        twilio_client = Client(account_sid, auth_token, http_client=twilio_http_client())
+        dispatcher.configure(twilio_client, phone_number)
         logger.info(f"Twilio client initialized with phone number: {phone_number}")
     except Exception as e:
         logger.error(f"Error initializing Twilio client: {e}")
 else:
     logger.warning("Twilio credentials not found in environment variables")
 
+# How a caller's turn is captured: 'gather' recognizes speech and answers in
+# the same request, 'record' records it and answers after transcription,
+# 'stream' connects the call to the media stream server (media_streams.py)
+TWILIO_VOICE_MODE = os.environ.get('TWILIO_VOICE_MODE', 'gather').lower()
+# Public websocket URL of the media stream server, e.g. wss://host/media-stream
+MEDIA_STREAM_URL = os.environ.get('MEDIA_STREAM_URL', '')
+# Silence that ends an utterance in gather mode
+TWILIO_SPEECH_TIMEOUT = os.environ.get('TWILIO_SPEECH_TIMEOUT', 'auto')
+TWILIO_SPEECH_LANGUAGE = os.environ.get('TWILIO_SPEECH_LANGUAGE', 'en-US')
+# How long a recording turn waits for local transcription before answering
+# later; Twilio gives up on a webhook after 15 seconds
+STT_INLINE_WAIT_SECONDS = float(os.environ.get('STT_INLINE_WAIT_SECONDS', '8'))
+# Most numbers accepted by one bulk outbound request
+MAX_BULK_CALLS = int(os.environ.get('MAX_BULK_CALLS', '1000'))
+# Longest wait for an answer already being computed from partial results
+SPEECH_PREFETCH_WAIT_SECONDS = float(os.environ.get('SPEECH_PREFETCH_WAIT_SECONDS', '3'))
+# Call logs returned per page by default, and the most a client may ask for
+CALL_LOG_PAGE_SIZE = int(os.environ.get('CALL_LOG_PAGE_SIZE', '50'))
+CALL_LOG_MAX_PAGE_SIZE = int(os.environ.get('CALL_LOG_MAX_PAGE_SIZE', '500'))
+
+# Placeholders filled into cached fragments
+_PROMPT_SLOT = "__prompt__"
+_CALLER_SLOT = "__caller__"
+
+def _gather_speech(prompt_name, action='/api/twilio/process-speech'):
+    """TwiML that listens for one spoken turn; partial results start the answer early"""
+    def build(resp):
+        gather = resp.gather(
+            input='speech',
+            action=action,
+            method='POST',
+            speech_timeout=TWILIO_SPEECH_TIMEOUT,
+            language=TWILIO_SPEECH_LANGUAGE,
+            partial_result_callback='/api/twilio/speech-partial',
+            partial_result_callback_method='POST',
+            action_on_empty_result=True
+        )
+        # Callers can talk over the prompt; speech interrupts it
+        gather.say(_PROMPT_SLOT, voice=VOICE)
+    return cached_fragment(
+        ("gather", prompt_name, action),
+        lambda: render_verbs(build).replace(say(_PROMPT_SLOT), prompt(prompt_name))
+    )
+
+def _stream_fragment(caller):
+    """TwiML that connects the call to the media stream server"""
+    def build(resp):
+        stream = resp.connect().stream(url=MEDIA_STREAM_URL)
+        stream.parameter(name='caller', value=_CALLER_SLOT)
+    template = verb("stream", build)
+    return template.replace(_CALLER_SLOT, escape(caller, {'"': '&quot;'}))
+
+def _turn_mode():
+    if TWILIO_VOICE_MODE == 'stream' and MEDIA_STREAM_URL:
+        return 'stream'
+    return 'gather' if TWILIO_VOICE_MODE == 'gather' else 'record'
+
 @twilio_bp.route('/voice', methods=['POST'])
+@twilio_webhook
 def voice_webhook():
     """Handle incoming voice calls from Twilio"""
-    logger.debug("Received voice webhook request")
-    logger.debug(f"Request values: {request.values}")
-    
-    # Create TwiML response
-    resp = VoiceResponse()
-    
     # Get call SID for tracking
     call_sid = request.values.get('CallSid')
     caller = request.values.get('From', 'unknown')
+    mode = _turn_mode()
     
-    # Greeting message
-    resp.say("Welcome to Zion's Steward. I am here to help you store and retrieve truths.", voice="Polly.Matthew")
-    resp.pause(length=1)
-    
-    # Check if this is a new call or a response to a conversation
-    existing_call = CallLog.query.filter_by(twilio_sid=call_sid).first()
+    # Check if this is a new call or a response to a conversation, with one
+    # lookup on the unique twilio_sid index
+    existing_call = db.session.query(CallLog.transcript).filter_by(twilio_sid=call_sid).first()
     
+    # Static parts of the response are cached TwiML fragments
+    fragments = [prompt("welcome"), pause(1)]
     if existing_call and existing_call.transcript:
         # This is a continuing conversation
-        resp.say("How else may I assist you today?", voice="Polly.Matthew")
+        fragments.append(prompt("assist_again"))
     else:
         # This is a new call
-        resp.say("You may ask me to store a truth, retrieve information on a topic, or ask general questions.", voice="Polly.Matthew")
-        resp.say("Please speak after the tone.", voice="Polly.Matthew") 
-    
-    # Record the caller's speech with simpler configuration
-    resp.record(
-        action='/api/twilio/process-recording',
-        maxLength=60,
-        playBeep=True,
-        timeout=3
-    )
+        fragments.append(prompt("instructions"))
+        if mode == 'record':
+            fragments.append(prompt("speak_after_tone"))
+            # Have the transcription model loading while the caller speaks
+            warm_model()
+    
+    if mode == 'stream':
+        # Real-time audio both ways; the media stream server takes the turns from here
+        fragments.append(_stream_fragment(caller))
+    elif mode == 'gather':
+        # Recognize the caller's speech and answer in the same turn
+        fragments.append(_gather_speech("listening"))
+    else:
+        # Record the caller's speech with simpler configuration
+        fragments.append(verb("record", lambda resp: resp.record(
+            action='/api/twilio/process-recording',
+            maxLength=60,
+            playBeep=True,
+            timeout=3
+        )))
     
     # Log the call
     try:
         if not existing_call:
-            call_log = CallLog(
-                twilio_sid=call_sid,
-                caller_number=caller
-            )
-            db.session.add(call_log)
-            db.session.commit()
+            run_write(_log_new_call, call_sid, caller)
             logger.debug(f"New call logged with SID: {call_sid}")
         
     except Exception as e:
         logger.error(f"Error logging call: {e}")
         db.session.rollback()
     
-    logger.debug(f"Returning TwiML response: {str(resp)}")
-    return Response(str(resp), mimetype='text/xml')
+    return Response(document(*fragments), mimetype='text/xml')
 
 @twilio_bp.route('/process-recording', methods=['POST'])
+@twilio_webhook
 def process_recording():
     """Process the recording after the caller speaks"""
     logger.debug("Processing recording")
@@ -102,31 +196,43 @@ def process_recording():
     recording_sid = request.values.get('RecordingSid')
     recording_duration = request.values.get('RecordingDuration')
     
+    if recording_url and not is_trusted_recording_url(recording_url):
+        # Recordings are fetched with the account credentials, so only from Twilio
+        logger.warning(f"Ignoring recording for {call_sid} at untrusted URL {recording_url}")
+        recording_url = None
+    
     if recording_url:
         # Process recording directly
         try:
-            # Use a default transcript until we can process the recording
-            transcript = "User recording received"
-            
             # Update the call log
             call_log = CallLog.query.filter_by(twilio_sid=call_sid).first()
             if call_log:
-                call_log.transcript = transcript
-                
-                # Generate a response based on what we know
-                response = "I've received your message and I'm processing it."
-                
-                # Try to use our text-based recognition since Twilio transcription
-                # can be unreliable in the webhook flow
+                # Transcribe locally and answer in this turn if it finishes in time;
+                # otherwise the worker fills in the call log when it is done
+                answer = None
+                job = submit_recording(call_sid, recording_url, call_log.caller_number)
+                if job is not None:
+                    try:
+                        _, answer = job.result(timeout=STT_INLINE_WAIT_SECONDS)
+                    except FutureTimeout:
+                        logger.info(f"Recording for {call_sid} is still being transcribed")
+                    except Exception as stt_error:
+                        logger.warning(f"Local transcription failed for {call_sid}: {stt_error}")
+                        job = None
                 
-                # Update the call log with our best response
-                call_log.response = response
-                db.session.commit()
-                
-                # Respond to the user
-                resp.say("I've received your message.", voice="Polly.Matthew")
-                resp.pause(length=1)
-                resp.say(response, voice="Polly.Matthew")
+                if answer:
+                    resp.say(answer, voice="Polly.Matthew")
+                else:
+                    # Generate a response based on what we know
+                    response = "I've received your message and I'm processing it."
+                    if job is None:
+                        # Use a default transcript when the recording cannot be transcribed
+                        run_write(_update_call_log, call_sid, transcript="User recording received", response=response)
+                    
+                    # Respond to the user
+                    resp.say("I've received your message.", voice="Polly.Matthew")
+                    resp.pause(length=1)
+                    resp.say(response, voice="Polly.Matthew")
                 
                 # Allow for conversation to continue
                 resp.redirect('/api/twilio/voice')
@@ -143,10 +249,49 @@ def process_recording():
     else:
         resp.say("I didn't receive any recording. Please call back and try again.", voice="Polly.Matthew")
     
-    logger.debug(f"Returning recording response: {str(resp)}")
     return Response(str(resp), mimetype='text/xml')
 
+@twilio_bp.route('/process-speech', methods=['POST'])
+@twilio_webhook
+def process_speech():
+    """Answer a recognized spoken turn and keep listening (gather mode)"""
+    call_sid = request.values.get('CallSid')
+    caller = request.values.get('From', 'unknown')
+    transcript = (request.values.get('SpeechResult') or '').strip()
+    
+    if not transcript:
+        # Ask once more, then end a silent call instead of listening forever
+        if request.args.get('retry'):
+            twiml = document(prompt("goodbye"), verb("hangup", lambda resp: resp.hangup()))
+        else:
+            twiml = document(_gather_speech("not_caught", action='/api/twilio/process-speech?retry=1'))
+        return Response(twiml, mimetype='text/xml')
+    
+    logger.info(f"Received speech for call {call_sid}: {transcript} (confidence {request.values.get('Confidence')})")
+    
+    # Use the answer started from partial results when the words did not change
+    response = answer_turn(call_sid, transcript, caller, "gather", prefetch_wait=SPEECH_PREFETCH_WAIT_SECONDS)
+    
+    try:
+        run_write(_update_call_log, call_sid, transcript=transcript, response=response)
+    except Exception as e:
+        logger.error(f"Error updating call log for {call_sid}: {e}")
+    
+    return Response(document(say(response), _gather_speech("assist_again")), mimetype='text/xml')
+
+@twilio_bp.route('/speech-partial', methods=['POST'])
+@twilio_webhook
+def speech_partial():
+    """Start answering from a partial speech result while the caller is still talking"""
+    call_sid = request.values.get('CallSid')
+    stable = (request.values.get('StableSpeechResult') or '').strip()
+    unstable = (request.values.get('UnstableSpeechResult') or '').strip()
+    hypothesis = unstable if unstable.startswith(stable) else f"{stable} {unstable}".strip()
+    prefetch_answer(call_sid, hypothesis)
+    return Response(status=200)
+
 @twilio_bp.route('/process-transcript', methods=['POST'])
+@twilio_webhook
 def process_transcript():
     """Process the transcribed text from the recording"""
     logger.debug("Processing transcript")
@@ -165,14 +310,12 @@ def process_transcript():
         # Update call log with transcript
         call_log = CallLog.query.filter_by(twilio_sid=call_sid).first()
         if call_log:
-            call_log.transcript = transcript
-            
             # Try to use the LLM handler if available, otherwise use rule-based responses
-            response = "Thank you for your contribution to Zion's knowledge."
+            response = DEFAULT_RESPONSE
             
             # Attempt to use LLM to analyze the transcript
             try:
-                from llm_handler import generate_text
+                from llm_handler import generate_response
                 
                 # Create prompt that classifies the intent and generates a response
                 prompt = f"""Classify the following transcript from a voice call and generate an appropriate response:
@@ -188,8 +331,8 @@ def process_transcript():
                 If intent is to store a truth, extract the truth content.
                 """
                 
-                # Try to get LLM response - fix function call to match the API
-                llm_response = generate_text()  # The LLM handler will extract the prompt from the request
+                # Try to get LLM response, with this call's earlier turns in the model input
+                llm_response = generate_response(prompt, call_sid=call_sid)
                 
                 if isinstance(llm_response, dict) and "response" in llm_response:
                     logger.info("Using LLM-generated response")
@@ -226,206 +369,18 @@ def process_transcript():
                 logger.warning(f"Error using LLM for transcript analysis: {llm_error}")
                 logger.info("Falling back to rule-based processing")
             
-            # Fallback to rule-based intent recognition
-            if "store this truth" in transcript.lower() or "remember this" in transcript.lower():
-                # Extract the truth content
-                try:
-                    truth_content = transcript
-                    
-                    # Check for various formats
-                    if "store this truth:" in transcript.lower():
-                        logger.info("Found 'store this truth:' with colon")
-                        truth_content = transcript.lower().split("store this truth:", 1)[1].strip()
-                    elif "Store this truth:" in transcript:
-                        logger.info("Found 'Store this truth:' with colon")
-                        truth_content = transcript.split("Store this truth:", 1)[1].strip()
-                    elif "store this truth" in transcript.lower():
-                        logger.info("Found 'store this truth' without colon")
-                        truth_content = transcript.lower().split("store this truth", 1)[1].strip()
-                    elif "Store this truth" in transcript:
-                        logger.info("Found 'Store this truth' without colon")
-                        truth_content = transcript.split("Store this truth", 1)[1].strip()
-                    elif "remember this" in transcript.lower():
-                        logger.info("Found 'remember this'")
-                        truth_content = transcript.lower().split("remember this", 1)[1].strip()
-                    else:
-                        # Just in case we can't parse correctly
-                        logger.warning("Using full transcript as truth content")
-                        # Already set to transcript above
-                    
-                    logger.info(f"Extracted truth content: '{truth_content}'")
-                except Exception as extract_error:
-                    logger.error(f"Truth extraction error: {extract_error}")
-                    truth_content = transcript
-                
-                # Store the truth in our database
-                try:
-                    add_truth_data = {
-                        'content': truth_content,
-                        'source': f"Voice call from {call_log.caller_number}"
-                    }
-                    
-                    # Add truth to database
-                    add_truth(add_truth_data)
-                    
-                    response = f"I've stored the truth: '{truth_content}'. Thank you for contributing to Zion's knowledge."
-                    logger.info(f"Added truth from rule-based extraction: {truth_content}")
-                except Exception as truth_error:
-                    logger.error(f"Error adding truth: {truth_error}")
-                    response = "I encountered an error storing your truth. Please try again later."
-            
-            # If it looks like a question or information request, try to find relevant information
-            elif ("?" in transcript or 
-                  transcript.lower().startswith("what") or 
-                  transcript.lower().startswith("how") or 
-                  transcript.lower().startswith("why") or
-                  transcript.lower().startswith("tell me about") or
-                  transcript.lower().startswith("tell us about") or
-                  "tell me about" in transcript.lower() or
-                  "information on" in transcript.lower() or
-                  "information about" in transcript.lower() or
-                  "i need information" in transcript.lower() or
-                  "i want information" in transcript.lower() or
-                  "i need to know" in transcript.lower() or
-                  "i want to know" in transcript.lower() or
-                  "i would like to know" in transcript.lower() or
-                  "would like to know" in transcript.lower() or
-                  "can you tell me" in transcript.lower()):
-                try:
-                    # Directly search the database for relevant truths - extract just the key search terms
-                    search_terms = transcript.lower()
-                    # Remove common question words and phrases
-                    for phrase in ["?", "what is", "what are", "tell me about", "tell us about", 
-                                  "information on", "information about", "how does", "how do", 
-                                  "why is", "why are", "i need information about",
-                                  "i need information on", "i want information about", "i want information on",
-                                  "i need to know about", "i want to know about", 
-                                  "can you tell me about ", "can you tell me about",  # Added space version
-                                  "i need", "i want", "can you tell me", "can you", "could you tell me", "could you",
-                                  "i would like to know", "would like to know", "what does it mean to", "what does it mean by",
-                                  "what does it mean", "what do you know about"]:
-                        search_terms = search_terms.replace(phrase, "")
-                    search_terms = search_terms.strip()
-                    
-                    # Further clean up the search terms
-                    search_terms = ' '.join(search_terms.split())  # Normalize whitespace
-                    
-                    # Handle capitalization issues with terms like 'Holy Spirit' vs 'holy spirit'
-                    search_terms_lower = search_terms.lower()
-                    
-                    # Special handling for spirit vs Holy Spirit
-                    if "spirit" in search_terms_lower and not "holy spirit" in search_terms_lower:
-                        # Check if we're talking about the Holy Spirit
-                        if "walk by" in search_terms_lower or "led by" in search_terms_lower:
-                            search_terms = "holy spirit"
-                            logger.info("Search term contains 'spirit', refined to 'holy spirit'")
-                    
-                    # Special handling for endurance/enduring variations
-                    if "endure to the end" in search_terms_lower:
-                        search_terms = "enduring to the end"
-                        logger.info("Search term contains 'endure to the end', refined to 'enduring to the end'")
-                    elif "endurance test" in search_terms_lower:
-                        search_terms = "endurance is the test"
-                        logger.info("Search term contains 'endurance test', refined to 'endurance is the test'")
-                    elif "endurance" in search_terms_lower and "consecration" in search_terms_lower:
-                        search_terms = "endurance is consecration"
-                        logger.info("Search term contains both 'endurance' and 'consecration', refined to 'endurance is consecration'")
-                    elif "endure" in search_terms_lower and "endurance" not in search_terms_lower:
-                        search_terms = "endurance"
-                        logger.info("Search term contains 'endure', refined to 'endurance'")
-                    
-                    # If the search term has multiple words, try to identify the main subject
-                    if len(search_terms.split()) > 3:
-                        # Look for keywords in our database to focus the search
-                        key_topics = ["faith", "revelation", "truth", "scripture", "prophecy", 
-                                    "gospel", "holy spirit", "jesus", "christ", "salvation",
-                                    "repentance", "baptism", "endurance", "enduring", "covenant",
-                                    "elements of repentance", "pattern of faith", "alma 32", 
-                                    "baptismal covenant", "holy ghost", "gift of the holy ghost"]
-                        
-                        # Try to find the most specific match first, otherwise fallback to a broader term
-                        found_specific_topic = False
-                        
-                        # First look for multi-word specific topics
-                        for topic in key_topics:
-                            if " " in topic and topic.lower() in search_terms_lower:
-                                search_terms = topic
-                                logger.info(f"Refined search to specific key topic: {topic}")
-                                found_specific_topic = True
-                                break
-                        
-                        # If no specific topic found, try broader single word matches
-                        if not found_specific_topic:
-                            for topic in key_topics:
-                                if " " not in topic and topic.lower() in search_terms_lower:
-                                    search_terms = topic
-                                    logger.info(f"Refined search to key topic: {topic}")
-                                    break
-                    
-                    # Log what we're searching for
-                    logger.info(f"Searching for: '{search_terms}'")
-                    
-                    # Perform an enhanced search with special handling for key concepts
-                    from models import Truth
-                    
-                    # Check for specific theological concepts that need to be handled specially
-                    specific_concept_searches = {
-                        "pattern of faith": "pattern of faith in alma 32",
-                        "elements of repentance": "five elements of repentance",
-                        "baptismal covenant": "baptismal covenant",
-                        "holy ghost": "holy ghost is not just a comforter",
-                        "gift of the holy ghost": "gift of the holy ghost",
-                        "enduring to the end": "enduring to the end",
-                        "gospel system": "gospel system",
-                    }
-                    
-                    # Check if we're dealing with a known theological concept
-                    concept_search_term = None
-                    for concept, search_phrase in specific_concept_searches.items():
-                        if concept.lower() in search_terms.lower():
-                            concept_search_term = search_phrase
-                            logger.info(f"Using specialized concept search: '{concept_search_term}' for '{search_terms}'")
-                            break
-                    
-                    # Perform the search with the appropriate search term
-                    if concept_search_term:
-                        # Try the specialized concept search first
-                        results = Truth.query.filter(Truth.content.ilike(f'%{concept_search_term}%')).limit(3).all()
-                        if not results:
-                            # Fall back to the original search term
-                            results = Truth.query.filter(Truth.content.ilike(f'%{search_terms}%')).limit(3).all()
-                    else:
-                        # Use standard search
-                        results = Truth.query.filter(Truth.content.ilike(f'%{search_terms}%')).limit(3).all()
-                    
-                    if results:
-                        # Found relevant information
-                        truth_content = results[0].content
-                        # Clean the truth content from any leading colon or formatting issues
-                        if truth_content.startswith(":"):
-                            truth_content = truth_content[1:].strip()
-                            
-                        response = f"Based on what I know: {truth_content}"
-                        logger.info(f"Found truth: {truth_content}")
-                    else:
-                        logger.info(f"No truths found for '{search_terms}'")
-                        response = f"I don't have specific information about {search_terms} yet. You can contribute this truth by saying 'Store this truth: ' followed by what you know."
-                except Exception as search_error:
-                    logger.error(f"Error searching truths: {search_error}")
+            # Rule-based intent recognition, shared with the speech turn
+            response = answer_turn(call_sid, transcript, call_log.caller_number, "transcription", response)
             
-            # Update call log with response
-            call_log.response = response
-            db.session.commit()
+            # Update call log with transcript and response
+            run_write(_update_call_log, call_sid, transcript=transcript, response=response)
             
             # Optionally call back to confirm (would need LLM for more complex interactions)
             if twilio_client and call_log and "store this truth" in transcript.lower():
                 try:
-                    twilio_client.calls.create(
-                        to=call_log.caller_number,
-                        from_=phone_number,
-                        twiml=f'<Response><Say voice="Polly.Matthew">{response}</Say></Response>'
-                    )
-                    logger.info(f"Callback sent to {call_log.caller_number}")
+                    # Queued, so a burst of callbacks cannot block this worker or exceed the CPS limit
+                    dispatcher.enqueue(call_log.caller_number, document(say(response)))
+                    logger.info(f"Callback queued to {call_log.caller_number}")
                 except Exception as callback_error:
                     logger.error(f"Error making callback: {callback_error}")
         
@@ -435,11 +390,41 @@ def process_transcript():
         logger.error(f"Error processing transcript: {e}")
         return Response(status=500)
 
+@twilio_bp.route('/call-status', methods=['POST'])
+@twilio_webhook
+def call_status():
+    """Status callback: release a finished call's conversation memory and record its duration"""
+    call_sid = request.values.get('CallSid')
+    if request.values.get('CallStatus') in ('completed', 'busy', 'failed', 'no-answer', 'canceled'):
+        end_session(call_sid)
+        duration = request.values.get('CallDuration')
+        if duration and duration.isdigit():
+            try:
+                run_write(_update_call_log, call_sid, call_duration=int(duration))
+            except Exception as e:
+                logger.error(f"Error recording duration for {call_sid}: {e}")
+    return Response(status=204)
+
+@twilio_bp.route('/calls/<call_sid>/conversation', methods=['GET'])
+def get_call_conversation(call_sid):
+    """Get the conversation memory of a call: summary of older turns and the recent ones"""
+    try:
+        session = get_session(call_sid)
+        if not session.turn_count:
+            return jsonify({"error": "No turns recorded for this call"}), 404
+        return jsonify(session.to_dict())
+    except Exception as e:
+        logger.error(f"Error getting conversation for {call_sid}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@twilio_bp.route('/conversations/stats', methods=['GET'])
+def get_conversation_stats():
+    """Get how many call conversations this worker holds in memory"""
+    return jsonify(memory_stats())
+
 @twilio_bp.route('/outbound-call', methods=['POST'])
 def make_outbound_call():
-    """Make an outbound call with a specific message"""
-    logger.debug("Outbound call attempt")
-    
+    """Queue an outbound call with a specific message"""
     if not twilio_client:
         return jsonify({"error": "Twilio client not initialized"}), 500
     
@@ -450,46 +435,242 @@ def make_outbound_call():
     if not to_number or not message:
         return jsonify({"error": "To number and message are required"}), 400
     
-    try:
-        # Make the call
-        call = twilio_client.calls.create(
-            to=to_number,
-            from_=phone_number,
-            twiml=f'<Response><Say voice="Polly.Matthew">{message}</Say></Response>'
-        )
-        
-        logger.info(f"Outbound call initiated to {to_number}, SID: {call.sid}")
-        
-        return jsonify({
-            "message": "Call initiated successfully",
-            "call_sid": call.sid
-        })
-    except Exception as e:
-        logger.error(f"Error making outbound call: {e}")
-        return jsonify({"error": str(e)}), 500
+    job_id = dispatcher.enqueue(to_number, document(say(message)))
+    if job_id is None:
+        return jsonify({"error": "Outbound call queue is full"}), 503
+    
+    return jsonify({
+        "message": "Call queued successfully",
+        "job_id": job_id
+    }), 202
+
+@twilio_bp.route('/outbound-calls/bulk', methods=['POST'])
+def make_bulk_outbound_calls():
+    """Queue the same message to many numbers; calls go out at the account's CPS limit"""
+    if not twilio_client:
+        return jsonify({"error": "Twilio client not initialized"}), 500
+    
+    data = request.json
+    numbers = data.get('numbers', [])
+    message = data.get('message')
+    
+    if not numbers or not message:
+        return jsonify({"error": "Numbers and message are required"}), 400
+    if len(numbers) > MAX_BULK_CALLS:
+        return jsonify({"error": f"At most {MAX_BULK_CALLS} numbers per request"}), 400
+    
+    twiml = document(say(message))
+    batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+    numbers = list(dict.fromkeys(numbers))
+    queued = len(dispatcher.enqueue_many(numbers, twiml, batch_id=batch_id))
+    
+    return jsonify({
+        "batch_id": batch_id,
+        "queued": queued,
+        "rejected": len(numbers) - queued
+    }), 202
+
+@twilio_bp.route('/outbound-calls/<job_id>', methods=['GET'])
+def get_outbound_call(job_id):
+    """Get the status of a queued outbound call"""
+    job = dispatcher.job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@twilio_bp.route('/outbound-calls/batch/<batch_id>', methods=['GET'])
+def get_outbound_batch(batch_id):
+    """Get status counts for a bulk outbound request"""
+    batch = dispatcher.batch(batch_id)
+    if not batch:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(batch)
+
+@twilio_bp.route('/outbound-calls/stats', methods=['GET'])
+def get_outbound_stats():
+    """Get this worker's outbound dispatcher counters"""
+    return jsonify(dispatcher.stats())
+
+CALL_LOG_EXPORT_FIELDS = ["id", "twilio_sid", "caller_number", "call_duration", "transcript", "response", "created_at"]
+
+def encode_log_cursor(log):
+    """Opaque cursor for the page after this row: its (created_at, id) position"""
+    return base64.urlsafe_b64encode(f"{log.created_at.isoformat()}|{log.id}".encode('utf-8')).decode('ascii')
+
+def decode_log_cursor(cursor):
+    """Return the (created_at, id) position in a cursor; raises ValueError if malformed"""
+    created_at, log_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+    return datetime.fromisoformat(created_at), int(log_id)
+
+def parse_call_log_filters(args):
+    """Read optional call log filters (caller, created_after, created_before, has_transcript) from query args"""
+    created_after = args.get('created_after')
+    created_before = args.get('created_before')
+    has_transcript = args.get('has_transcript')
+    return {
+        "caller": args.get('caller') or None,
+        "created_after": datetime.fromisoformat(created_after) if created_after else None,
+        "created_before": datetime.fromisoformat(created_before) if created_before else None,
+        "has_transcript": has_transcript.lower() == 'true' if has_transcript else None,
+    }
+
+def filter_call_log_query(query, caller=None, created_after=None, created_before=None, has_transcript=None):
+    """Apply call log filters, newest first; (created_at, id) keeps the order stable for cursors"""
+    if caller:
+        query = query.filter(CallLog.caller_number == caller)
+    if created_after:
+        query = query.filter(CallLog.created_at >= created_after)
+    if created_before:
+        query = query.filter(CallLog.created_at < created_before)
+    if has_transcript is True:
+        query = query.filter(CallLog.transcript.isnot(None), CallLog.transcript != '')
+    elif has_transcript is False:
+        query = query.filter(or_(CallLog.transcript.is_(None), CallLog.transcript == ''))
+    return query.order_by(CallLog.created_at.desc(), CallLog.id.desc())
 
 @twilio_bp.route('/logs', methods=['GET'])
 def get_call_logs():
-    """Get all call logs"""
+    """Get one page of call logs, newest first
+
+    Pass the returned next_cursor as ?cursor= to fetch the following page;
+    it is null on the last page.
+    """
     try:
-        logs = CallLog.query.order_by(CallLog.created_at.desc()).all()
+        filters = parse_call_log_filters(request.args)
+        limit = min(max(int(request.args.get('limit', CALL_LOG_PAGE_SIZE)), 1), CALL_LOG_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        position = decode_log_cursor(cursor) if cursor else None
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    try:
+        query = filter_call_log_query(CallLog.query, **filters)
+        if position:
+            # Keyset pagination: seek past the last row seen instead of OFFSET
+            created_at, log_id = position
+            query = query.filter(or_(
+                CallLog.created_at < created_at,
+                and_(CallLog.created_at == created_at, CallLog.id < log_id)
+            ))
+        # One extra row tells whether another page follows
+        logs = query.limit(limit + 1).all()
+        next_cursor = encode_log_cursor(logs[limit - 1]) if len(logs) > limit else None
         return jsonify({
-            "logs": [
-                {
-                    "id": log.id,
-                    "twilio_sid": log.twilio_sid,
-                    "caller_number": log.caller_number,
-                    "call_duration": log.call_duration,
-                    "transcript": log.transcript,
-                    "response": log.response,
-                    "created_at": log.created_at.isoformat()
-                } for log in logs
-            ]
+            "logs": [log.to_dict() for log in logs[:limit]],
+            "next_cursor": next_cursor
         })
     except Exception as e:
         logger.error(f"Error getting call logs: {e}")
         return jsonify({"error": str(e)}), 500
-        
+
+@twilio_bp.route('/logs/export', methods=['GET'])
+def export_call_logs():
+    """Stream every call log matching the filters as NDJSON (default) or CSV"""
+    try:
+        filters = parse_call_log_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    def ndjson_rows(logs):
+        for log in logs:
+            yield json.dumps(log.to_dict()) + '\n'
+
+    def csv_rows(logs):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CALL_LOG_EXPORT_FIELDS)
+        for log in logs:
+            row = log.to_dict()
+            writer.writerow([row[field] for field in CALL_LOG_EXPORT_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only, when nothing matched
+        yield buffer.getvalue()
+
+    try:
+        logs = stream_query(filter_call_log_query(CallLog.query, **filters))
+        if export_format == 'csv':
+            body, mimetype = csv_rows(logs), 'text/csv'
+        else:
+            body, mimetype = ndjson_rows(logs), 'application/x-ndjson'
+        filename = f"call-logs-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{export_format}"
+        return Response(stream_with_context(body), mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+    except Exception as e:
+        logger.error(f"Error exporting call logs: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@twilio_bp.route('/stats', methods=['GET'])
+def get_call_stats():
+    """Get call totals and per-day activity for the dashboard from the daily rollups"""
+    try:
+        days = min(max(int(request.args.get('days', 7)), 1), 366)
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    try:
+        return jsonify(call_stats(days))
+    except Exception as e:
+        logger.error(f"Error getting call stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@twilio_bp.route('/retention', methods=['GET'])
+def get_retention_status():
+    """Get the call log retention policy, archive size and last pass"""
+    try:
+        return jsonify(retention_status())
+    except Exception as e:
+        logger.error(f"Error getting retention status: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@twilio_bp.route('/retention/run', methods=['POST'])
+def run_call_retention():
+    """Start a retention pass in the background"""
+    if not request_retention_run():
+        return jsonify({"error": "A retention pass is already running"}), 409
+    return jsonify({"status": "started"}), 202
+
+@twilio_bp.route('/analytics', methods=['GET'])
+def get_voice_analytics():
+    """Get voice turn totals per intent and the most asked, most missed and slowest questions"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        return jsonify(voice_analytics(limit))
+    except Exception as e:
+        logger.error(f"Error getting voice analytics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@twilio_bp.route('/analytics/turns', methods=['GET'])
+def get_voice_turns():
+    """Get the newest voice turns, optionally by call_sid, intent and hit"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    hit = request.args.get('hit')
+    try:
+        return jsonify({"turns": recent_turns(limit, request.args.get('call_sid'), request.args.get('intent'),
+                                              hit.lower() == 'true' if hit else None)})
+    except Exception as e:
+        logger.error(f"Error getting voice turns: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@twilio_bp.route('/stt/stats', methods=['GET'])
+def get_stt_stats():
+    """Get local speech-to-text model and throughput counters"""
+    return jsonify(stt_stats())
+
+@twilio_bp.route('/prompts', methods=['GET'])
+def get_prompt_stats():
+    """Get which voice prompts are played from pre-rendered recordings"""
+    return jsonify(prompt_stats())
+
 @twilio_bp.route('/test-voice', methods=['GET'])
 def test_voice():
     """Generate a test TwiML response for voice handling"""
@@ -636,14 +817,9 @@ def simulate_voice_interaction():
         logger.info(f"Starting simulation with text: '{text}' and phone: {phone}")
         
         # Create a simulated call log
-        call_log = CallLog(
-            twilio_sid=f"SIMULATED_{int(time.time())}",
-            caller_number=phone,
-            transcript=text
-        )
-        db.session.add(call_log)
-        db.session.commit()
-        logger.info(f"Created call log with ID: {call_log.id}")
+        call_sid = f"SIMULATED_{int(time.time())}"
+        call_log_id = run_write(_log_new_call, call_sid, phone, text)
+        logger.info(f"Created call log with ID: {call_log_id}")
         
         # Process the text similar to how we'd process a transcript
         # Try to use the LLM handler if available, otherwise use rule-based responses
@@ -651,7 +827,7 @@ def simulate_voice_interaction():
         
         # Attempt to use LLM to analyze the text
         try:
-            from llm_handler import generate_text
+            from llm_handler import generate_response
             
             # Create prompt that classifies the intent and generates a response
             prompt = f"""Classify the following transcript from a voice call and generate an appropriate response:
@@ -667,8 +843,8 @@ def simulate_voice_interaction():
             If intent is to store a truth, extract the truth content.
             """
             
-            # Try to get LLM response - fix function call to match the API
-            llm_response = generate_text()  # The LLM handler will extract the prompt from the request
+            # Try to get LLM response, with this call's earlier turns in the model input
+            llm_response = generate_response(prompt, call_sid=call_sid)
             
             if isinstance(llm_response, dict) and "response" in llm_response:
                 logger.info("Using LLM-generated response")
@@ -928,8 +1104,7 @@ def simulate_voice_interaction():
                 logger.error(f"Error searching truths: {search_error}")
         
         # Update the call log with the response
-        call_log.response = response
-        db.session.commit()
+        run_write(_update_call_log, call_sid, response=response)
         
         return jsonify({
             "message": "Simulated voice interaction processed",
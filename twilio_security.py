@@ -0,0 +1,30 @@
+import os
+import logging
+from functools import wraps
+from flask import request, Response
+from twilio.request_validator import RequestValidator
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Twilio signs each webhook request with the account's auth token; requests
+# without a valid X-Twilio-Signature are refused. Set to false only for local testing.
+TWILIO_VALIDATE_SIGNATURES = os.environ.get('TWILIO_VALIDATE_SIGNATURES', 'true').lower() == 'true'
+
+def signature_valid(url, params, signature):
+    """Whether signature is Twilio's signature of url and params under TWILIO_AUTH_TOKEN"""
+    auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
+    if not auth_token or not signature:
+        return False
+    return RequestValidator(auth_token).validate(url, params, signature)
+
+def twilio_webhook(view):
+    """Refuse requests to a webhook route that were not signed by Twilio"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if TWILIO_VALIDATE_SIGNATURES and not signature_valid(
+                request.url, request.form, request.headers.get('X-Twilio-Signature')):
+            logger.warning(f"Refused unsigned request to {request.path} from {request.remote_addr}")
+            return Response("Invalid Twilio signature", status=403)
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,227 @@
+import os
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import case, func
+from app import app, db
+from models import VoiceTurn, VoiceQueryStat
+from db_writer import run_write
+from db_profile import bulk_insert, upsert_insert
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Turns are buffered in memory and written in batches, off the voice hot path
+VOICE_ANALYTICS_ENABLED = os.environ.get('VOICE_ANALYTICS_ENABLED', 'true').lower() == 'true'
+VOICE_ANALYTICS_FLUSH_SECONDS = float(os.environ.get('VOICE_ANALYTICS_FLUSH_SECONDS', '2'))
+VOICE_ANALYTICS_BATCH = int(os.environ.get('VOICE_ANALYTICS_BATCH', '200'))
+# Turns held while the database is slow; the oldest are dropped beyond this
+VOICE_ANALYTICS_MAX_PENDING = int(os.environ.get('VOICE_ANALYTICS_MAX_PENDING', '10000'))
+# Per-turn records are deleted after this many days; the running totals are kept
+VOICE_TURN_RETENTION_DAYS = int(os.environ.get('VOICE_TURN_RETENTION_DAYS', '30'))
+
+TURN_COLUMNS = ["call_sid", "channel", "intent", "search_terms", "hit", "prefetched", "latency_ms", "created_at"]
+SEARCH_TERMS_LENGTH = 256
+
+_pending = deque()
+_pending_lock = threading.Lock()
+_flush_requested = threading.Event()
+_flush_thread = None
+_counters = {"recorded": 0, "flushed": 0, "dropped": 0, "failed": 0}
+
+def record_turn(call_sid, channel, intent, search_terms, hit, latency_ms, prefetched=False):
+    """Queue one answered turn for the analytics tables; never blocks on the database"""
+    if not VOICE_ANALYTICS_ENABLED:
+        return
+    turn = {
+        "call_sid": call_sid,
+        "channel": channel,
+        "intent": intent,
+        "search_terms": ' '.join(search_terms.lower().split())[:SEARCH_TERMS_LENGTH] if search_terms else None,
+        "hit": hit,
+        "prefetched": prefetched,
+        "latency_ms": int(round(latency_ms)),
+        "created_at": datetime.utcnow(),
+    }
+    with _pending_lock:
+        if len(_pending) >= VOICE_ANALYTICS_MAX_PENDING:
+            _pending.popleft()
+            _counters["dropped"] += 1
+        _pending.append(turn)
+        _counters["recorded"] += 1
+        full = len(_pending) >= VOICE_ANALYTICS_BATCH
+    _ensure_flush_thread()
+    if full:
+        _flush_requested.set()
+
+def _ensure_flush_thread():
+    global _flush_thread
+    if _flush_thread is not None and _flush_thread.is_alive():
+        return
+    with _pending_lock:
+        if _flush_thread is None or not _flush_thread.is_alive():
+            _flush_thread = threading.Thread(target=_flush_loop, name="voice-analytics", daemon=True)
+            _flush_thread.start()
+
+def _flush_loop():
+    with app.app_context():
+        while True:
+            _flush_requested.wait(VOICE_ANALYTICS_FLUSH_SECONDS)
+            _flush_requested.clear()
+            try:
+                flush_turns()
+            finally:
+                db.session.remove()
+
+def _aggregate(turns):
+    """Sum a batch of turns per (intent, search terms)"""
+    deltas = {}
+    for turn in turns:
+        key = (turn["intent"], turn["search_terms"] or '')
+        delta = deltas.setdefault(key, {"turns": 0, "hits": 0, "misses": 0, "prefetched": 0,
+                                        "latency_ms_total": 0, "latency_ms_max": 0,
+                                        "last_seen_at": turn["created_at"]})
+        delta["turns"] += 1
+        delta["hits"] += turn["hit"] is True
+        delta["misses"] += turn["hit"] is False
+        delta["prefetched"] += bool(turn["prefetched"])
+        delta["latency_ms_total"] += turn["latency_ms"]
+        delta["latency_ms_max"] = max(delta["latency_ms_max"], turn["latency_ms"])
+        delta["last_seen_at"] = max(delta["last_seen_at"], turn["created_at"])
+    return deltas
+
+def _add_query_stats(session, deltas):
+    """Add per-(intent, search terms) deltas to the running totals in one upsert
+
+    Increments run in SQL and new keys are inserted with ON CONFLICT, so
+    workers flushing the same new question at once neither lose counts nor
+    fail on the unique constraint.
+    """
+    rows = [{"intent": intent, "search_terms": search_terms, **delta}
+            for (intent, search_terms), delta in sorted(deltas.items())]
+    if not rows:
+        return
+    stat = VoiceQueryStat.__table__.c
+    statement = upsert_insert(session, VoiceQueryStat).values(rows)
+    new = statement.excluded
+    session.execute(statement.on_conflict_do_update(index_elements=[stat.intent, stat.search_terms], set_={
+        "turns": stat.turns + new.turns,
+        "hits": stat.hits + new.hits,
+        "misses": stat.misses + new.misses,
+        "prefetched": stat.prefetched + new.prefetched,
+        "latency_ms_total": stat.latency_ms_total + new.latency_ms_total,
+        "latency_ms_max": case((stat.latency_ms_max < new.latency_ms_max, new.latency_ms_max),
+                               else_=stat.latency_ms_max),
+        "last_seen_at": new.last_seen_at,
+    }))
+
+def _apply_turns(turns):
+    """Stage the turn records and add them to the running totals"""
+    bulk_insert(db.session, VoiceTurn, turns, TURN_COLUMNS)
+    _add_query_stats(db.session, _aggregate(turns))
+
+def flush_turns():
+    """Write the buffered turns; returns how many were written
+
+    Analytics are best effort: a batch that cannot be written is dropped
+    and counted as failed rather than retried on the voice path.
+    """
+    with _pending_lock:
+        turns = list(_pending)
+        _pending.clear()
+    if not turns:
+        return 0
+    try:
+        run_write(_apply_turns, turns)
+        _counters["flushed"] += len(turns)
+        return len(turns)
+    except Exception as e:
+        _counters["failed"] += len(turns)
+        logger.error(f"Error writing {len(turns)} voice analytics turns: {e}")
+        return 0
+
+def _delete_turns_before(cutoff):
+    return VoiceTurn.query.filter(VoiceTurn.created_at < cutoff).delete(synchronize_session=False)
+
+def prune_voice_turns(now=None):
+    """Delete per-turn records past VOICE_TURN_RETENTION_DAYS; returns rows deleted"""
+    if VOICE_TURN_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = (now or datetime.utcnow()) - timedelta(days=VOICE_TURN_RETENTION_DAYS)
+    return run_write(_delete_turns_before, cutoff)
+
+def _stat_dict(stat):
+    searched = stat.hits + stat.misses
+    return {
+        "intent": stat.intent,
+        "search_terms": stat.search_terms or None,
+        "turns": stat.turns,
+        "hits": stat.hits,
+        "misses": stat.misses,
+        "hit_rate": round(stat.hits / searched, 3) if searched else None,
+        "prefetched": stat.prefetched,
+        "average_latency_ms": round(stat.latency_ms_total / stat.turns, 1) if stat.turns else None,
+        "max_latency_ms": stat.latency_ms_max,
+        "last_seen_at": stat.last_seen_at.isoformat() if stat.last_seen_at else None,
+    }
+
+def voice_analytics(limit=20):
+    """Return per-intent totals and the most asked, most missed and slowest questions"""
+    intents = {}
+    for intent, turns, hits, misses, prefetched, latency_total, latency_max in db.session.query(
+            VoiceQueryStat.intent, func.sum(VoiceQueryStat.turns), func.sum(VoiceQueryStat.hits),
+            func.sum(VoiceQueryStat.misses), func.sum(VoiceQueryStat.prefetched),
+            func.sum(VoiceQueryStat.latency_ms_total), func.max(VoiceQueryStat.latency_ms_max)
+    ).group_by(VoiceQueryStat.intent):
+        searched = hits + misses
+        intents[intent] = {
+            "turns": int(turns),
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": round(hits / searched, 3) if searched else None,
+            "prefetched": int(prefetched),
+            "average_latency_ms": round(latency_total / turns, 1) if turns else None,
+            "max_latency_ms": latency_max,
+        }
+
+    questions = VoiceQueryStat.query.filter(VoiceQueryStat.intent == "question",
+                                            VoiceQueryStat.search_terms != '')
+    average_latency = VoiceQueryStat.latency_ms_total / VoiceQueryStat.turns
+    with _pending_lock:
+        pipeline = {**_counters, "pending": len(_pending)}
+    return {
+        "intents": intents,
+        "top_queries": [_stat_dict(s) for s in
+                        questions.order_by(VoiceQueryStat.turns.desc()).limit(limit)],
+        "top_misses": [_stat_dict(s) for s in
+                       questions.filter(VoiceQueryStat.misses > 0)
+                       .order_by(VoiceQueryStat.misses.desc()).limit(limit)],
+        "slowest": [_stat_dict(s) for s in
+                    questions.order_by(average_latency.desc()).limit(limit)],
+        "pipeline": pipeline,
+    }
+
+def _turn_dict(turn):
+    return {
+        "id": turn.id,
+        "call_sid": turn.call_sid,
+        "channel": turn.channel,
+        "intent": turn.intent,
+        "search_terms": turn.search_terms,
+        "hit": turn.hit,
+        "prefetched": turn.prefetched,
+        "latency_ms": turn.latency_ms,
+        "created_at": turn.created_at.isoformat(),
+    }
+
+def recent_turns(limit=100, call_sid=None, intent=None, hit=None):
+    """Return the newest per-turn records, optionally filtered"""
+    query = VoiceTurn.query
+    if call_sid:
+        query = query.filter(VoiceTurn.call_sid == call_sid)
+    if intent:
+        query = query.filter(VoiceTurn.intent == intent)
+    if hit is not None:
+        query = query.filter(VoiceTurn.hit.is_(hit))
+    return [_turn_dict(t) for t in query.order_by(VoiceTurn.id.desc()).limit(limit)]
@@ -0,0 +1,294 @@
+import os
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+from models import Truth
+from truth_store import add_truth
+from reranker import rerank, candidate_budget
+from voice_analytics import record_turn
+from conversation_memory import get_session, remember_turn
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Threads answering questions speculatively from partial speech results
+SPEECH_PREFETCH_WORKERS = int(os.environ.get('SPEECH_PREFETCH_WORKERS', '4'))
+# Speculative answers not claimed by a final result within this time are dropped
+SPEECH_PREFETCH_TTL_SECONDS = float(os.environ.get('SPEECH_PREFETCH_TTL_SECONDS', '60'))
+
+DEFAULT_RESPONSE = "Thank you for your contribution to Zion's knowledge."
+
+_QUESTION_PHRASES = [
+    "tell me about", "information on", "information about", "i need information",
+    "i want information", "i need to know", "i want to know", "i would like to know",
+    "would like to know", "can you tell me"
+]
+
+_FILLER_PHRASES = [
+    "?", "what is", "what are", "tell me about", "tell us about",
+    "information on", "information about", "how does", "how do",
+    "why is", "why are", "i need information about",
+    "i need information on", "i want information about", "i want information on",
+    "i need to know about", "i want to know about",
+    "can you tell me about ", "can you tell me about",
+    "i need", "i want", "can you tell me", "can you", "could you tell me", "could you",
+    "i would like to know", "would like to know", "what does it mean to", "what does it mean by",
+    "what does it mean", "what do you know about"
+]
+
+_KEY_TOPICS = [
+    "faith", "revelation", "truth", "scripture", "prophecy",
+    "gospel", "holy spirit", "jesus", "christ", "salvation",
+    "repentance", "baptism", "endurance", "enduring", "covenant",
+    "elements of repentance", "pattern of faith", "alma 32",
+    "baptismal covenant", "holy ghost", "gift of the holy ghost"
+]
+
+_CONCEPT_SEARCHES = {
+    "pattern of faith": "pattern of faith in alma 32",
+    "elements of repentance": "five elements of repentance",
+    "baptismal covenant": "baptismal covenant",
+    "holy ghost": "holy ghost is not just a comforter",
+    "gift of the holy ghost": "gift of the holy ghost",
+    "enduring to the end": "enduring to the end",
+    "gospel system": "gospel system",
+}
+
+# Asking for more on whatever the previous question was about
+_FOLLOW_UP_PHRASES = [
+    "tell me more", "say more", "what else", "go on", "more about that", "more about it",
+    "explain that", "explain it", "anything else"
+]
+_follow_up_pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, _FOLLOW_UP_PHRASES)) + r")\b")
+# Words that can come with a follow-up phrase without naming a new topic
+_FOLLOW_UP_WORDS = set(' '.join(_FOLLOW_UP_PHRASES).split()) | {
+    "a", "and", "bit", "can", "could", "is", "little", "now", "oh", "ok", "okay", "please",
+    "so", "some", "that's", "there", "this", "us", "well", "would", "yeah", "yes", "you"
+}
+
+_punctuation = re.compile(r"[^\w\s']")
+
+# Speculative answers by call SID: (normalized text, future, submitted at)
+_prefetch_executor = ThreadPoolExecutor(max_workers=SPEECH_PREFETCH_WORKERS, thread_name_prefix="speech-prefetch")
+_prefetched = {}
+_prefetch_lock = threading.Lock()
+
+def is_store_intent(transcript):
+    lowered = transcript.lower()
+    return "store this truth" in lowered or "remember this" in lowered
+
+def is_question(transcript):
+    lowered = transcript.lower()
+    return ("?" in transcript or
+            lowered.startswith(("what", "how", "why", "tell me about", "tell us about")) or
+            any(phrase in lowered for phrase in _QUESTION_PHRASES))
+
+def is_follow_up(transcript):
+    """Whether the caller only asked for more on the last question, without naming a new topic"""
+    normalized = normalize_speech(transcript)
+    return (_follow_up_pattern.search(normalized) is not None
+            and all(word in _FOLLOW_UP_WORDS for word in normalized.split()))
+
+def classify_intent(transcript):
+    """Name what a caller wanted: store, question, statement, or none when nothing was heard"""
+    if not transcript or not transcript.strip():
+        return "none"
+    if is_store_intent(transcript):
+        return "store"
+    if is_question(transcript):
+        return "question"
+    return "statement"
+
+def extract_truth_content(transcript):
+    """Return the truth a caller asked to store, without the command phrase"""
+    lowered = transcript.lower()
+    for marker in ["store this truth:", "store this truth", "remember this"]:
+        position = lowered.find(marker)
+        if position >= 0:
+            logger.info(f"Found '{marker}'")
+            return lowered[position + len(marker):].strip()
+    logger.warning("Using full transcript as truth content")
+    return transcript
+
+def store_spoken_truth(transcript, caller_number):
+    """Store the truth in a store request and return what to say back"""
+    truth_content = extract_truth_content(transcript)
+    logger.info(f"Extracted truth content: '{truth_content}'")
+    try:
+        add_truth({
+            'content': truth_content,
+            'source': f"Voice call from {caller_number}"
+        })
+        logger.info(f"Added truth from rule-based extraction: {truth_content}")
+        return f"I've stored the truth: '{truth_content}'. Thank you for contributing to Zion's knowledge."
+    except Exception as truth_error:
+        logger.error(f"Error adding truth: {truth_error}")
+        return "I encountered an error storing your truth. Please try again later."
+
+def search_terms_for(transcript):
+    """Reduce a spoken question to the terms to search for"""
+    search_terms = transcript.lower()
+    for phrase in _FILLER_PHRASES:
+        search_terms = search_terms.replace(phrase, "")
+    # Speech recognition ends sentences with punctuation the truths will not match
+    search_terms = ' '.join(search_terms.split()).strip(" .,!")
+    search_terms_lower = search_terms.lower()
+
+    # Special handling for spirit vs Holy Spirit
+    if "spirit" in search_terms_lower and "holy spirit" not in search_terms_lower:
+        if "walk by" in search_terms_lower or "led by" in search_terms_lower:
+            search_terms = "holy spirit"
+            logger.info("Search term contains 'spirit', refined to 'holy spirit'")
+
+    # Special handling for endurance/enduring variations
+    if "endure to the end" in search_terms_lower:
+        search_terms = "enduring to the end"
+    elif "endurance test" in search_terms_lower:
+        search_terms = "endurance is the test"
+    elif "endurance" in search_terms_lower and "consecration" in search_terms_lower:
+        search_terms = "endurance is consecration"
+    elif "endure" in search_terms_lower and "endurance" not in search_terms_lower:
+        search_terms = "endurance"
+
+    # If the search term has multiple words, focus on the most specific key topic
+    if len(search_terms.split()) > 3:
+        multi_word = [t for t in _KEY_TOPICS if " " in t and t in search_terms_lower]
+        single_word = [t for t in _KEY_TOPICS if " " not in t and t in search_terms_lower]
+        if multi_word or single_word:
+            search_terms = (multi_word or single_word)[0]
+            logger.info(f"Refined search to key topic: {search_terms}")
+    return search_terms
+
+def search_answer(transcript, search_terms=None, already_said=None):
+    """Answer a spoken question; returns (reply, search terms, hit)
+
+    hit is False when no truth matched and None when the search failed, in
+    which case the reply is None too. already_said(reply) skips answers the
+    caller has heard earlier in the call.
+    """
+    search_terms = search_terms or search_terms_for(transcript)
+    try:
+        logger.info(f"Searching for: '{search_terms}'")
+
+        concept_search_term = None
+        for concept, search_phrase in _CONCEPT_SEARCHES.items():
+            if concept in search_terms.lower():
+                concept_search_term = search_phrase
+                logger.info(f"Using specialized concept search: '{concept_search_term}' for '{search_terms}'")
+                break
+
+        # Fetch as many candidates as the reranker's latency budget allows
+        candidates = candidate_budget(1)
+        results = []
+        if concept_search_term:
+            results = Truth.query.filter(Truth.content.ilike(f'%{concept_search_term}%')).limit(candidates).all()
+        if not results:
+            results = Truth.query.filter(Truth.content.ilike(f'%{search_terms}%')).limit(candidates).all()
+
+        # Score candidates against the caller's full question
+        ranked = rerank(transcript, results, 3 if already_said else 1)
+        for truth in ranked:
+            truth_content = truth.content
+            if truth_content.startswith(":"):
+                truth_content = truth_content[1:].strip()
+            reply = f"Based on what I know: {truth_content}"
+            if already_said and already_said(reply):
+                continue
+            logger.info(f"Found truth: {truth_content}")
+            return reply, search_terms, True
+        if ranked:
+            return f"That is everything I know about {search_terms} so far.", search_terms, False
+        logger.info(f"No truths found for '{search_terms}'")
+        return (f"I don't have specific information about {search_terms} yet. You can contribute this "
+                f"truth by saying 'Store this truth: ' followed by what you know."), search_terms, False
+    except Exception as search_error:
+        logger.error(f"Error searching truths: {search_error}")
+        return None, search_terms, None
+
+def answer_question(transcript):
+    """Find the truth that best answers a spoken question and return what to say back"""
+    return search_answer(transcript)[0]
+
+def _answer(transcript, caller_number, response):
+    """Run the rule-based pipeline; returns (reply, intent, search terms, hit)"""
+    intent = classify_intent(transcript)
+    if intent == "store":
+        return store_spoken_truth(transcript, caller_number), intent, None, None
+    if intent == "question":
+        reply, search_terms, hit = search_answer(transcript)
+        return reply or response, intent, search_terms, hit
+    return response, intent, None, None
+
+def answer_transcript(transcript, caller_number, response=DEFAULT_RESPONSE):
+    """Run the rule-based pipeline on what a caller said; returns the reply to speak"""
+    return _answer(transcript, caller_number, response)[0]
+
+def answer_turn(call_sid, transcript, caller_number, channel, response=DEFAULT_RESPONSE, prefetch_wait=0):
+    """Answer one caller turn, record it for voice analytics and add it to the call's memory
+
+    Returns the reply to speak. With prefetch_wait, an answer already started
+    from partial speech for the same words is used if it is ready within that
+    many seconds.
+    """
+    started = time.perf_counter()
+    session = get_session(call_sid) if call_sid else None
+    prefetched = _claim_prefetched(call_sid, transcript, prefetch_wait) if prefetch_wait else None
+    if prefetched and prefetched[0] is not None:
+        reply, search_terms, hit = prefetched
+        intent = "question"
+    elif session and session.last_search_terms and is_follow_up(transcript):
+        # "Tell me more": search the previous question again for something not said yet
+        prefetched = None
+        reply, search_terms, hit = search_answer(session.last_search_terms, session.last_search_terms,
+                                                 already_said=session.has_said)
+        reply, intent = reply or response, "question"
+    else:
+        prefetched = None
+        reply, intent, search_terms, hit = _answer(transcript, caller_number, response)
+    record_turn(call_sid, channel, intent, search_terms, hit,
+                (time.perf_counter() - started) * 1000, prefetched=prefetched is not None)
+    remember_turn(call_sid, transcript, reply, intent, search_terms)
+    return reply
+
+def normalize_speech(text):
+    """Normalize recognized speech so partial and final results compare equal"""
+    return ' '.join(_punctuation.sub(' ', text.lower()).split())
+
+def _answer_in_context(transcript):
+    with app.app_context():
+        return search_answer(transcript)
+
+def prefetch_answer(call_sid, partial_text):
+    """Start answering a partial speech result while the caller is still talking
+
+    Only questions are answered speculatively, since they have no side effects.
+    A final result with the same words picks up the answer instead of
+    searching again.
+    """
+    if not call_sid or not partial_text or is_store_intent(partial_text) or not is_question(partial_text):
+        return False
+    key = normalize_speech(partial_text)
+    now = time.monotonic()
+    with _prefetch_lock:
+        for sid in [s for s, (_, _, at) in _prefetched.items() if now - at > SPEECH_PREFETCH_TTL_SECONDS]:
+            del _prefetched[sid]
+        current = _prefetched.get(call_sid)
+        if current and current[0] == key:
+            return False
+        _prefetched[call_sid] = (key, _prefetch_executor.submit(_answer_in_context, partial_text), now)
+    return True
+
+def _claim_prefetched(call_sid, transcript, timeout):
+    """Return the speculative (reply, search terms, hit) for this exact utterance, or None"""
+    with _prefetch_lock:
+        entry = _prefetched.pop(call_sid, None)
+    if not entry or entry[0] != normalize_speech(transcript):
+        return None
+    try:
+        return entry[1].result(timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Speculative answer for {call_sid} unavailable: {e}")
+        return None
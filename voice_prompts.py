@@ -0,0 +1,179 @@
+import os
+import time
+import wave
+import hashlib
+import logging
+import threading
+from xml.sax.saxutils import escape
+import numpy as np
+from twilio.twiml.voice_response import VoiceResponse
+from text_to_speech import resample, synthesize, is_available as tts_available
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+VOICE = "Polly.Matthew"
+
+# Play pre-rendered recordings of the fixed prompts instead of <Say> when they exist
+VOICE_PROMPT_AUDIO = os.environ.get('VOICE_PROMPT_AUDIO', 'true').lower() == 'true'
+PROMPT_AUDIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'audio', 'prompts')
+PROMPT_AUDIO_URL = '/static/audio/prompts'
+PROMPT_SAMPLE_RATE = 8000
+# How often a worker checks whether the prompt recordings or prompt settings
+# changed, e.g. recordings rendered by a deploy step while it is running
+VOICE_PROMPT_CHECK_SECONDS = float(os.environ.get('VOICE_PROMPT_CHECK_SECONDS', '5'))
+
+# Fixed prompts spoken by the voice webhooks
+PROMPTS = {
+    "welcome": "Welcome to Zion's Steward. I am here to help you store and retrieve truths.",
+    "instructions": "You may ask me to store a truth, retrieve information on a topic, or ask general questions.",
+    "speak_after_tone": "Please speak after the tone.",
+    "assist_again": "How else may I assist you today?",
+    "listening": "Go ahead, I'm listening.",
+    "not_caught": "I didn't catch that. Please say it again.",
+    "goodbye": "Thank you for calling Zion's Steward. Goodbye.",
+    "turn_error": "I encountered an error processing your question. Please try again.",
+}
+
+_prompt_names = {text: name for name, text in PROMPTS.items()}
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+# Rendered TwiML fragments by key, valid while the prompt signature is unchanged.
+# Reentrant because some fragments are built from other cached fragments
+_fragments = {}
+_fragments_lock = threading.RLock()
+_fragments_signature = None
+_fragments_checked = 0.0
+
+# Decoded prompt recordings by (path, sample rate), for the media stream server
+_recordings = {}
+
+def _audio_filename(name):
+    # The text is part of the name, so editing a prompt renders it again
+    digest = hashlib.sha1(f"{PROMPTS[name]}|{os.environ.get('TTS_PIPER_MODEL', '')}".encode('utf-8')).hexdigest()
+    return f"{name}-{digest[:12]}.wav"
+
+def render_prompt_audio(force=False):
+    """Synthesize every fixed prompt to a WAV under static/; returns the names rendered"""
+    if not tts_available():
+        logger.warning("No speech synthesis voice configured; prompts stay as <Say>")
+        return []
+    os.makedirs(PROMPT_AUDIO_DIR, exist_ok=True)
+    rendered = []
+    for name, text in PROMPTS.items():
+        path = os.path.join(PROMPT_AUDIO_DIR, _audio_filename(name))
+        if os.path.exists(path) and not force:
+            continue
+        samples = synthesize(text, PROMPT_SAMPLE_RATE)
+        tmp_path = f"{path}.tmp"
+        with wave.open(tmp_path, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(PROMPT_SAMPLE_RATE)
+            wav.writeframes(samples.tobytes())
+        os.replace(tmp_path, path)
+        rendered.append(name)
+    with _fragments_lock:
+        _fragments.clear()
+    _recordings.clear()
+    logger.info(f"Rendered {len(rendered)} prompt recordings")
+    return rendered
+
+def say(text):
+    """TwiML for speaking dynamic text"""
+    return f'<Say voice="{VOICE}">{escape(text)}</Say>'
+
+def _render_prompt(name):
+    if VOICE_PROMPT_AUDIO:
+        filename = _audio_filename(name)
+        if os.path.exists(os.path.join(PROMPT_AUDIO_DIR, filename)):
+            return f'<Play>{PROMPT_AUDIO_URL}/{filename}</Play>'
+    return say(PROMPTS[name])
+
+def recorded_prompt(text, sample_rate):
+    """Int16 samples of the rendered recording of a fixed prompt's text; None if there is none"""
+    name = _prompt_names.get(text.strip())
+    if name is None or not VOICE_PROMPT_AUDIO:
+        return None
+    _check_fragments()
+    path = os.path.join(PROMPT_AUDIO_DIR, _audio_filename(name))
+    samples = _recordings.get((path, sample_rate))
+    if samples is None:
+        if not os.path.exists(path):
+            return None
+        with wave.open(path, 'rb') as wav:
+            rate = wav.getframerate()
+            raw = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        samples = resample(raw.astype(np.float32), rate, sample_rate).astype(np.int16)
+        _recordings[(path, sample_rate)] = samples
+    return samples
+
+def _prompt_signature():
+    """What the rendered prompts depend on besides their text: settings and the recordings on disk"""
+    try:
+        # Rendering replaces files in the directory, which moves its mtime
+        recordings = os.stat(PROMPT_AUDIO_DIR).st_mtime_ns
+    except FileNotFoundError:
+        recordings = None
+    return VOICE, VOICE_PROMPT_AUDIO, os.environ.get('TTS_PIPER_MODEL', ''), recordings
+
+def _check_fragments():
+    """Drop cached fragments and recordings if the prompt signature changed, at most once per check interval"""
+    global _fragments_signature, _fragments_checked
+
+    if time.monotonic() - _fragments_checked < VOICE_PROMPT_CHECK_SECONDS:
+        return
+    with _fragments_lock:
+        _fragments_checked = time.monotonic()
+        signature = _prompt_signature()
+        if signature != _fragments_signature:
+            _fragments.clear()
+            _recordings.clear()
+            _fragments_signature = signature
+
+def cached_fragment(key, build):
+    """Return the fragment cached under key, building it on first use"""
+    _check_fragments()
+    fragment = _fragments.get(key)
+    if fragment is None:
+        with _fragments_lock:
+            fragment = _fragments.get(key)
+            if fragment is None:
+                fragment = _fragments[key] = build()
+    return fragment
+
+def prompt(name):
+    """TwiML for a fixed prompt: <Play> of its recording if rendered, else <Say>"""
+    return cached_fragment(("prompt", name), lambda: _render_prompt(name))
+
+def render_verbs(build_verbs):
+    """TwiML for the verbs build_verbs(resp) adds to an empty VoiceResponse"""
+    resp = VoiceResponse()
+    build_verbs(resp)
+    xml = str(resp)
+    return xml[xml.index('<Response>') + len('<Response>'):xml.rindex('</Response>')]
+
+def verb(key, build_verbs):
+    """Cached TwiML for static verbs, rendered once and then reused as a string"""
+    return cached_fragment(("verb", key), lambda: render_verbs(build_verbs))
+
+def pause(length):
+    return cached_fragment(("pause", length), lambda: f'<Pause length="{length}" />')
+
+def document(*fragments):
+    """Join TwiML fragments into a response document"""
+    return f"{XML_DECLARATION}<Response>{''.join(fragments)}</Response>"
+
+def prompt_stats():
+    """Return which prompts are played from recordings and how many fragments are cached"""
+    return {
+        "audio_enabled": VOICE_PROMPT_AUDIO,
+        "recorded": sorted(name for name in PROMPTS if prompt(name).startswith('<Play>')),
+        "cached_fragments": len(_fragments),
+    }
+
+# Renders the prompt recordings ahead of deployment: python voice_prompts.py
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(render_prompt_audio(force=True))